@@ -0,0 +1,233 @@
+'''Benchmark suite
+
+Runs the missions that come with glidersim in a synthetic environment
+(see synthetic.py), so that no bathymetry or model files are required,
+and reports for each case:
+
+* steps_per_second : simulated time steps per wall second (member steps for ensembles)
+* speed : simulated seconds per wall second
+* peak_rss : peak resident set size of the process (bytes)
+* output_bytes : size of the NetCDF output file
+* phases : wall time per phase of the simulation (single runs only, see glidersim.profiling)
+
+Each case runs in a fresh process with fixed random seeds, so that the
+peak memory use of one case does not affect the next, and the
+simulations are the same for each run.
+
+Usage
+-----
+
+python run_benchmarks.py short -o results.json
+python run_benchmarks.py short --baseline baselines/short.json
+python run_benchmarks.py long ensemble --save-baseline
+
+With --baseline, the results are compared with a stored baseline and
+the exit status is 1 if any case is slower, or uses more memory or
+disk space, than the baseline by more than the tolerance.
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+sys.path.insert(0, here)
+
+import glidersim
+import glidersim.configuration
+import glidersim.ensemble
+import glidersim.glidermodels
+import glidersim.glidersim
+
+from synthetic import SyntheticEnvironment
+
+DATA = os.path.join(os.path.dirname(here), 'data')
+BASELINES = os.path.join(here, 'baselines')
+
+# mission, mission directory, use glider directory structure, date, time, latitude and longitude (NMEA)
+MISSIONS = dict(spiral=('spiral.mi', os.path.join(DATA, 'comet', 'spiral'), True,
+                        '20190809', '15:20', 5440.1099, 646.5619),
+                nsb3=('nsb3.mi', os.path.join(DATA, 'comet', 'nsb3'), True,
+                      '20190809', '15:20', 5440.1099, 646.5619),
+                helgo=('helgo.mi', os.path.join(os.path.dirname(here), 'calibration'), False,
+                       '20110212', '16:06', 5432.496, 725.716))
+
+# suite -> list of (case name, mission, simulated hours, number of ensemble members or None)
+# helgo.mi completes after about 36 minutes, and is run in the short suite only.
+SUITES = dict(short=[('spiral_short', 'spiral', 2, None),
+                     ('nsb3_short', 'nsb3', 2, None),
+                     ('helgo_short', 'helgo', 2, None)],
+              long=[('spiral_long', 'spiral', 24, None),
+                    ('nsb3_long', 'nsb3', 24, None)],
+              ensemble=[('spiral_ensemble', 'spiral', 1, 20),
+                        ('nsb3_ensemble', 'nsb3', 1, 20)])
+
+DT = 0.5
+CPU_CYCLE = 4
+SEED = 1
+TOLERANCE = 0.15 # relative change that counts as a regression
+
+
+def create_glider_model():
+    glider_model = glidersim.glidermodels.Shallow100mGliderModel()
+    glider_model.initialise_gliderflightmodel(Cd0=0.20, mg=73.3, Vg=71.542e-3, T1=2052, T2=-35.5, T3=0.36)
+    return glider_model
+
+
+def create_config(mission, output):
+    mission_name, mission_directory, _, datestr, timestr, lat, lon = MISSIONS[mission]
+    return glidersim.configuration.Config(mission_name,
+                                          description="benchmark",
+                                          datestr=datestr,
+                                          timestr=timestr,
+                                          lat_ini=lat,
+                                          lon_ini=lon,
+                                          mission_directory=mission_directory,
+                                          output=output,
+                                          storePeriod=1,
+                                          seed=SEED,
+                                          sensor_settings={'u_use_current_correction':0},
+                                          special_settings={'glider.gps.acquiretime':100.,
+                                                            'mission_initialisation_time':400,
+                                                            'initial_heading':0})
+
+
+def peak_rss():
+    ''' Returns the peak resident set size of this process in bytes'''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss*1024
+
+
+def run_case(mission, hours, n_members=None):
+    ''' Runs a single benchmark case and returns its results as a dictionary'''
+    use_glider_directory_structure = MISSIONS[mission][2]
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, 'benchmark.nc')
+        config = create_config(mission, output)
+        if n_members is None:
+            GM = glidersim.glidersim.GliderMission(config, glider_model=create_glider_model(),
+                                                   environment_model=SyntheticEnvironment(), verbose=False)
+            GM.enable_profiling()
+        else:
+            GM = glidersim.ensemble.EnsembleMission(config, create_glider_model(), n_members,
+                                                    environment_model=SyntheticEnvironment())
+        GM.loadmission(verbose=False, use_glider_directory_structure=use_glider_directory_structure)
+        t0 = time.perf_counter()
+        GM.run(dt=DT, CPUcycle=CPU_CYCLE, maxSimulationTime=hours/24.)
+        wall_time = time.perf_counter() - t0
+        GM.save(output)
+        output_bytes = os.path.getsize(output)
+        t = GM.get('m_present_time')
+    simulated_time = float(np.max(t) - np.min(t))
+    steps = simulated_time/DT * (n_members or 1)
+    result = dict(mission=mission, hours=hours, members=n_members,
+                  wall_time=wall_time,
+                  simulated_time=simulated_time,
+                  steps_per_second=steps/wall_time,
+                  speed=simulated_time/wall_time,
+                  peak_rss=peak_rss(),
+                  output_bytes=output_bytes)
+    if n_members is None:
+        report = GM.profile_report()
+        result['phases'] = dict((k, v['time']) for k, v in report['phases'].items())
+    return result
+
+
+def _run_case_in_process(connection, *p):
+    try:
+        connection.send(run_case(*p))
+    except Exception as e:
+        connection.send(e)
+    finally:
+        connection.close()
+
+
+def run_isolated(mission, hours, n_members=None):
+    ''' Runs a benchmark case in a new process'''
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_run_case_in_process, args=(sender, mission, hours, n_members))
+    process.start()
+    sender.close()
+    result = receiver.recv()
+    process.join()
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def run_suite(suite):
+    results = {}
+    for name, mission, hours, n_members in SUITES[suite]:
+        print(f"Running {name}...", flush=True)
+        results[name] = r = run_isolated(mission, hours, n_members)
+        print(f"    {r['steps_per_second']:10.0f} steps/s  {r['peak_rss']/2**20:7.1f} MiB  "
+              f"{r['output_bytes']/2**10:9.1f} KiB", flush=True)
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    ''' Compares results with a baseline
+
+    Returns
+    -------
+    list of str
+        descriptions of the regressions found
+    '''
+    regressions = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if b is None:
+            continue
+        if r['steps_per_second'] < b['steps_per_second']*(1-tolerance):
+            regressions.append(f"{name}: {r['steps_per_second']:.0f} steps/s (baseline {b['steps_per_second']:.0f})")
+        for k in ('peak_rss', 'output_bytes'):
+            if r[k] > b[k]*(1+tolerance):
+                regressions.append(f"{name}: {k} {r[k]} (baseline {b[k]})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the glidersim benchmark suite.")
+    parser.add_argument('suites', nargs='*', default=['short'], choices=list(SUITES),
+                        help="suites to run (default: short)")
+    parser.add_argument('-o', '--output', help="write results to this JSON file")
+    parser.add_argument('--baseline', help="compare with this JSON file (default: none)")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="write the results of each suite to baselines/<suite>.json")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help=f"relative change that counts as a regression (default: {TOLERANCE})")
+    args = parser.parse_args()
+    results = dict(python=platform.python_version(),
+                   machine=platform.machine(),
+                   glidersim=glidersim.__version__,
+                   suites={})
+    regressions = []
+    for suite in args.suites:
+        results['suites'][suite] = r = run_suite(suite)
+        if args.save_baseline:
+            with open(os.path.join(BASELINES, f"{suite}.json"), 'w') as fp:
+                json.dump(r, fp, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        for r in results['suites'].values():
+            regressions += compare(r, baseline, args.tolerance)
+        for s in regressions:
+            print(f"REGRESSION {s}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
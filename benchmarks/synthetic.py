@@ -0,0 +1,49 @@
+'''Synthetic environment for benchmarks
+
+An environment model that needs no data files: the bathymetry,
+tidal currents and stratification are analytical functions of time
+and position. It implements the get_data() method of the environment
+models in glidersim.environments.
+'''
+import numpy as np
+
+
+class SyntheticEnvironment(object):
+    ''' Analytical environment model
+
+    Parameters
+    ----------
+    water_depth : float
+        mean water depth (m)
+    slope : float
+        amplitude (m) of the bathymetry variation
+    tidal_amplitude : float
+        amplitude (m/s) of the eastward tidal current. The northward component is half of it.
+    mixed_layer_depth : float
+        depth scale (m) of the thermocline
+    '''
+    M2 = 44714.16 # period of the M2 tide (s)
+    LENGTH_SCALE = 0.05 # wavelength (degrees) of the bathymetry variations
+
+    def __init__(self, water_depth=60., slope=5., tidal_amplitude=0.3, mixed_layer_depth=15.):
+        self.water_depth = water_depth
+        self.slope = slope
+        self.tidal_amplitude = tidal_amplitude
+        self.mixed_layer_depth = mixed_layer_depth
+
+    def get_water_depth(self, lat, lon):
+        k = 2*np.pi/self.LENGTH_SCALE
+        return self.water_depth + self.slope*np.sin(k*lat)*np.cos(k*lon)
+
+    def get_data(self, t, lat, lon, z):
+        ''' Returns u, v, w, water_depth, eta, S, T, rho for position lat, lon (decimal) and depth z (<0)'''
+        phase = 2*np.pi*t/self.M2
+        u = self.tidal_amplitude*np.cos(phase)
+        v = 0.5*self.tidal_amplitude*np.sin(phase)
+        eta = 1.5*np.cos(phase)
+        water_depth = self.get_water_depth(lat, lon)
+        f = np.exp(np.minimum(z, 0)/self.mixed_layer_depth)
+        T = 8. + 8.*f
+        S = 33. - 1.*f
+        rho = 1000. + 0.78*S - 0.17*(T-10) + 0.0045*(-z)
+        return u, v, 0, water_depth, eta, S, T, rho
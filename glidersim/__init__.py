@@ -1,14 +1,24 @@
 __all__=['glidersim',
          'environments',
+         'ensemble',
+         'sweep',
          'behaviors',
          'configuration.py',
          'datastore.py',
+         'dbdcache.py',
+         'equilibrium.py',
          'fsm.py',
          'getm_nc.py',
          'glidermodels.py',
+         'gliderstate.py',
          'timeseries.py,'
          'getm.py',
-         'parser.py']
+         'parser.py',
+         'planning.py',
+         'profiling.py',
+         'projection.py',
+         'tilestore.py',
+         'tracing.py']
 
 from . import glidersim
 from ._version import __version__
@@ -1,13 +1,15 @@
-from math import sqrt,pi,sin,cos
-from functools import reduce
+from math import sqrt,pi,sin,cos,inf
+import operator
 from collections import UserList, OrderedDict
 
 import arrow
 
 import latlon
 
-from .fsm import FSM
+from .fsm import FSM, ExceptionFSM
+from .gliderstate import GliderState, CLOCKS
 from . import common
+from . import tracing
 
 logger = common.get_logger("behaviors")
 
@@ -72,7 +74,20 @@ class Condition(object):
 
         The class defines a method check() that returns True or False, depending on
         whether the current value of the parameter matches the condition or not.
+
+        The comparisons are compiled into (parameter, function, value) tuples when
+        the condition is constructed. A comparison of which the value is outside
+        the value range is always False.
+
+        If the glider state is a GliderState, the condition watches its input
+        parameters, and is only evaluated again when any of them changed. A
+        comparison clock>value on a clock (see gliderstate.CLOCKS) is not
+        watched, but sets a wake-up time at which the condition is evaluated
+        again.
     '''
+    COMPARISONS={'>':operator.gt, '==':operator.eq, '<':operator.lt, '!=':operator.ne}
+    WAKE_MARGIN=1. # s, margin on the wake-up time for round-off in the clocks.
+    
     def __init__(self,parameter,operator,value,valuerange=(None,None),*args):
         self.parameter=[parameter]
         self.operator=[operator]
@@ -97,9 +112,51 @@ class Condition(object):
                 vr[1]=1e12
             self.valuerange[i]=vr
         for i in self.operator:
-            if i not in ['>','==','<','!=']:
+            if i not in self.COMPARISONS:
                 raise ValueError('Unknown comparison operator')
         #print "%s %s %s"%(parameter,operator,value)
+        self.compile()
+
+    def compile(self):
+        ''' Compiles the comparisons into a list of (parameter, function, value) tuples'''
+        self._comparisons=[]
+        for p,v,vr,o in zip(self.parameter,self.value,self.valuerange,self.operator):
+            if vr[0]<=v<=vr[1]:
+                self._comparisons.append((p,self.COMPARISONS[o],v))
+            else:
+                self._comparisons.append((p,self.never,v))
+        # comparisons that become True as time advances, and stay True until the clock is reset.
+        self._timed=[(p,v) for p,f,v in self._comparisons if p in CLOCKS and f is operator.gt]
+        self._gs=None
+        self._tracking=False
+        self._result=None
+        self._wake=-inf
+        self.changed=True
+
+    @property
+    def inputs(self):
+        ''' the parameters this condition depends on (comparisons that are always False excluded)'''
+        return list(OrderedDict.fromkeys(p for p,f,v in self._comparisons if f is not self.never))
+
+    def watch(self,gs):
+        ''' Registers the input parameters of this condition with the glider state gs'''
+        self._gs=gs
+        self._tracking=isinstance(gs,GliderState)
+        self.changed=True
+        if self._tracking:
+            timed=set(p for p,v in self._timed)
+            for p in self.inputs:
+                gs.watch(p,self,increments=p not in timed)
+
+    def __getstate__(self):
+        # the glider state does not keep its watchers when pickled.
+        state=self.__dict__.copy()
+        state.update(_gs=None,_tracking=False,changed=True)
+        return state
+
+    @staticmethod
+    def never(x,value):
+        return False
 
     def addCondition(self,parameter,operator,value,valuerange=(None,None)):
         self.parameter.append(parameter)
@@ -109,29 +166,71 @@ class Condition(object):
         self.check_input()
 
     def check_param(self,gs,parameter,value,valuerange,operator):
-        #if parameter == 'time_since_cycle_end':
-        #    print(f"Check param {parameter}, {value}, {valuerange}, {operator} Actual value: {gs[parameter]}", end='')
-        #    print()
-        #    input()
-            
         if parameter not in gs:
             raise ValueError("glider status has not required parameter")
-        if (value<=valuerange[1] and value>=valuerange[0]) or \
-                value==None:
-            r=eval("%s%s%s"%(gs[parameter],operator,value))
+        if value<=valuerange[1] and value>=valuerange[0]:
+            r=self.COMPARISONS[operator](gs[parameter],value)
         else:
             r=False
-        #print(f" Result: {r}")
         return r
+    
     def check_params(self,gs):
-        rs=[]
-        for p,v,vr,o in zip(self.parameter,self.value,self.valuerange,self.operator):
-            rs.append(self.check_param(gs,p,v,vr,o))
-        return rs
+        try:
+            return [f(gs[p],v) for p,f,v in self._comparisons]
+        except KeyError:
+            raise ValueError("glider status has not required parameter")
 
     def check(self,gs):
-        c=self.check_params(gs)
-        return reduce(lambda x,y: x or y,c)
+        if gs is not self._gs:
+            self.watch(gs)
+        if self.changed or gs['m_present_time']>=self._wake:
+            try:
+                self._result=self.evaluate(gs)
+            except KeyError:
+                raise ValueError("glider status has not required parameter")
+            if self._tracking:
+                self.changed=False
+                self._wake=self.wake_time(gs)
+        return self._result
+
+    def evaluate(self,gs):
+        # True if any of the comparisons is True
+        for p,f,v in self._comparisons:
+            if f(gs[p],v):
+                return True
+        return False
+
+    def wake_time(self,gs):
+        ''' Returns the time at which the first timed comparison that is False may become True'''
+        dt=inf
+        for p,v in self._timed:
+            x=gs[p]
+            if not x>v:
+                dt=min(dt,v-x)
+        return gs['m_present_time']+dt-self.WAKE_MARGIN
+
+    def surface_wake_time(self,gs,clocks,drifting):
+        ''' Returns the earliest time at which the condition may become True while
+            the glider floats at the surface (see Behavior.next_event_time())
+
+            clocks are the parameters that advance with the time, and drifting maps
+            the parameters that change otherwise to the earliest time at which they
+            may change. All other parameters are constant.
+        '''
+        t=gs['m_present_time']
+        if self.evaluate(gs):
+            return t
+        t_wake=inf
+        for p,f,v in self._comparisons:
+            if f is self.never:
+                continue
+            if p in clocks and f is operator.gt:
+                t_wake=min(t_wake,t+v-gs[p])
+            elif p in clocks:
+                return t
+            elif p in drifting:
+                t_wake=min(t_wake,drifting[p])
+        return t_wake
 
     # dummy methods: allow condition to be handles as Flag
     def set_True(self):
@@ -142,16 +241,17 @@ class Condition(object):
 class ConditionAnd(Condition):
     def __init__(self,parameter,operator,value,valuerange=(None,None),*args):
         Condition.__init__(self,parameter,operator,value,valuerange,*args)
-    def check(self,gs):
-        return reduce(lambda x,y: x and y,self.check_params(gs))
+    def evaluate(self,gs):
+        # True if all of the comparisons are True
+        for p,f,v in self._comparisons:
+            if not f(gs[p],v):
+                return False
+        return True
 
 class ConditionOr(Condition):
     def __init__(self,parameter,operator,value,valuerange=(None,None),*args):
         Condition.__init__(self,parameter,operator,value,valuerange,*args)
-    def check(self,gs):
-        return reduce(lambda x,y: x or y,self.check_params(gs))
         
-
 class Flag(object):
     def __init__(self,flag=True):
         self.flag=flag
@@ -161,6 +261,10 @@ class Flag(object):
         self.flag=False
     def check(self,*dmy):
         return self.flag
+    def surface_wake_time(self,gs,*dmy):
+        if self.flag:
+            return gs['m_present_time']
+        return inf
 
 class UTC_Condition(object):
     def __init__(self,timetuple):
@@ -185,6 +289,10 @@ class UTC_Condition(object):
         else:
             return False
 
+    def surface_wake_time(self,gs,*dmy):
+        # not predicted
+        return gs['m_present_time']
+
 class UniqueList(UserList):
     def __init__(self, initlist=None):
         super().__init__(initlist)
@@ -245,17 +353,67 @@ class Behavior(object):
 
     def process(self,gs):
         self.gliderState=gs
-        CLRS.r(self.behaviorName+" "+str(self.fsm.current_state))
-        CLRS.w("Checking conditions:")
+        if VERBOSE:
+            CLRS.r(self.behaviorName+" "+str(self.fsm.current_state))
+            CLRS.w("Checking conditions:")
         for arg,c in self.b_arg.items():
             if c.check(gs):
-                self.fsm.process(arg)
+                if tracing.TRACER is None:
+                    self.fsm.process(arg)
+                else:
+                    self.__process_traced(gs,arg)
+
+    def __process_traced(self,gs,arg):
+        t=gs['m_present_time']
+        state=self.fsm.current_state
+        tracing.TRACER.condition(t,self.behaviorName,arg)
+        self.fsm.process(arg)
+        if self.fsm.current_state!=state and tracing.TRACER is not None:
+            tracing.TRACER.transition(t,self.behaviorName,arg,state,self.fsm.current_state)
 
         #print("behaviors:process(): time:",  self.gliderState['m_present_time'])
         #input("\nPress return")
+
+    def next_event_time(self,gs,clocks,drifting):
+        ''' Returns the earliest time at which processing this behavior may have
+            an effect other than idle_cycle(), while the glider floats at the
+            surface with idle actuators
+
+            clocks and drifting are as for Condition.surface_wake_time(). A
+            transition that calls no action and stays in the current state has
+            no effect. A state that calls an action every cycle (polling) is
+            handled by _polled_event_time().
+        '''
+        t=gs['m_present_time']
+        state=self.fsm.current_state
+        t_event=inf
+        for arg,c in self.b_arg.items():
+            try:
+                action,next_state=self.fsm.get_transition(arg,state)
+            except ExceptionFSM:
+                return t
+            if action is None and next_state in (None,state):
+                continue
+            t_wake=c.surface_wake_time(gs,clocks,drifting)
+            if (arg,state) not in self.fsm.state_transitions and t_wake<=t:
+                t_wake=self._polled_event_time(gs,clocks,drifting)
+            t_event=min(t_event,t_wake)
+        return t_event
+
+    def _polled_event_time(self,gs,clocks,drifting):
+        # the action of the current state for any input is called every cycle;
+        # subclasses that know when it has an effect override this method.
+        return gs['m_present_time']
+
+    def idle_cycle(self,gs):
+        ''' Applies the effects of processing this behavior before its next event (see next_event_time())'''
+        pass
         
     def updateMS(self,ms):
+        previous=Behavior.MS
         Behavior.MS+= ~Behavior.MS&ms # x+=~x&2 add 2 if x&2 is 0, 0 otherwise.
+        if tracing.TRACER is not None and Behavior.MS!=previous:
+            tracing.TRACER.mission_status(self.gliderState['m_present_time'],previous,Behavior.MS)
         CLRS.b("Mission Status: %s"%(Behavior.MS))
 
     def printInfo(self):
@@ -542,7 +700,8 @@ class Surface(WhenBehavior):
 
     def WaitForGPS(self,fsm):
         self.b_arg['resume'].set_False()
-        CLRS.r(self.behaviorName+": "+fsm.current_state+"->"+fsm.next_state)
+        if VERBOSE:
+            CLRS.r(self.behaviorName+": "+fsm.current_state+"->"+fsm.next_state)
         currentTime=self.gliderState['m_present_time']
         self.gliderState['nocomms']=0.
         # reset hovering variables too
@@ -567,13 +726,15 @@ class Surface(WhenBehavior):
             else:
                 self.gliderState['m_water_vx']=-1.
                 self.gliderState['m_water_vy']=-1.
-        CLRS.w("Time at surface: %f"%(currentTime-self.surfacingTime))
-        CLRS.w("gps status: %f"%(self.gliderState['m_gps_status']))
+        if VERBOSE:
+            CLRS.w("Time at surface: %f"%(currentTime-self.surfacingTime))
+            CLRS.w("gps status: %f"%(self.gliderState['m_gps_status']))
 
         
     def WaitForUser(self,fsm):
         self.b_arg['resume'].set_False()
-        CLRS.r(self.behaviorName+": "+fsm.current_state+"->"+fsm.next_state)
+        if VERBOSE:
+            CLRS.r(self.behaviorName+": "+fsm.current_state+"->"+fsm.next_state)
         currentTime=self.gliderState['m_present_time']
         self.gliderState['nocomms']=0.
         # reset hovering variables too
@@ -590,11 +751,13 @@ class Surface(WhenBehavior):
                 self.gliderState['c_gps_on']=0 # switch off gps
         else: # end
             self.b_arg['resume'].set_True()
-        CLRS.w("Time at surface: %f"%(currentTime-self.surfacingTime))
+        if VERBOSE:
+            CLRS.w("Time at surface: %f"%(currentTime-self.surfacingTime))
 
     def WaitForFinalGPS(self,fsm):
         self.b_arg['resume'].set_False()
-        CLRS.r(self.behaviorName+": "+fsm.current_state+"->"+fsm.next_state)
+        if VERBOSE:
+            CLRS.r(self.behaviorName+": "+fsm.current_state+"->"+fsm.next_state)
         currentTime=self.gliderState['m_present_time']
         self.gliderState['nocomms']=0.
         # reset hovering variables too
@@ -618,6 +781,23 @@ class Surface(WhenBehavior):
     def getBusy(self,fsm):
         self.b_arg['resume'].set_False()
         self.__busytime=self.gliderState['m_present_time']
+
+    def _polled_event_time(self,gs,clocks,drifting):
+        state=self.fsm.current_state
+        if state in ('WaitForGPS','WaitForFinalGPS') and gs['m_gps_status']!=0:
+            return self.surfacingTime+self.gps_wait_time
+        elif state=='WaitForUser' and self.end_action==1:
+            return self.surfacingTime+max(self.datatransfertime,self.keystroke_wait_time)
+        elif state=='Busy':
+            return self.__busytime+gs['_init_dive_time']
+        return gs['m_present_time']
+
+    def idle_cycle(self,gs):
+        if self.fsm.current_state in ('WaitForGPS','WaitForUser','WaitForFinalGPS'):
+            gs['nocomms']=0.
+            gs['hover_for']=0.
+            gs['stalled_for']=0.
+            gs['samedepth_for']=0.
     
     def beBusy(self,fsm):
         # keep my self busy until init_dive_time is exceeded.
@@ -861,7 +1041,8 @@ class Yo(WhenBehavior):
         self.gliderState['samedepth_for']=0.
     
     def SubState(self,fsm):
-        CLRS.g(self.behaviorName+": "+fsm.current_state+"->"+fsm.next_state)
+        if VERBOSE:
+            CLRS.g(self.behaviorName+": "+fsm.current_state+"->"+fsm.next_state)
         substate=self.substates[self.current_profile%2]
         substate.process(self.gliderState)
         if substate.fsm.current_state=='Complete':
@@ -878,10 +1059,21 @@ class Yo(WhenBehavior):
                 substate=self.substates[self.current_profile%2]
                 substate.b_arg['start_when'].set_True()
         else:
-            CLRS.b("Current profile: %0d"%(self.current_profile))
+            if VERBOSE:
+                CLRS.b("Current profile: %0d"%(self.current_profile))
             # pass memory on
             fsm.memory=list(substate.fsm.memory)
 
+    def _polled_event_time(self,gs,clocks,drifting):
+        substate=self.substates[self.current_profile%2]
+        if substate.fsm.current_state=='Complete':
+            return gs['m_present_time']
+        return substate.next_event_time(gs,clocks,drifting)
+
+    def idle_cycle(self,gs):
+        if self.fsm.current_state=='Active':
+            self.substates[self.current_profile%2].idle_cycle(gs)
+
 
 
 class SGYo(Yo):
@@ -1033,16 +1225,14 @@ class Goto_list(WhenBehavior):
         fsm.memory=[('c_wpt_latlon',self.setWaypoint(r))]
 
     def Steering(self,fsm):
-        CLRS.g(self.behaviorName+": "+fsm.current_state+"->"+fsm.next_state)
+        if VERBOSE:
+            CLRS.g(self.behaviorName+": "+fsm.current_state+"->"+fsm.next_state)
         # set distance to waypoint
-        x0=self.gliderState['m_lmc_x']
-        y0=self.gliderState['m_lmc_y']
         r=self.activeWaypoint
-        x1=self.wpt_lmc[r][0]
-        y1=self.wpt_lmc[r][1]
-        dist=sqrt((x0-x1)**2+(y0-y1)**2)
+        dist=self.__getDistanceToWaypoint(self.gliderState)
         self.gliderState['m_dist_to_wpt']=dist
-        CLRS.w("distance to waypoint: %f"%(dist))
+        if VERBOSE:
+            CLRS.w("distance to waypoint: %f"%(dist))
         #print(dist, self.gliderState['c_heading'], self.gliderState['c_wpt_lat'], self.gliderState['c_wpt_lon'])
         if self.list_stop_when==7 and dist<=self.list_when_wpt_dist:
             self.achievedWaypoints+=1
@@ -1068,6 +1258,30 @@ class Goto_list(WhenBehavior):
         fsm.memory=[]
         self.updateMS(TOQUIT)
 
+    def _polled_event_time(self,gs,clocks,drifting):
+        t=gs['m_present_time']
+        if self.list_stop_when!=7:
+            return inf
+        dist=self.__getDistanceToWaypoint(gs)
+        if dist<=self.list_when_wpt_dist:
+            return t
+        # at the surface, the dead reckoned position moves with the depth averaged current only.
+        if gs['u_use_current_correction']:
+            speed=sqrt(gs['m_water_vx']**2+gs['m_water_vy']**2)
+        else:
+            speed=0
+        if speed==0:
+            return inf
+        return t+(dist-self.list_when_wpt_dist)/speed
+
+    def idle_cycle(self,gs):
+        if self.fsm.current_state=='Active':
+            gs['m_dist_to_wpt']=self.__getDistanceToWaypoint(gs)
+
+    def __getDistanceToWaypoint(self,gs):
+        x1,y1=self.wpt_lmc[self.activeWaypoint][:2]
+        return sqrt((gs['m_lmc_x']-x1)**2+(gs['m_lmc_y']-y1)**2)
+
     def __getClosestWaypoint(self):
         mindist=1e9
         r=None
@@ -1196,6 +1410,17 @@ class Prepare_to_dive(WhenBehavior):
         self.gliderState['hover_for']=0.
         self.gliderState['stalled_for']=0.
         self.gliderState['samedepth_for']=0.
+
+    def _polled_event_time(self,gs,clocks,drifting):
+        if gs['m_gps_status']==0:
+            return gs['m_present_time']
+        return self.t0+self.wait_time
+
+    def idle_cycle(self,gs):
+        if self.fsm.current_state=='Active':
+            gs['hover_for']=0.
+            gs['stalled_for']=0.
+            gs['samedepth_for']=0.
         
     def Complete(self,fsm):
         # set gps position at dive and relief stack
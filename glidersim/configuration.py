@@ -27,6 +27,9 @@ class Config(object):
         self.sensor_settings={}
         self.special_settings={}
         self.longtermParameters=[]
+        self.recording_spec=None # datastore.RecordingSpec, if not all parameters are to be recorded every storePeriod steps.
+        self.seed=None # seed for the actuator and fin noise. None: not reproducible.
+        self.noise=True # False: no actuator and fin noise.
         for k,v in kw.items():
             self.__dict__[k]=v
 
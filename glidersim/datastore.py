@@ -1,54 +1,547 @@
 import os
 import pickle
+import fnmatch
 import glob
+import math
+import time
 import numpy as np
+import netCDF4
 
 from latlon import convertToDecimal
 from GliderNetCDF import ncHereon
 
+from .gliderstate import GliderState, is_numeric
+from .projection import LocalProjection
+
+
+K_TIME = "m_present_time"
+# parameters that can be derived from recorded LMC coordinates: (x, y, index of lat/lon)
+DERIVED_LATLON = {'m_lat':('m_lmc_x', 'm_lmc_y', 0),
+                  'm_lon':('m_lmc_x', 'm_lmc_y', 1),
+                  'x_lat':('x_lmc_x', 'x_lmc_y', 0),
+                  'x_lon':('x_lmc_x', 'x_lmc_y', 1)}
+
+
+class RecordingSpec(object):
+    ''' Specifies which parameters are recorded, and how often.
+
+    Parameters
+    ----------
+    include : list of str
+        patterns (as in fnmatch) of parameters to record. Default: all parameters.
+    exclude : list of str
+        patterns of parameters not to record.
+    intervals : dict or None
+        pattern -> recording interval in seconds (simulated time). An interval of 0
+        records every time step. Parameters that match none of the patterns are
+        recorded every period time steps (storePeriod in the configuration).
+    on_change : list of str
+        patterns of parameters that are recorded only when their value changes.
+    derive_latlon : bool
+        if True, m_lat, m_lon, x_lat and x_lon are not recorded during the
+        simulation, but computed from the recorded LMC coordinates (m_lmc_x,
+        m_lmc_y, x_lmc_x and x_lmc_y) when the data are saved or read.
+
+    Parameters recorded at different times have their own time
+    variable, which is named time_<interval>s or time_<parameter> for
+    parameters that are recorded on change. m_present_time is always
+    recorded.
+
+    Latitudes and longitudes are derived only if the LMC coordinates are
+    recorded at the same times (not on change). They are then given at the
+    times of the LMC coordinates, irrespective of their own interval.
+
+    Examples
+    --------
+    >>> spec = RecordingSpec(exclude=['_*', 'utm_0', '*_stack', 'x_last_wpt_*'],
+    ...                      intervals={'m_depth':0, 'x_lat':30, 'x_lon':30,
+    ...                                 'temp':60, 'salt':60, 'rho':60},
+    ...                      on_change=['c_wpt_*'])
+    '''
+    def __init__(self, include=('*',), exclude=(), intervals=None, on_change=(), derive_latlon=False):
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.intervals = dict(intervals or {})
+        self.on_change = list(on_change)
+        self.derive_latlon = derive_latlon
+
+    def __match(self, parameter, patterns):
+        return any(fnmatch.fnmatchcase(parameter, p) for p in patterns)
+    
+    def selects(self, parameter):
+        return self.__match(parameter, self.include) and not self.__match(parameter, self.exclude)
+
+    def is_on_change(self, parameter):
+        return self.__match(parameter, self.on_change)
+
+    def interval(self, parameter):
+        ''' Returns the recording interval (s) of parameter, or None if not specified.'''
+        for pattern, interval in self.intervals.items():
+            if fnmatch.fnmatchcase(parameter, pattern):
+                return interval
+        return None
+
+    def schedule(self, parameter):
+        ''' Returns how parameter is recorded
+
+        Returns
+        -------
+        None, 'period', 'on_change' or float
+            not recorded, every period steps, on change, or at an interval (s)
+        '''
+        if parameter == K_TIME:
+            return 'period'
+        if not self.selects(parameter):
+            return None
+        if self.is_on_change(parameter):
+            return 'on_change'
+        interval = self.interval(parameter)
+        return 'period' if interval is None else interval
+
+
+class RecordGroup(object):
+    ''' Buffer for a number of parameters that are recorded at the same times.
+
+    Numerical parameters are recorded in a single float64 buffer, with
+    one row per parameter, which grows geometrically. Non-numerical
+    parameters (such as utm_0) are recorded in lists.
+
+    Parameters
+    ----------
+    time_key : str
+        name of the time variable of this group
+    parameters : list of str
+        parameters to record
+    gs : GliderState or dict
+        glider state
+    period : int or None
+        record every period time steps
+    interval : float or None
+        record every interval seconds (every time step if 0)
+    on_change : bool
+        record when the value of the (single) parameter changes.
+    '''
+    INITIAL_CAPACITY = 1024
+    
+    def __init__(self, time_key, parameters, gs, period=None, interval=None, on_change=False):
+        self.time_key = time_key
+        self.period = period
+        self.interval = interval
+        self.on_change = on_change
+        self.parameters = list(parameters)
+        if isinstance(gs, GliderState):
+            numerical_keys = set(gs.numerical_keys)
+        else:
+            numerical_keys = set(k for k, v in gs.items() if is_numeric(v))
+        numerical = [k for k in self.parameters if k in numerical_keys]
+        objects = [k for k in self.parameters if k not in numerical_keys]
+        if time_key in numerical:
+            names = sources = numerical
+        else:
+            names = [time_key] + numerical
+            sources = [K_TIME] + numerical
+        self.rows = dict((k, i) for i, k in enumerate(names))
+        self.objects = dict((k, []) for k in objects)
+        self.sources = sources
+        if isinstance(gs, GliderState):
+            slots = [gs.slot(k) for k in sources]
+            if slots == list(range(len(slots))):
+                self.slots = slice(0, len(slots))
+            else:
+                self.slots = np.array(slots)
+        else:
+            self.slots = None
+        self.buffer = np.empty((len(names), self.INITIAL_CAPACITY), dtype=np.float64)
+        self.size = 0
+        self.counter = 0
+        self.next_time = -np.inf
+        self.last_value = object() # differs from any value, so that the first value is recorded.
+
+    def is_due(self, gs, force=False, steps=1):
+        if self.on_change:
+            value = gs[self.parameters[0]]
+            if force or value != self.last_value:
+                self.last_value = value
+                return True
+            return False
+        if self.interval is not None:
+            t = gs[K_TIME]
+            if force or t >= self.next_time:
+                if self.interval > 0:
+                    self.next_time = (t//self.interval + 1) * self.interval
+                return True
+            return False
+        self.counter += steps
+        if self.counter >= self.period or force:
+            self.counter = 0
+            return True
+        return False
+
+    def record(self, gs):
+        if self.size == self.buffer.shape[1]:
+            n_rows, capacity = self.buffer.shape
+            buffer = np.empty((n_rows, 2*capacity), dtype=np.float64)
+            buffer[:, :capacity] = self.buffer
+            self.buffer = buffer
+        if self.slots is None:
+            self.buffer[:, self.size] = [gs[k] for k in self.sources]
+        else:
+            self.buffer[:, self.size] = gs.view(self.rows)[self.slots]
+        for k, v in self.objects.items():
+            v.append(gs[k])
+        self.size += 1
+
+    def clear(self):
+        self.size = 0
+        for v in self.objects.values():
+            v.clear()
+
+    def get(self, parameter):
+        return self.buffer[self.rows[parameter], :self.size]
+
+    @staticmethod
+    def _object_array(v):
+        # the type of the array is set to the type of the first element.
+        try:
+            return np.array(v, dtype=type(v[0]))
+        except (IndexError, TypeError):
+            return np.array(v, dtype=object)
+
+    def buffered_data(self):
+        data = dict((k, self.get(k)) for k in self.rows)
+        for k, v in self.objects.items():
+            data[k] = self._object_array(v)
+        return data
+
+    
+class NetCDFStream(object):
+    ''' Writes recorded data incrementally to a NetCDF file
+
+    Each record group has its own unlimited time dimension, named as
+    its time variable, except the group with m_present_time, of which
+    the dimension is named time. The file is opened for each write and
+    closed afterwards, so that it can be read by other programs between
+    writes.
+
+    Parameters
+    ----------
+    fn : str
+        filename
+    flush_records : int
+        number of records after which data are written to file
+    flush_interval : float
+        wall time (s) after which data are written to file
+    zlib : bool
+        compress variables
+    complevel : int
+        compression level (1-9)
+    chunksize : int
+        chunk size along the time dimension
+    '''
+    K_IGNORE = ["utm_0"]
+    
+    def __init__(self, fn, flush_records=1000, flush_interval=60., zlib=True, complevel=4, chunksize=1024):
+        self.fn = fn
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.zlib = zlib
+        self.complevel = complevel
+        self.chunksize = chunksize
+        self.n_records = {}
+        self.created = False
+        self.last_write_time = time.time()
+
+    def is_due(self, n_pending):
+        ''' Returns True if n_pending records should be written now.'''
+        return n_pending>=self.flush_records or time.time()-self.last_write_time>=self.flush_interval
+
+    @staticmethod
+    def dimension_name(time_key):
+        return 'time' if time_key == K_TIME else time_key
+    
+    def __create_variables(self, nc, dimension, time_key, data):
+        nc.createDimension(dimension, None)
+        opts = dict(zlib=self.zlib, complevel=self.complevel, chunksizes=(self.chunksize,))
+        v = nc.createVariable(dimension, 'f8', (dimension,), **opts)
+        v.units = "seconds since 1970-01-01 00:00:00 UTC"
+        for k, x in data.items():
+            if k==time_key or k in self.K_IGNORE:
+                continue
+            if x.dtype==bool:
+                nc.createVariable(k, 'i1', (dimension,), **opts)
+            elif x.dtype.kind in 'iuf':
+                nc.createVariable(k, 'f8', (dimension,), **opts)
+
+    def write(self, groups, metadata=None):
+        ''' Appends data to the file
+
+        Parameters
+        ----------
+        groups : list of (str, dict)
+            time variable name and a dictionary with parameter names and arrays of
+            equal length, including the time variable.
+        metadata : dict or None
+            global attributes to set
+        '''
+        mode = 'a' if self.created else 'w'
+        with netCDF4.Dataset(self.fn, mode) as nc:
+            if not self.created:
+                nc.setncatts(dict(title="Results of glidersim model",
+                                  source="n.a.",
+                                  originator="n.a."))
+                self.created = True
+            if metadata:
+                nc.setncatts(metadata)
+            for time_key, data in groups:
+                dimension = self.dimension_name(time_key)
+                if dimension not in nc.dimensions:
+                    self.__create_variables(nc, dimension, time_key, data)
+                i0 = self.n_records.get(dimension, 0)
+                i1 = i0 + len(data[time_key])
+                nc.variables[dimension][i0:i1] = data[time_key]
+                for k, x in data.items():
+                    if k != time_key and k in nc.variables:
+                        nc.variables[k][i0:i1] = x
+                self.n_records[dimension] = i1
+        self.last_write_time = time.time()
+
+    def read(self, parameters=None):
+        ''' Reads data from file
+
+        Parameters
+        ----------
+        parameters : list of str or None
+            parameters to read. If None, all parameters are read.
+
+        Returns
+        -------
+        dict
+            parameter names and arrays
+        '''
+        data = {}
+        if not self.created:
+            return data
+        with netCDF4.Dataset(self.fn, 'r') as nc:
+            nc.set_auto_mask(False)
+            for k in parameters or list(nc.variables.keys()):
+                v = nc.variables[self.dimension_name(k)]
+                x = v[:]
+                if v.dtype == np.int8:
+                    x = x.astype(bool)
+                data[K_TIME if k=='time' else k] = x
+        return data
+
+
 class Data(object):
-    def __init__(self,gs={},period=10):
+    ''' Records the glider state.
+
+    By default, all parameters are recorded every period time
+    steps. Alternatively, a RecordingSpec can be given to select the
+    parameters and to set recording intervals per parameter.
+
+    The recorded data are available through the data attribute, a
+    dictionary with parameter names and arrays, and through the method
+    get(). For numerical parameters these arrays are views on the
+    record buffers, and remain valid until new data are recorded.
+    get_time() returns the times at which a parameter was recorded.
+
+    If latitudes and longitudes are derived from LMC coordinates (see
+    RecordingSpec), the changes of utm_0 are kept, and the conversion
+    is done with a LocalProjection with tolerance projection_tolerance (m).
+
+    The dictionary metadata is written to the output file as global
+    attributes (NetCDF), or under the key _metadata (pickle).
+    '''
+    def __init__(self,gs={},period=10, spec=None, projection_tolerance=0.001):
         self.gs=gs
-        self.data=dict((k,[]) for k in list(gs.keys()))
-        self.__cnt=0
         self.period=period
+        self.spec=spec
+        self.projection_tolerance = projection_tolerance
+        self.metadata = {}
+        self.__initialise_groups()
+
+    def __initialise_groups(self):
+        spec = self.spec or RecordingSpec()
+        schedules = dict((k, spec.schedule(k)) for k in self.gs.keys())
+        derived = []
+        if spec.derive_latlon:
+            for k, (kx, ky, _) in DERIVED_LATLON.items():
+                s = schedules.get(kx)
+                if schedules.get(k) not in (None, 'on_change') and s not in (None, 'on_change') \
+                   and schedules.get(ky) == s:
+                    derived.append(k)
+        default = []
+        intervals = {}
+        on_change = []
+        for k, s in schedules.items():
+            if s is None or k in derived:
+                continue
+            elif s == 'on_change':
+                on_change.append(k)
+            elif s == 'period':
+                default.append(k)
+            else:
+                intervals.setdefault(s, []).append(k)
+        groups = [RecordGroup(K_TIME, default, self.gs, period=self.period)]
+        for interval, parameters in sorted(intervals.items()):
+            time_key = "time_{}s".format(f"{interval:g}".replace(".", "p"))
+            groups.append(RecordGroup(time_key, parameters, self.gs, interval=interval))
+        for k in on_change:
+            groups.append(RecordGroup(f"time_{k}", [k], self.gs, on_change=True))
+        self._groups = groups
+        self._time_keys = {}
+        self._group = {}
+        for g in groups:
+            self._group[g.time_key] = g
+            for k in g.parameters:
+                self._group[k] = g
+                self._time_keys[k] = g.time_key
+        self._derived = {} # derived parameter -> record group of its LMC coordinates
+        for k in derived:
+            g = self._group[DERIVED_LATLON[k][0]]
+            self._derived[k] = self._group[k] = g
+            self._time_keys[k] = g.time_key
+        self._keys = [k for k in self.gs.keys() if k in self._group]
+        self._keys += [g.time_key for g in groups[1:]]
+        self._loaded_data = None
+        self._stream = None
+        # changes of utm_0: times and values
+        if derived:
+            self._utm_0 = ([self.gs[K_TIME]], [self.gs['utm_0']])
+        else:
+            self._utm_0 = None
+        self._projections = {}
+
+    def set_output_stream(self, fn=None, **kwds):
+        ''' Writes recorded data to a NetCDF file while the simulation is running.
+
+        Once the data are written to file, they are removed from memory. The
+        attribute data and the method get() read the data back from file.
+
+        Parameters
+        ----------
+        fn : str or None
+            filename. If None, the attribute output is used.
+        kwds : 
+            keywords passed to NetCDFStream (flush_records, flush_interval, zlib,
+            complevel, chunksize).
+        '''
+        fn = fn or getattr(self, 'output', None)
+        if fn is None:
+            raise ValueError("No filename given for output stream.")
+        self._stream = NetCDFStream(fn, **kwds)
+
+    def flush(self):
+        ''' Writes all data in memory to the output stream, if set.'''
+        if self._stream is None:
+            return
+        groups = [g for g in self._groups if g.size]
+        if groups or self.metadata:
+            self._stream.write([(g.time_key, self.__group_data(g)) for g in groups], self.metadata)
+            for g in groups:
+                g.clear()
+
+    @property
+    def data(self):
+        if self._loaded_data is not None:
+            return self._loaded_data
+        if self._stream is not None:
+            self.flush()
+            return self._stream.read()
+        return self.__buffered_data()
+
+    def __buffered_data(self):
+        data = {}
+        for g in self._groups:
+            data.update(self.__group_data(g))
+        return dict((k, data[k]) for k in self._keys)
+
+    def __group_data(self, g):
+        data = g.buffered_data()
+        latlon = {}
+        for k, group in self._derived.items():
+            if group is g:
+                kx, ky, i = DERIVED_LATLON[k]
+                if kx not in latlon:
+                    latlon[kx] = self.__derive_latlon(data[g.time_key], data[kx], data[ky])
+                data[k] = latlon[kx][i]
+        return data
+
+    def __derive_latlon(self, t, x, y):
+        ''' Returns latitude and longitude (NMEA) of LMC coordinates x, y, recorded at times t'''
+        lat = np.empty_like(x)
+        lon = np.empty_like(x)
+        times, values = self._utm_0
+        segments = np.maximum(np.searchsorted(times, t, side='right')-1, 0)
+        for i in np.unique(segments):
+            j = segments == i
+            lat[j], lon[j] = self.__get_projection(values[i]).nmea_array(x[j], y[j])
+        return lat, lon
+
+    def __get_projection(self, utm_0):
+        try:
+            return self._projections[utm_0]
+        except KeyError:
+            projection = self._projections[utm_0] = LocalProjection(utm_0, self.projection_tolerance)
+            return projection
+
+    @data.setter
+    def data(self, data):
+        self._loaded_data = data
+
+    def time_key(self, parameter):
+        ''' Returns the name of the time variable of parameter.'''
+        return self._time_keys.get(parameter, K_TIME)
 
     def __save_pickle(self,fn):
+        data = self.data
+        time_keys = dict((k, v) for k, v in self._time_keys.items() if v != K_TIME)
+        if time_keys:
+            data = dict(data, _time_keys=time_keys)
+        if self.metadata:
+            data = dict(data, _metadata=self.metadata)
         with open(fn,'wb') as fd:
-            pickle.dump(self.data,fd)
+            pickle.dump(data,fd)
 
     def __save_ascii(self,fn):
+        if len(set(self.time_key(k) for k in self._keys)) > 1:
+            raise ValueError("Ascii output requires all parameters to be recorded at the same times.")
+        data=self.data
         fd=open(fn,'w')
         # print header
-        keys=list(self.data.keys())
+        keys=list(data.keys())
         hdr="#"+" ".join(keys)+"\n"
         fd.write(hdr)
-        n=len(self.data[keys[0]])
+        n=len(data[keys[0]])
         for i in range(n):
-            s=" ".join(["%s"%(self.data[k][i].__str__()) for k in keys])
+            s=" ".join(["%s"%(data[k][i].__str__()) for k in keys])
             fd.write(s+"\n")
         fd.close()
 
     def __save_nc(self, fn):
-        k_tm = "m_present_time"
         k_ignore = ["utm_0"]
-        tm = self.data[k_tm]
+        data = self.data
+        time_keys = set(self.time_key(k) for k in data.keys())
         opts = dict(title="Results of glidersim model",
                     source="n.a.",
                     originator="n.a.")
-                    
+        opts.update(self.metadata)
+
         with ncHereon(fn, mode='w', **opts) as nc:
-            for k in self.data.keys():
-                if k==k_tm:
+            for k in data.keys():
+                if k in time_keys:
                     continue
                 if k in k_ignore:
                     continue
-                nc.add_parameter(k,'-', tm, self.data[k])
+                nc.add_parameter(k,'-', data[self.time_key(k)], data[k])
                 
         
     def __load_pickle(self,fn):
         with open(fn,'rb') as fd:
-            self.data=pickle.load(fd)
+            data=pickle.load(fd)
+        self._time_keys = data.pop('_time_keys', {})
+        self.metadata = data.pop('_metadata', {})
+        self.data = data
 
     def create_new_filename(self, fn, suffix):
         directory, filename = os.path.split(fn)
@@ -76,6 +569,10 @@ class Data(object):
         fn = fn or self.output
         if filename_suffix:
             fn = self.create_new_filename(fn, filename_suffix)
+        if self._stream is not None and fn == self._stream.fn:
+            self.flush()
+            print(f"Output streamed to {fn}.")
+            return
         print(f"Writing output to {fn}...")
         _, extension = os.path.splitext(fn)
         s = extension.lower()[1:]
@@ -88,16 +585,61 @@ class Data(object):
             self.__save_ascii(fn)
 
     def get(self,parameter):
-        return np.array(self.data[parameter])
+        if self._loaded_data is None and self._stream is not None:
+            self.flush()
+            return self._stream.read([parameter])[parameter]
+        if self._loaded_data is None and parameter in self._derived:
+            g = self._derived[parameter]
+            kx, ky, i = DERIVED_LATLON[parameter]
+            return self.__derive_latlon(g.get(g.time_key), g.get(kx), g.get(ky))[i]
+        if self._loaded_data is None and parameter in self._group and parameter in self._group[parameter].rows:
+            return self._group[parameter].get(parameter)
+        return np.asarray(self.data[parameter])
+
+    def get_time(self, parameter):
+        ''' Returns the times at which parameter was recorded.'''
+        return self.get(self.time_key(parameter))
 
     def load(self,fn,data_format='pickle'):
         if data_format=='pickle':
             self.__load_pickle(fn)
 
-    def add_data(self,force_data_write=False):
-        self.__cnt+=1
-        if self.__cnt==self.period or force_data_write:
-            self.__cnt=0
-            for k,v in self.gs.items():
-                self.data[k].append(v)
+    def steps_to_next_record(self, dt):
+        ''' Returns the number of time steps dt until the next record is due
+
+        Parameters recorded on change are not taken into account.
+        '''
+        t = self.gs[K_TIME]
+        steps = np.inf
+        for g in self._groups:
+            if g.on_change:
+                continue
+            if g.interval is None:
+                steps = min(steps, g.period - g.counter)
+            elif g.interval > 0 and g.next_time > t:
+                steps = min(steps, max(1, math.ceil((g.next_time - t)/dt - 1e-9)))
+            else:
+                # recorded every time step, or due now (nothing recorded yet).
+                return 1
+        return steps
+
+    def add_data(self,force_data_write=False, steps=1):
+        ''' Records the glider state, if due
+
+        steps is the number of time steps since the previous call.
+        '''
+        if self._utm_0 is not None:
+            utm_0 = self.gs['utm_0']
+            times, values = self._utm_0
+            if utm_0 is not values[-1] and utm_0 != values[-1]:
+                times.append(self.gs[K_TIME])
+                values.append(utm_0)
+        recorded = False
+        for g in self._groups:
+            if g.is_due(self.gs, force_data_write, steps):
+                g.record(self.gs)
+                recorded = True
+        if recorded and self._stream is not None:
+            if self._stream.is_due(max(g.size for g in self._groups)):
+                self.flush()
     
@@ -0,0 +1,211 @@
+'''Persistent cache of decoded dbd data
+
+GliderData reads the CTD, depth-averaged current and GPS data of a
+deployment each time it is reset. Decoding all dbd files with dbdreader
+every time gets slow as the number of files grows during a deployment.
+DbdCache decodes each file only once, and stores the time series of the
+requested parameters per file, in memory and on disk, keyed by the file
+name, size and modification time. Only new or changed files are decoded;
+the data of all files are merged into a CachedData object, which can be
+used as a (read-only) substitute for dbdreader.MultiDBD.
+
+>>> cache = DbdCache('/home/user/.cache/glidersim/dbd', cacheDir='/home/user/.dbdreader')
+>>> dbd = cache.read('/gliders/comet/from-glider/comet*.[st]bd', ['sci_water_cond', 'sci_water_temp', 'sci_water_pressure'])
+>>> t, C, T, P = dbd.get_sync('sci_water_cond', 'sci_water_temp', 'sci_water_pressure')
+'''
+import glob
+import hashlib
+import os
+
+import numpy as np
+
+import dbdreader
+
+from . import common
+
+logger = common.get_logger(name="dbdcache")
+
+
+class CachedData(object):
+    ''' Merged time series of a number of dbd files
+
+    Provides get() and get_sync() with the same semantics as
+    dbdreader.MultiDBD, for the parameters that were read.
+
+    Parameters
+    ----------
+    data : dict
+        (t, v) arrays by parameter name, sorted in time
+    filenames : list of str
+        files the data were read from
+    '''
+    def __init__(self, data, filenames):
+        self.data = data
+        self.filenames = filenames
+
+    def get(self, *parameters):
+        ''' Returns time and values for each parameter
+
+        Raises
+        ------
+        dbdreader.DbdError
+            if a parameter does not occur in any of the files
+        '''
+        invalid = [p for p in parameters if p not in self.data]
+        if invalid:
+            raise dbdreader.DbdError(value=dbdreader.DBD_ERROR_NO_VALID_PARAMETERS,
+                                     mesg=f"Parameters {{{','.join(invalid)}}} are unknown glider sensor names.",
+                                     data=invalid)
+        r = [self.data[p] for p in parameters]
+        if len(parameters) == 1:
+            return r[0]
+        return r
+
+    def get_sync(self, *parameters):
+        ''' Returns the values of parameters, all interpolated to the time base of the first parameter'''
+        if len(parameters) < 2:
+            raise ValueError("Expect at least two parameters.")
+        tv = self.get(*parameters)
+        t, v = tv[0]
+        r = [t, v]
+        for _t, _v in tv[1:]:
+            if len(_t):
+                r.append(np.interp(t, _t, _v, left=np.nan, right=np.nan))
+            else:
+                r.append(t*np.nan)
+        return tuple(r)
+
+    def close(self):
+        pass
+
+
+class DbdCache(object):
+    ''' Cache of decoded dbd files
+
+    Parameters
+    ----------
+    cache_directory : str or None
+        directory where the decoded data are stored. If None, the data are
+        cached in memory only.
+    cacheDir : str or None
+        directory with the dbdreader cache (.cac) files
+    '''
+    def __init__(self, cache_directory=None, cacheDir=None):
+        self.cache_directory = cache_directory
+        self.cacheDir = cacheDir
+        self._files = {} # filename -> (key, data)
+
+    def read(self, pattern, parameters):
+        ''' Reads parameters from the files matching pattern
+
+        Parameters
+        ----------
+        pattern : str
+            glob pattern of the dbd files
+        parameters : list of str
+            parameter names
+
+        Returns
+        -------
+        CachedData
+
+        Raises
+        ------
+        dbdreader.DbdError
+            if no files match pattern
+        '''
+        filenames = sorted(glob.glob(pattern))
+        if not filenames:
+            raise dbdreader.DbdError(value=dbdreader.DBD_ERROR_NO_FILES_FOUND,
+                                     mesg=f"No files matched {pattern}.")
+        parameters = list(parameters)
+        merged = {}
+        n_decoded = 0
+        for fn in filenames:
+            data, decoded = self.__get_file(fn, parameters)
+            n_decoded += decoded
+            for p, tv in data.items():
+                merged.setdefault(p, []).append(tv)
+        logger.debug(f"Read {len(filenames)} files, of which {n_decoded} decoded.")
+        for p, tvs in merged.items():
+            t = np.hstack([tv[0] for tv in tvs])
+            v = np.hstack([tv[1] for tv in tvs])
+            i = np.argsort(t, kind='stable')
+            merged[p] = (t[i], v[i])
+        return CachedData(merged, filenames)
+
+    def clear(self):
+        ''' Clears the cache in memory'''
+        self._files.clear()
+
+    def __get_file(self, fn, parameters):
+        # returns the data of file fn for parameters, and whether the file was decoded.
+        st = os.stat(fn)
+        key = (st.st_size, st.st_mtime_ns)
+        try:
+            _key, requested, data = self._files[fn]
+        except KeyError:
+            _key, requested, data = self.__load(fn)
+        if _key == key and requested.issuperset(parameters):
+            self._files[fn] = (key, requested, data)
+            return {p:data[p] for p in parameters if p in data}, False
+        if _key == key:
+            parameters = sorted(requested.union(parameters))
+        data = self.__decode(fn, parameters)
+        if data is None:
+            return {}, True
+        self._files[fn] = (key, frozenset(parameters), data)
+        self.__save(fn, key, parameters, data)
+        return data, True
+
+    def __decode(self, fn, parameters):
+        try:
+            dbd = dbdreader.DBD(fn, cacheDir=self.cacheDir)
+        except dbdreader.DbdError as e:
+            logger.warning(f"Could not read {fn} ({e.mesg}).")
+            return None
+        data = {}
+        try:
+            for p in parameters:
+                if dbd.has_parameter(p):
+                    data[p] = dbd.get(p)
+        finally:
+            dbd.close()
+        return data
+
+    def __cache_filename(self, fn):
+        digest = hashlib.sha1(os.path.abspath(fn).encode('utf8')).hexdigest()[:8]
+        return os.path.join(self.cache_directory, f"{os.path.basename(fn)}-{digest}.npz")
+
+    def __load(self, fn):
+        # returns key, requested parameters and data from disk, or a key that never matches.
+        empty = (None, frozenset(), {})
+        if not self.cache_directory:
+            return empty
+        cache_fn = self.__cache_filename(fn)
+        if not os.path.exists(cache_fn):
+            return empty
+        try:
+            with np.load(cache_fn) as f:
+                key = tuple(int(k) for k in f['key'])
+                requested = frozenset(f['parameters'].tolist())
+                data = {p:(f['t_'+p], f['v_'+p]) for p in f['available'].tolist()}
+        except (OSError, KeyError, ValueError):
+            logger.warning(f"Could not read cache file {cache_fn}.")
+            return empty
+        return key, requested, data
+
+    def __save(self, fn, key, parameters, data):
+        if not self.cache_directory:
+            return
+        arrays = {}
+        for p, (t, v) in data.items():
+            arrays['t_'+p] = t
+            arrays['v_'+p] = v
+        cache_fn = self.__cache_filename(fn)
+        try:
+            os.makedirs(self.cache_directory, exist_ok=True)
+            np.savez(cache_fn, key=np.array(key, np.int64), parameters=np.array(parameters, str),
+                     available=np.array(sorted(data), str), **arrays)
+        except OSError:
+            logger.warning(f"Could not write cache file {cache_fn}.")
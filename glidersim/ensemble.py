@@ -0,0 +1,838 @@
+'''Ensemble simulations
+
+This module implements a glider model and a mission class that
+simulate N gliders (ensemble members) simultaneously. The dynamic
+state of all members (positions, velocities, actuator positions, PID
+and GPS state and the glider state variables gs) is held as numpy
+arrays of shape (N,), so that the actuators and the flight model are
+advanced for all members with a single vectorised step.
+
+Each member keeps its own behavior stack (LayeredControl), which
+operates on a dictionary-like view of the member's glider state, and
+environmental data are obtained per member, so that each member can
+have its own environment model if required.
+
+Performance: each time step has a fixed cost, independent of N, of
+operating on the member arrays, which is about that of 4 GliderMission
+runs. The cost per member (behaviors and environmental data) is about a
+third of that of a GliderMission run. Ensembles are therefore only faster
+than separate GliderMission runs from about 8 members upwards; a single
+member takes about 4 times as long. With the noise disabled, a member
+follows exactly the same trajectory as the same glider simulated with
+GliderMission.
+
+Example
+-------
+
+>>> glider_model = glidermodels.Shallow100mGliderModel()
+>>> glider_model.initialise_gliderflightmodel(Cd0=0.20, mg=73.3, Vg=71.542e-3)
+>>> EM = EnsembleMission(conf, glider_model, 100, environment_model=environment_model)
+>>> EM.loadmission()
+>>> EM.run(dt=0.5, CPUcycle=4, maxSimulationTime=1)
+>>> depth = EM.get('m_depth') # (time, member) array
+'''
+from collections.abc import MutableMapping
+import copy
+import os
+import pickle
+
+import numpy as np
+import netCDF4
+
+from latlon import convertToDecimal
+
+from . import behaviors
+from . import common
+from . import parser
+from .glidermodels import NoiseStream
+from .glidersim import LayeredControl, MISSIONS, MAFILES
+from .projection import LocalProjection, decimal_to_nmea_array
+
+logger = common.get_logger(name='ensemble')
+
+
+class EnsembleState(dict):
+    ''' Glider state of all members
+
+    Dictionary of parameter name -> array of shape (N,). Numeric
+    parameters are stored as float64 arrays, all other parameters as
+    object arrays. The computation of parameters can be deferred with
+    defer(), as in gliderstate.GliderState; deferred parameters are
+    computed when they are read with gs[key].
+    '''
+    def __init__(self, n_members):
+        super().__init__()
+        self.n_members = n_members
+        self._deferred = {} # parameter -> (keys, function, args)
+
+    def __getitem__(self, key):
+        if key in self._deferred:
+            self.__resolve(key)
+        return super().__getitem__(key)
+
+    def new_parameter(self, key, value):
+        if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+            self[key] = np.full(self.n_members, value, float)
+        else:
+            self[key] = np.empty(self.n_members, dtype=object)
+            self[key][:] = [value] * self.n_members
+
+    def defer(self, keys, function, *args):
+        ''' Defers the computation of numerical parameters
+
+        Parameters
+        ----------
+        keys : tuple of str
+            numerical parameters
+        function : callable
+            function(*args) returns an array of shape (N,) for each of the parameters in keys.
+        *args :
+            arguments of function
+        '''
+        entry = (keys, function, args)
+        for k in keys:
+            self._deferred[k] = entry
+
+    def resolve(self):
+        ''' Computes all deferred parameters'''
+        while self._deferred:
+            self.__resolve(next(iter(self._deferred)))
+
+    def __resolve(self, key):
+        keys, function, args = self._deferred[key]
+        for k, v in zip(keys, function(*args)):
+            del self._deferred[k]
+            super().__getitem__(k)[:] = v
+
+    def member(self, i):
+        return MemberState(self, i)
+
+
+class MemberState(MutableMapping):
+    ''' Dictionary-like view of the glider state of a single member
+
+    Behaviors and the LayeredControl read and write the glider state of
+    a member through this view.
+    '''
+    def __init__(self, state, i):
+        self._state = state
+        self._i = i
+
+    def __getitem__(self, key):
+        return self._state[key].item(self._i)
+
+    def __setitem__(self, key, value):
+        if key not in self._state:
+            self._state.new_parameter(key, value)
+        self._state[key][self._i] = value
+
+    def __delitem__(self, key):
+        raise KeyError("Parameters cannot be removed from an ensemble member.")
+
+    def __iter__(self):
+        return iter(self._state)
+
+    def __len__(self):
+        return len(self._state)
+
+    def __contains__(self, key):
+        return key in self._state
+
+
+class EnsembleNoiseStream(object):
+    ''' Actuator and fin noise for all members
+
+    Each member has its own NoiseStream, so that the noise of a member
+    only depends on its own seed. Random numbers are generated per member
+    in blocks, and handed out as arrays of shape (N,). Each member has its
+    own position in its blocks, so that numbers drawn for some members
+    only (see uniform()) do not shift the sequences of the other members.
+
+    Parameters
+    ----------
+    n_members : int
+        number of members
+    seeds : int, sequence of N ints or None
+        seed of the ensemble, from which the seeds of the members are derived
+        (numpy.random.SeedSequence.spawn()), or a seed for each member.
+    enabled : bool
+        if False, no noise is generated.
+    block_size : int
+        number of random numbers generated at a time per member
+    '''
+    def __init__(self, n_members, seeds=None, enabled=True, block_size=1024):
+        if seeds is None or isinstance(seeds, (int, np.integer)):
+            seeds = np.random.SeedSequence(seeds).spawn(n_members)
+        elif len(seeds) != n_members:
+            raise ValueError(f"Expected {n_members} seeds, got {len(seeds)}.")
+        self.members = [NoiseStream(seed, enabled, block_size) for seed in seeds]
+        self.n_members = n_members
+        self.enabled = enabled
+        self.block_size = block_size
+        self._all = np.arange(n_members)
+        self._blocks = dict(uniform=np.empty((block_size, n_members)),
+                            normal=np.empty((block_size, n_members)))
+        self._index = dict(uniform=np.full(n_members, block_size),
+                           normal=np.full(n_members, block_size))
+
+    def __next(self, kind, members):
+        block = self._blocks[kind]
+        index = self._index[kind]
+        for i in members[index[members]==self.block_size]:
+            rng = self.members[i].rng
+            block[:, i] = rng.random(self.block_size) if kind == 'uniform' else rng.standard_normal(self.block_size)
+            index[i] = 0
+        x = block[index[members], members]
+        index[members] += 1
+        return x
+
+    def __check_size(self, size):
+        if tuple(np.atleast_1d(size)) != (self.n_members,):
+            raise ValueError(f"Ensemble noise has shape ({self.n_members},), not {size}.")
+
+    def uniform(self, size, mask=None):
+        ''' Returns an array of shape (N,) from U(0, 1)
+
+        If mask is given, numbers are drawn for the members where mask is
+        True only; the other members get 0.5.
+        '''
+        self.__check_size(size)
+        x = np.full(self.n_members, 0.5)
+        if self.enabled:
+            members = self._all if mask is None else np.flatnonzero(mask)
+            x[members] = self.__next('uniform', members)
+        return x
+
+    def normal(self, size):
+        ''' Returns an array of shape (N,) from N(0, 1)'''
+        self.__check_size(size)
+        if not self.enabled:
+            return np.zeros(self.n_members)
+        return self.__next('normal', self._all)
+
+
+class LinearActuatorArray(object):
+    ''' Vectorised version of glidermodels.LinearActuator
+
+    Parameters
+    ----------
+    actuator : glidermodels.LinearActuator
+        actuator to take the settings from
+    n_members : int
+        number of members
+    '''
+    def __init__(self, actuator, n_members):
+        self.position = np.full(n_members, actuator.position, float)
+        self.speed = actuator.speed
+        self.position_max = actuator.position_max
+        self.position_min = actuator.position_min
+        self.deadbandWidth = actuator.deadbandWidth
+        self.position_target = np.full(n_members, actuator.position_target, float)
+        self.status = np.full(n_members, actuator.status, int)
+        self.noise = EnsembleNoiseStream(n_members)
+
+    def set_commanded(self, value, mask=None):
+        value = np.minimum(np.maximum(value, self.position_min), self.position_max)
+        if mask is None:
+            self.position_target[:] = value
+        elif value.ndim:
+            self.position_target[mask] = value[mask]
+        else:
+            self.position_target[mask] = value
+        return self.position_target.copy()
+
+    def get_measured(self):
+        return self.position.copy()
+
+    def actuate(self, dt):
+        delta_position = self.position_target-self.position
+        self.status[(self.status==0) & (np.abs(delta_position)>self.deadbandWidth)] = 1
+        running = self.status==1
+        if not running.any():
+            return
+        speed = self.speed*np.where(delta_position>0, 1., -1.)
+        # a hack to prevent over shoots.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            factor = np.where(np.abs(delta_position)<np.abs(speed)*dt,
+                              np.abs(delta_position/speed/dt), 1.)
+        # noise is drawn for the running actuators only, as for a single glider.
+        speed += (self.noise.uniform(speed.shape, running)-0.5)*speed*0.05
+        self.position = np.where(running, self.position+speed*dt*factor, self.position)
+        delta_position = self.position_target-self.position
+        stop = running & (((speed>0) & (delta_position<=0)) | ((speed<0) & (delta_position>=0)))
+        self.status[stop] = 0
+
+
+class PIDArray(object):
+    ''' PID controllers of all members
+
+    The state of the controllers is stored in arrays. A per-member
+    controller with the same interface as glidermodels.PID is obtained
+    by member().
+    '''
+    def __init__(self, pid, n_members):
+        self.Kp = pid.Kp
+        self.Ki = pid.Ki
+        self.Kd = pid.Kd
+        self.deadband = pid.deadband
+        self.t = np.full(n_members, np.nan)
+        self.ecum = np.zeros(n_members, float)
+        self.e = np.zeros(n_members, float)
+
+    def output(self, i, t, processVariable, setVariable):
+        e = setVariable-processVariable
+        if abs(e)<self.deadband:
+            return 0 # don't do anything
+        t_last = self.t[i]
+        if t_last==t_last and t_last: # not nan, and not 0
+            dedt = (e-self.e[i])/(t-t_last)
+            self.ecum[i] += e*(t-t_last)
+        else:
+            dedt = 0
+        self.e[i] = e
+        self.t[i] = t
+        return self.Kp*e + self.Ki*self.ecum[i] + self.Kd*dedt
+
+    def reset(self, mask=None):
+        if mask is None:
+            mask = slice(None)
+        self.t[mask] = np.nan
+        self.ecum[mask] = 0
+        self.e[mask] = 0.
+
+    def member(self, i):
+        return MemberPID(self, i)
+
+
+class MemberPID(object):
+    ''' PID controller of a single member, backed by a PIDArray '''
+    def __init__(self, pid_array, i):
+        self.pid_array = pid_array
+        self.i = i
+
+    def output(self, t, processVariable, setVariable):
+        return self.pid_array.output(self.i, t, processVariable, setVariable)
+
+    def reset(self):
+        self.pid_array.reset(self.i)
+
+
+class GPSArray(object):
+    ''' Vectorised version of glidermodels.GPS '''
+    def __init__(self, gps, n_members):
+        self.acquiretime = gps.acquiretime
+        self.status = np.full(n_members, gps.status, float)
+        self.time = np.full(n_members, np.nan)
+        self.enabled = np.zeros(n_members, bool)
+
+    def get_status(self, t, z):
+        underwater = z<-.1
+        self.time[underwater] = t
+        # as GPS.get_status(): a time of 0 counts as not set.
+        self.time[np.isnan(self.time) | (self.time==0)] = t
+        self.status = np.where(underwater, 2, np.where(t-self.time>self.acquiretime, 0, 1)).astype(float)
+        self.status[~self.enabled] *= -1
+        return self.status
+
+
+class EnsembleGliderModel(object):
+    ''' Glider model for an ensemble of N gliders
+
+    Parameters
+    ----------
+    glider_model : glidermodels.BaseGliderModel
+        glider model (including hardware and initialised glider flight model)
+        used as template for all members.
+    n_members : int
+        number of ensemble members
+    environment_model : environment model or list of environment models
+        a single environment model, shared by all members, or one per member.
+    '''
+    SPEED_WINDOW = 60//4
+    SCALAR_MEMBERS = 8 # up to this number of members, the flight model is integrated member by member.
+
+    def __init__(self, glider_model, n_members, environment_model=None):
+        self.template = glider_model
+        self.n_members = n_members
+        # copy of the flight model, with its own fin model, of which the noise is set by set_noise().
+        self.gliderflight_model = copy.copy(glider_model.gliderflight_model)
+        self.gliderflight_model.fin_model = copy.copy(glider_model.gliderflight_model.fin_model)
+        self.buoyancypump = LinearActuatorArray(glider_model.buoyancypump, n_members)
+        self.pitchmotor = LinearActuatorArray(glider_model.pitchmotor, n_members)
+        self.finmotor = LinearActuatorArray(glider_model.finmotor, n_members)
+        self.finPID = PIDArray(glider_model.finPID, n_members)
+        self.pitchPID = PIDArray(glider_model.pitchPID, n_members)
+        self.gps = GPSArray(glider_model.gps, n_members)
+        self.environment_model = environment_model
+        # optional per-member flight model coefficients (None: use flight model settings)
+        self.member_parameters = dict(Cd0=None, mg=None, Vg=None)
+        self._speeds = np.zeros((n_members, self.SPEED_WINDOW), float)
+        self._n_speeds = np.zeros(n_members, int)
+        self._i_speeds = np.zeros(n_members, int)
+        self.projection_tolerance = glider_model.projection_tolerance
+        self._projections = {} # utm_0 -> LocalProjection
+        self.set_noise()
+
+    def set_noise(self, seeds=None, enabled=True):
+        ''' Sets new noise streams for the actuators and the fin model
+
+        Parameters
+        ----------
+        seeds : int, sequence of N ints or None
+            seed of the ensemble or a seed per member (see EnsembleNoiseStream)
+        enabled : bool
+            if False, actuators and fin model are run without noise.
+        '''
+        self.noise = EnsembleNoiseStream(self.n_members, seeds, enabled)
+        for actuator in (self.buoyancypump, self.pitchmotor, self.finmotor):
+            actuator.noise = self.noise
+        self.gliderflight_model.fin_model.noise_stream = self.noise
+
+    def set_member_parameters(self, **kwds):
+        ''' Set per-member flight model coefficients
+
+        Parameters
+        ----------
+        kwds : Cd0, mg and/or Vg, each as an array of shape (N,)
+        '''
+        for k, v in kwds.items():
+            if k not in self.member_parameters:
+                raise ValueError(f"Unknown member parameter {k}.")
+            v = np.asarray(v, float)
+            if v.shape != (self.n_members,):
+                raise ValueError(f"Parameter {k} should have shape ({self.n_members},).")
+            self.member_parameters[k] = v
+
+    def initialise_gliderstate(self, datestr, timestr, lat, lon, mission_start):
+        ''' Initialise the glider states of all members
+
+        lat and lon can be scalars (all members start at the same position)
+        or arrays of shape (N,).
+        '''
+        N = self.n_members
+        lats = np.broadcast_to(lat, (N,))
+        lons = np.broadcast_to(lon, (N,))
+        gs = EnsembleState(N)
+        for i, (_lat, _lon) in enumerate(zip(lats, lons)):
+            self.template.initialise_gliderstate(datestr, timestr, _lat, _lon, mission_start)
+            for k, v in self.template.gs.items():
+                if k not in gs:
+                    gs.new_parameter(k, v)
+                gs[k][i] = v
+        self.gs = gs
+        self.x = np.zeros(N, float)
+        self.y = np.zeros(N, float)
+        self.z = np.zeros(N, float)
+        self.lmc_x = np.zeros(N, float)
+        self.lmc_y = np.zeros(N, float)
+
+    def get_environment_model(self, i):
+        if isinstance(self.environment_model, (list, tuple)):
+            return self.environment_model[i]
+        return self.environment_model
+
+    def get_projection(self, utm_0):
+        ''' Returns the LocalProjection for utm_0, shared by all members with the same utm_0 '''
+        try:
+            return self._projections[utm_0]
+        except KeyError:
+            if len(self._projections) > 2*self.n_members:
+                self._projections.clear() # utm_0's of surfacings long ago.
+            projection = self._projections[utm_0] = LocalProjection(utm_0, self.projection_tolerance)
+            return projection
+
+    def get_projections(self):
+        ''' Returns a list of the LocalProjections of the current utm_0 of all members '''
+        return [self.get_projection(utm_0) for utm_0 in self.gs['utm_0']]
+
+    def translate_lmc_latlon(self, x, y, decimal=False, projections=None):
+        ''' Translate arrays of LMC coordinates into lat/lon (NMEA, or decimal if decimal is True) for all members
+
+        projections is an optional list of the LocalProjections of the members. If None,
+        the projections of the current utm_0 of the members are used.
+        '''
+        if projections is None:
+            projections = self.get_projections()
+        lat = np.empty(self.n_members, float)
+        lon = np.empty(self.n_members, float)
+        for i, projection in enumerate(projections):
+            lat[i], lon[i] = projection(x[i], y[i])
+        if not decimal:
+            lat, lon = decimal_to_nmea_array(lat), decimal_to_nmea_array(lon)
+        return lat, lon
+
+    def get_environmental_data(self, t, lat, lon, z, decimal=False):
+        ''' Get the environmental data for all members
+
+        The environment model of each member is queried separately. lat and lon
+        are in NMEA format, or in decimal degrees if decimal is True.
+
+        Returns
+        -------
+        u, v, w, water_depth, eta, S, T, rho : arrays of shape (N,)
+        '''
+        data = np.empty((8, self.n_members), float)
+        for i in range(self.n_members):
+            environment_model = self.get_environment_model(i)
+            if environment_model is None:
+                data[:, i] = 0, 0, 0, 40, 0, 35, 15, 1025
+            elif decimal:
+                data[:, i] = environment_model.get_data(t, lat[i], lon[i], z[i])
+            else:
+                declat = convertToDecimal(lat[i])
+                declon = convertToDecimal(lon[i])
+                data[:, i] = environment_model.get_data(t, declat, declon, z[i])
+        return data
+
+    def update(self, t, dt):
+        # the arrays of the glider state, as a plain dictionary; update() does not read any
+        # deferred parameters, so their resolution need not be checked at each access.
+        gs = dict(self.gs)
+        gfm = self.gliderflight_model
+        gs['m_gps_status'][:] = self.gps.get_status(gs['m_present_time'][0], self.z)
+        self.gps.enabled = gs['c_gps_on']!=0
+        #
+        self.pitchmotor.actuate(dt)
+        self.buoyancypump.actuate(dt)
+        self.finmotor.actuate(dt)
+        #
+        gs['m_ballast_pumped'][:] = self.buoyancypump.get_measured()
+        gs['m_fin'][:] = self.finmotor.get_measured()
+        gs['m_battpos'][:] = self.pitchmotor.get_measured()
+        #
+        projections = self.get_projections()
+        realLat, realLon = self.translate_lmc_latlon(self.x, self.y, decimal=True, projections=projections)
+        u_water, v_water, w_water, water_depth, eta, S, T, rho = self.get_environmental_data(t, realLat, realLon, self.z,
+                                                                                             decimal=True)
+
+        gs['temp'][:] = T
+        gs['salt'][:] = S
+        gs['water_depth'][:] = water_depth
+        gs['rho'][:] = rho
+        gs['x_u'][:] = u_water
+        gs['x_v'][:] = v_water
+        gs['x_w'][:] = w_water
+        gs['x_water_depth'][:] = water_depth+eta
+
+        m_heading, m_heading_rate = gfm.compute_heading_from_fin(t, gs['m_heading'].copy(), gs['m_heading_rate'],
+                                                                 gs['m_fin'].copy(), gs['m_speed'])
+        m_pitch = gfm.compute_pitch_from_battpos_buoyancy_drive(gs['m_battpos'], gs['m_ballast_pumped'],
+                                                                gs['m_pressure'])
+        gs['m_heading'][:] = m_heading
+        gs['m_heading_rate'][:] = m_heading_rate
+        gs['m_pitch'][:] = m_pitch
+
+        _x, _y, _z, _u, _v, _w = self.__step_integrate(self.x, self.y, self.z,
+                                                       gs['x_eastward_glider_velocity'],
+                                                       gs['x_northward_glider_velocity'],
+                                                       gs['x_upward_glider_velocity'],
+                                                       m_pitch, rho, gs['m_ballast_pumped'], m_heading)
+        grounded = _z + water_depth + eta < 0
+        _u[grounded] = _v[grounded] = _w[grounded] = 0
+        gs['_is_grounded'][:] = grounded
+        self.x, self.y, self.z = _x, _y, _z
+        gs['x_eastward_glider_velocity'][:] = _u
+        gs['x_northward_glider_velocity'][:] = _v
+        gs['x_upward_glider_velocity'][:] = _w
+        speed = (_u**2 + _v**2)**0.5
+        gs['x_speed'][:] = speed
+        self.__update_mean_speed(speed)
+
+        # update real position of the gliders:
+        self.x = self.x + u_water * dt
+        self.y = self.y + v_water * dt
+        self.z = self.z + w_water * dt
+
+        # update new position (dead reckoned)
+        gs['m_depth'][:] = -self.z
+        gs['m_pressure'][:] = np.maximum(0, -self.z * rho * 9.81 * 1e-5)
+        fix = gs['m_gps_status']==0
+        self.lmc_x = np.where(fix, self.x, self.lmc_x + dt * gs['x_northward_glider_velocity'])
+        self.lmc_y = np.where(fix, self.y, self.lmc_y + dt * gs['x_eastward_glider_velocity'])
+        correction = gs['u_use_current_correction']!=0
+        self.lmc_x = np.where(correction, self.lmc_x + dt * gs['m_water_vx'], self.lmc_x)
+        self.lmc_y = np.where(correction, self.lmc_y + dt * gs['m_water_vy'], self.lmc_y)
+        gs['m_lmc_x'][:] = self.lmc_x
+        gs['m_lmc_y'][:] = self.lmc_y
+        # lat/lon are only computed when read or recorded.
+        self.gs.defer(('m_lat', 'm_lon'), self.translate_lmc_latlon, self.lmc_x, self.lmc_y, False, projections)
+
+        samedepth = np.abs(gs['x_upward_glider_velocity'])<1e-4
+        hovering = samedepth & (self.z>0.1)
+        gs['samedepth_for'][:] = np.where(samedepth, gs['samedepth_for']+dt, 0)
+        gs['hover_for'][:] = np.where(samedepth, gs['hover_for']+hovering*dt, 0)
+        gs['stalled_for'][:] = np.where(samedepth, gs['stalled_for']+hovering*dt, 0)
+        gs['m_altitude'][:] = water_depth-gs['m_depth']
+        for k in ['m_present_time', 'm_present_secs_into_mission', 'nocomms',
+                  'time_since_cycle_start', 'time_since_cycle_end']:
+            gs[k] += dt
+        # store real glider positions too.
+        gs['x_lmc_x'][:] = self.x
+        gs['x_lmc_y'][:] = self.y
+        gs['x_lmc_z'][:] = self.z
+        self.gs.defer(('x_lat', 'x_lon'), self.translate_lmc_latlon, self.x, self.y, False, projections)
+
+    def __step_integrate(self, x, y, z, u, v, w, pitch, rho, buoyancy_change, heading):
+        # For small ensembles, the overhead of numpy on arrays of a few elements exceeds
+        # the cost of integrating the members one by one with the float backend.
+        gfm = self.gliderflight_model
+        if self.n_members > self.SCALAR_MEMBERS:
+            return gfm.step_integrate_array(x, y, z, u, v, w, pitch, rho, buoyancy_change, heading,
+                                            **self.member_parameters)
+        Cd0, mg, Vg = (self.member_parameters[k] for k in ('Cd0', 'mg', 'Vg'))
+        r = np.empty((6, self.n_members), float)
+        for i in range(self.n_members):
+            r[:, i] = gfm._step_integrate_float(x[i], y[i], z[i], u[i], v[i], w[i], pitch[i], rho[i],
+                                                buoyancy_change[i], heading[i],
+                                                None if Cd0 is None else Cd0[i],
+                                                None if mg is None else mg[i],
+                                                None if Vg is None else Vg[i])
+        return r
+
+    def __update_mean_speed(self, speed):
+        # moving average of the speed for those members that are not at the surface.
+        moving = np.where(speed>0)[0]
+        if not moving.shape[0]:
+            return
+        self._speeds[moving, self._i_speeds[moving]] = speed[moving]
+        self._i_speeds[moving] = (self._i_speeds[moving]+1)%self.SPEED_WINDOW
+        self._n_speeds[moving] = np.minimum(self._n_speeds[moving]+1, self.SPEED_WINDOW)
+        self.gs['m_speed'][moving] = self._speeds[moving].sum(axis=1)/self._n_speeds[moving]
+
+
+class EnsembleMission(object):
+    ''' Mission simulation of an ensemble of gliders
+
+    Parameters
+    ----------
+    config : configuration.Config
+        configuration, shared by all members
+    glider_model : glidermodels.BaseGliderModel
+        glider model, used as template for all members
+    n_members : int
+        number of ensemble members
+    environment_model : environment model or list of environment models
+        a single environment model, shared by all members, or one per member.
+    lat_ini, lon_ini : array-like (N,) or None
+        optional per-member start positions (NMEA). If None, the position
+        in config is used.
+    seeds : sequence of N ints or None
+        optional per-member seeds of the actuator and fin noise. If None, the
+        member seeds are derived from config.seed.
+    '''
+    def __init__(self, config, glider_model, n_members, environment_model=None,
+                 lat_ini=None, lon_ini=None, verbose=False, seeds=None):
+        if environment_model is None:
+            raise ValueError("No environemnt model specified.")
+        self.verbose = verbose
+        self.n_members = n_members
+        self.mission = config.missionName
+        self.mission_directory = config.mission_directory
+        self.output = config.output
+        self.datatransfertime = 0.
+        self.mission_initialisation_time = 0.
+        self.glider = EnsembleGliderModel(glider_model, n_members, environment_model)
+        self.glider.set_noise(seeds if seeds is not None else config.seed, config.noise)
+        lat = config.lat_ini if lat_ini is None else lat_ini
+        lon = config.lon_ini if lon_ini is None else lon_ini
+        self.glider.initialise_gliderstate(config.datestr, config.timestr, lat, lon, config.mission_start)
+        self.gs = [self.glider.gs.member(i) for i in range(n_members)]
+        self.LC = []
+        for i in range(n_members):
+            LC = LayeredControl()
+            LC.set_PIDS(self.glider.finPID.member(i), self.glider.pitchPID.member(i))
+            self.LC.append(LC)
+        self.MS = np.zeros(n_members, int)
+        self.active = np.ones(n_members, bool)
+        for sensorname, sensorvalue in config.sensor_settings.items():
+            self.sensor(sensorname, sensorvalue)
+        config.set_special_settings(self)
+        for s, v in dict(initial_heading='m_heading').items():
+            if s in config.special_settings:
+                self.glider.gs[v][:] = config.special_settings[s]
+        self.period = config.storePeriod
+        self.data = dict((k, []) for k, v in self.glider.gs.items() if v.dtype!=object)
+        self.data['active'] = []
+        self.__cnt = 0
+
+    def sensor(self, parameter, value):
+        if parameter in self.glider.gs:
+            if value is None:
+                logger.warning("Setting sensor %s failed (value==None)"%(parameter))
+            else:
+                logger.info("setting sensor value %s=%f"%(parameter, value))
+                self.glider.gs[parameter][:] = value
+        else:
+            logger.info("Ignoring sensor setting %s (sensor is not used)"%(parameter))
+
+    def loadmission(self, mission=None, verbose=False, use_glider_directory_structure=True):
+        mission = mission or self.mission
+        if not mission:
+            logger.error("No mission name supplied!")
+            raise ValueError("No mission name supplied!")
+        if use_glider_directory_structure:
+            mission = os.path.join(self.mission_directory, MISSIONS, mission)
+            mafiles_directory = os.path.join(self.mission_directory, MAFILES)
+        else:
+            mission = os.path.join(self.mission_directory, mission)
+            mafiles_directory = self.mission_directory
+        MP = parser.MissionParser(verbose=verbose)
+        MP.parse(mission, mafiles_directory)
+        for p, v in MP.sensor_settings:
+            self.sensor(p, v)
+        MP.behaviors.reverse()
+        for LC in self.LC:
+            # each member gets its own copy of the behaviors.
+            for b in copy.deepcopy(MP.behaviors):
+                if isinstance(b, behaviors.Surface):
+                    b.datatransfertime = self.datatransfertime
+                LC.addBehavior(b)
+
+    def add_data(self, force_data_write=False):
+        self.__cnt += 1
+        if self.__cnt==self.period or force_data_write:
+            self.__cnt = 0
+            for k in self.data.keys():
+                if k=='active':
+                    self.data[k].append(self.active.copy())
+                else:
+                    self.data[k].append(self.glider.gs[k].copy())
+
+    def get(self, parameter):
+        ''' Returns recorded values of parameter as (time, member) array. '''
+        return np.asarray(self.data[parameter])
+
+    def _cycle_member(self, i):
+        # Behavior.MS is shared by all behaviors, so it is swapped per member.
+        behaviors.Behavior.MS = int(self.MS[i])
+        b, p, f = self.LC[i].cycle(self.gs[i])
+        self.MS[i] = behaviors.Behavior.MS
+        return b, p, f
+
+    def check_if_on_surface(self, i):
+        for s in self.LC[i].stack:
+            if s.behaviorName=='Surface' and s.get_current_state()=='WaitForUser':
+                return True
+        return False
+
+    def run(self, dt=1, CPUcycle=4, maxSimulationTime=None,
+            end_on_surfacing=False, end_on_grounding=False, verbose=False):
+        ''' Run the simulation for all members
+
+        Parameters are as in GliderMission.run(). The simulation ends for
+        each member individually. The simulation stops when no members are
+        active anymore.
+        '''
+        N = self.n_members
+        glider = self.glider
+        gs = glider.gs
+        glider.gliderflight_model.dt = dt
+        behaviors.VERBOSE = self.verbose
+        self.MS[:] = 0
+        self.active[:] = True
+        gs['c_ballast_pumped'][:] = glider.buoyancypump.set_commanded(1000)
+        gs['c_battpos'][:] = glider.pitchmotor.set_commanded(100)
+        gs['c_fin'][:] = glider.finmotor.set_commanded(0)
+        subcycle_time = 1e3 # make sure we update LC on the first round.
+        simulationTime = gs['m_present_time'][0]
+        b = np.full(N, np.nan)
+        p = np.full(N, np.nan)
+        f = np.full(N, np.nan)
+        surfacings = np.full(N, int(end_on_surfacing))
+        groundings = np.full(N, int(end_on_grounding))
+
+        if gs['_pickup'][0] == True:
+            gs['time_since_cycle_start'][:] = self.datatransfertime
+        else:
+            mission_initialised_time = simulationTime + self.mission_initialisation_time
+            while simulationTime < mission_initialised_time:
+                glider.update(simulationTime, dt)
+                self.add_data()
+                simulationTime += dt
+        while True:
+            if subcycle_time>=CPUcycle: # a new cpucycle
+                for i in np.where(self.active)[0]:
+                    b[i], p[i], f[i] = [np.nan if _x is None else _x for _x in self._cycle_member(i)]
+                subcycle_time = 0
+            at_surface = gs['m_depth']<0.1
+            f[at_surface] = 0
+            glider.finPID.reset(at_surface)
+            to_quit = (self.MS & behaviors.TOQUIT)!=0
+            b[to_quit] = -10.
+            p[to_quit] = 1000.
+            f[to_quit] = 0.
+            mask = ~np.isnan(p)
+            gs['c_ballast_pumped'][mask] = glider.buoyancypump.set_commanded(p, mask)[mask]
+            mask = ~np.isnan(b)
+            gs['c_battpos'][mask] = glider.pitchmotor.set_commanded(b, mask)[mask]
+            mask = ~np.isnan(f)
+            gs['c_fin'][mask] = glider.finmotor.set_commanded(f, mask)[mask]
+            completed = to_quit & at_surface
+            self.MS[completed] |= behaviors.COMPLETED
+            finished = ((self.MS & behaviors.COMPLETED)!=0) | ((self.MS>=8) & at_surface)
+            self.active &= ~finished
+            if np.any(gs['m_depth']>1300):
+                raise ValueError('Whoops! Sinking to the depths...!')
+            if maxSimulationTime and gs['m_present_secs_into_mission'][0]>maxSimulationTime*86400.:
+                logger.info("Mission exceeding simulation time.")
+                break
+            force_data_write = False
+            if end_on_surfacing:
+                for i in np.where(self.active)[0]:
+                    if self.check_if_on_surface(i):
+                        surfacings[i] -= 1
+                        if surfacings[i]==0:
+                            logger.info(f"Member {i}: ending mission because of end_on_surfacing is set.")
+                            self.active[i] = False
+                            force_data_write = True
+            if end_on_grounding:
+                grounded = self.active & (gs['_is_grounded']!=0)
+                groundings[grounded] -= 1
+                stop = grounded & (groundings==0)
+                if stop.any():
+                    logger.info(f"Members {np.where(stop)[0]}: ending mission because of end_on_grounding is set.")
+                    self.active[stop] = False
+                    force_data_write = True
+            if force_data_write:
+                self.add_data(force_data_write=True)
+            if not self.active.any():
+                break
+            glider.update(simulationTime, dt)
+            self.add_data()
+            simulationTime += dt
+            subcycle_time += dt
+        for i in range(N):
+            if self.MS[i]&behaviors.COMPLETED:
+                logger.info(f"Member {i}: mission completed.")
+            else:
+                for k, v in behaviors.ABORTS.items():
+                    if self.MS[i]&v:
+                        logger.info(f"Member {i}: mission abort: {k.upper()}")
+        self.data = dict((k, np.array(v)) for k, v in self.data.items())
+
+    def save(self, fn=None):
+        ''' Save the results
+
+        Results are written to a netCDF file (.nc) with (time, member)
+        variables, or pickled (.pck).
+        '''
+        fn = fn or self.output
+        logger.info(f"Writing output to {fn}...")
+        _, extension = os.path.splitext(fn)
+        if extension.lower() == '.pck':
+            with open(fn, 'wb') as fd:
+                pickle.dump(self.data, fd)
+            return
+        tm = self.data['m_present_time'][:, 0]
+        with netCDF4.Dataset(fn, 'w') as nc:
+            nc.title = "Results of glidersim ensemble model"
+            nc.createDimension('time', tm.shape[0])
+            nc.createDimension('member', self.n_members)
+            v = nc.createVariable('time', 'f8', ('time',))
+            v.units = "seconds since 1970-01-01 00:00:00 UTC"
+            v[:] = tm
+            for k, x in self.data.items():
+                if k=='m_present_time':
+                    continue
+                v = nc.createVariable(k, 'i1' if x.dtype==bool else 'f8', ('time', 'member'), zlib=True)
+                v[...] = x
@@ -39,9 +39,277 @@ except ImportError:
 
     
 from . import common
+from . import dbdcache
+from . import tilestore
 
 logger = common.get_logger(name="environments")
 
+
+def weighted_bin_sums(depth, weights, bins, values, variance=False):
+    ''' Weighted sums of values in depth bins
+
+    Parameters
+    ----------
+    depth : array (N,)
+        depth of the samples (m)
+    weights : array (N,)
+        weights of the samples
+    bins : array (M+1,)
+        monotonically increasing bin edges (m). Bins need not be equidistant.
+        Samples outside the bins are ignored.
+    values : dict of arrays (N,)
+        values to be binned, by name
+    variance : bool
+        if True, also the weighted sums of the squared values are computed
+
+    Returns
+    -------
+    weights_sum : array (M,)
+        sum of the weights in each bin
+    sums : dict of arrays (M,)
+        weighted sums of the values, and if variance is True, of the squared
+        values with the names suffixed by '^2'.
+    '''
+    n = len(bins)-1
+    idx = np.digitize(depth, bins)-1
+    inside = (idx>=0) & (idx<n)
+    idx = idx[inside]
+    weights = np.asarray(weights, float)[inside]
+    weights_sum = np.bincount(idx, weights=weights, minlength=n)
+    sums = {}
+    for k, v in values.items():
+        v = np.asarray(v, float)[inside]
+        sums[k] = np.bincount(idx, weights=weights*v, minlength=n)
+        if variance:
+            sums[k+'^2'] = np.bincount(idx, weights=weights*v**2, minlength=n)
+    return weights_sum, sums
+
+
+class RollingProfile(object):
+    ''' Time-weighted, depth-binned profiles
+
+    Samples are weighted with exp(-age/timescale), and the weighted sums
+    per depth bin are kept, so that the profiles can be updated
+    incrementally as new samples arrive.
+
+    Parameters
+    ----------
+    bins : array (M+1,)
+        bin edges (m)
+    timescale : float
+        e-folding time scale (s) of the weights
+    z : array (M,) or None
+        depths (m) assigned to the bins. If None, the centres of the bins.
+    variance : bool
+        if True, the weighted variance per bin is available too.
+
+    Example
+    -------
+
+    >>> profile = RollingProfile(np.arange(0, 105, 5), 12*3600)
+    >>> profile.update(t, depth, rho=rho, T=T)
+    >>> z, rho_avg = profile.get('rho')
+    '''
+    def __init__(self, bins, timescale, z=None, variance=False):
+        self.bins = np.asarray(bins, float)
+        self.z = (self.bins[1:]+self.bins[:-1])/2 if z is None else np.asarray(z, float)
+        self.timescale = timescale
+        self.variance = variance
+        self.time = None # reference time of the weights
+        self.weights_sum = np.zeros(len(self.bins)-1, float)
+        self.sums = {}
+
+    def update(self, t, depth, **values):
+        ''' Adds samples
+
+        Parameters
+        ----------
+        t : array (N,)
+            time of the samples (s)
+        depth : array (N,)
+            depth of the samples (m)
+        values :
+            arrays (N,) of values by name. All updates must provide the same names.
+        '''
+        t = np.asarray(t, float)
+        if not t.size:
+            return
+        t_max = t.max()
+        if self.time is None:
+            self.time = t_max
+        elif t_max > self.time:
+            # decay the sums to the new reference time, which keeps the weights <= 1.
+            decay = np.exp(-(t_max - self.time)/self.timescale)
+            self.weights_sum *= decay
+            for k in self.sums:
+                self.sums[k] *= decay
+            self.time = t_max
+        weights = np.exp(-(self.time - t)/self.timescale)
+        weights_sum, sums = weighted_bin_sums(depth, weights, self.bins, values, self.variance)
+        self.weights_sum += weights_sum
+        for k, v in sums.items():
+            if k in self.sums:
+                self.sums[k] += v
+            else:
+                self.sums[k] = v
+
+    def get(self, name):
+        ''' Returns the depths and weighted averages of the non-empty bins for value name'''
+        j = np.flatnonzero(self.weights_sum)
+        return self.z[j], self.sums[name][j]/self.weights_sum[j]
+
+    def get_variance(self, name):
+        ''' Returns the depths and weighted variances of the non-empty bins for value name'''
+        if not self.variance:
+            raise ValueError("Profile was created without variance.")
+        j = np.flatnonzero(self.weights_sum)
+        mean = self.sums[name][j]/self.weights_sum[j]
+        return self.z[j], np.maximum(self.sums[name+'^2'][j]/self.weights_sum[j] - mean**2, 0)
+
+    def interpolator(self, name):
+        ''' Returns a function of depth that interpolates the profile of value name'''
+        z, avg = self.get(name)
+        return interp1d(z, avg, bounds_error = False, fill_value=(avg[0], avg[-1]))
+
+
+class ProfileTable(object):
+    ''' Profiles resampled on a uniform depth grid, for fast scalar lookup
+
+    A number of profiles, given at the same depths, are linearly
+    interpolated onto a fine uniform grid, so that a lookup requires only
+    index arithmetic. Above the first and below the last depth the
+    profiles take their first and last values, respectively.
+
+    Parameters
+    ----------
+    z : array (N,)
+        increasing depths (m) of the profiles
+    values : list of arrays (N,)
+        profiles
+    dz : float
+        resolution (m) of the uniform grid
+
+    Example
+    -------
+
+    >>> table = ProfileTable(z, [rho, SA, T], dz=0.1)
+    >>> rho, SA, T = table(12.3)
+    '''
+    def __init__(self, z, values, dz=0.1):
+        z = np.asarray(z, float)
+        self.z0 = float(z[0])
+        self.dz = dz
+        n = int(np.ceil((z[-1] - z[0])/dz)) + 1
+        zi = self.z0 + np.arange(n)*dz
+        # python lists of tuples, which are faster to index than arrays.
+        self.table = list(zip(*[np.interp(zi, z, v).tolist() for v in values]))
+        self.n = n
+        self.first = self.table[0]
+        self.last = self.table[-1]
+
+    def __call__(self, depth):
+        ''' Returns a tuple with the values of all profiles at depth (m)'''
+        x = (depth - self.z0)/self.dz
+        if x <= 0:
+            return self.first
+        i = int(x)
+        if i >= self.n-1:
+            return self.last
+        f = x - i
+        return tuple(a + (b-a)*f for a, b in zip(self.table[i], self.table[i+1]))
+
+
+class CellCachedBathymetry(object):
+    ''' Bilinear interpolation of gridded bathymetry
+
+    For scalar positions, the grid cell of the last position and its
+    corner depths are remembered, so that as long as the glider stays in
+    the cell, the water depth follows from plain arithmetic. The grid is
+    searched only when the glider leaves the cell.
+
+    Called as scipy's RegularGridInterpolator, with a tuple (lat, lon)
+    of scalars or arrays.
+
+    Parameters
+    ----------
+    lat : array (M,)
+        latitudes of the grid (monotonic)
+    lon : array (N,)
+        longitudes of the grid (monotonic)
+    bathymetry : array (M, N) or tilestore.TiledArray
+        water depth
+    bounds_error : bool
+        if True, a ValueError is raised for positions outside the grid. If False,
+        fill_value is returned for these positions.
+    fill_value : float
+        water depth outside the grid, if bounds_error is False
+
+    Example
+    -------
+
+    >>> bathymetry_fun = CellCachedBathymetry(lat, lon, bathymetry)
+    >>> water_depth = bathymetry_fun((54.2, 7.3))
+    >>> water_depths = bathymetry_fun((lats, lons))
+    '''
+    def __init__(self, lat, lon, bathymetry, bounds_error=True, fill_value=np.nan):
+        lat = np.asarray(lat, float)
+        lon = np.asarray(lon, float)
+        if not isinstance(bathymetry, tilestore.TiledArray):
+            bathymetry = np.asarray(bathymetry, float)
+        if lat[0] > lat[-1]:
+            lat = lat[::-1]
+            bathymetry = bathymetry[::-1]
+        if lon[0] > lon[-1]:
+            lon = lon[::-1]
+            bathymetry = bathymetry[:, ::-1]
+        self.lat = lat
+        self.lon = lon
+        self.bathymetry = bathymetry
+        self.bounds_error = bounds_error
+        self.fill_value = fill_value
+        self.cell = None # lat0, lat1, lon0, lon1 and the depths at the four corners
+
+    def __call__(self, xi):
+        lat, lon = xi
+        if not (isinstance(lat, (float, int)) and isinstance(lon, (float, int))):
+            return self.interpolate(lat, lon)
+        c = self.cell
+        if c is None or not (c[0] <= lat <= c[1] and c[2] <= lon <= c[3]):
+            c = self.__find_cell(lat, lon)
+            if c is None:
+                return self.fill_value
+            self.cell = c
+        lat0, lat1, lon0, lon1, d00, d01, d10, d11 = c
+        f = (lat-lat0)/(lat1-lat0)
+        g = (lon-lon0)/(lon1-lon0)
+        return (d00*(1-g) + d01*g)*(1-f) + (d10*(1-g) + d11*g)*f
+
+    def __find_cell(self, lat, lon):
+        if not (self.lat[0] <= lat <= self.lat[-1] and self.lon[0] <= lon <= self.lon[-1]):
+            if self.bounds_error:
+                raise ValueError(f"Position ({lat}, {lon}) is outside the bathymetry grid.")
+            return None
+        i = min(int(np.searchsorted(self.lat, lat, side='right'))-1, len(self.lat)-2)
+        j = min(int(np.searchsorted(self.lon, lon, side='right'))-1, len(self.lon)-2)
+        d = self.bathymetry
+        return (float(self.lat[i]), float(self.lat[i+1]), float(self.lon[j]), float(self.lon[j+1]),
+                float(d[i, j]), float(d[i, j+1]), float(d[i+1, j]), float(d[i+1, j+1]))
+
+    def interpolate(self, lat, lon):
+        ''' Returns the water depth for arrays of positions'''
+        lat, lon = np.broadcast_arrays(np.asarray(lat, float), np.asarray(lon, float))
+        inside = (lat >= self.lat[0]) & (lat <= self.lat[-1]) & (lon >= self.lon[0]) & (lon <= self.lon[-1])
+        if self.bounds_error and not np.all(inside):
+            raise ValueError("One or more positions are outside the bathymetry grid.")
+        i = np.clip(np.searchsorted(self.lat, lat, side='right')-1, 0, len(self.lat)-2)
+        j = np.clip(np.searchsorted(self.lon, lon, side='right')-1, 0, len(self.lon)-2)
+        f = (lat-self.lat[i])/(self.lat[i+1]-self.lat[i])
+        g = (lon-self.lon[j])/(self.lon[j+1]-self.lon[j])
+        d = self.bathymetry
+        r = (d[i, j]*(1-g) + d[i, j+1]*g)*(1-f) + (d[i+1, j]*(1-g) + d[i+1, j+1]*g)*f
+        return np.where(inside, r, self.fill_value)
+
+
 class GliderData(object):
     ''' Class to compute environmental data based on glider data.
 
@@ -56,7 +324,14 @@ class GliderData(object):
     NC_LAT_NAME = 'lat'
     NC_LON_NAME = 'lon'
     DBDREADER_CACHEDIR = None
-    
+    DBD_CACHE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'glidersim', 'dbd') # decoded dbd data. If None, kept in memory only.
+    DBD_PARAMETERS = ['sci_water_cond', 'sci_water_temp', 'sci_water_pressure',
+                      'm_water_vx', 'm_water_vy', 'm_final_water_vx', 'm_final_water_vy',
+                      'm_gps_lat', 'm_gps_lon', 'm_depth']
+    PROFILE_BINS = None # depth bin edges (m) of the CTD profiles. If None, 5 m bins.
+    PROFILE_VARIANCE = False # if True, self.profile.get_variance() is available.
+    PROFILE_RESOLUTION = 0.1 # (m) resolution of the table used to look up rho, SA and T.
+
     def __init__(self, glider_name, gliders_directory=None, bathymetry_filename=None,
                  glider_is_simulator=False, ekman_depth=None):
         self.u_fun = None
@@ -69,6 +344,7 @@ class GliderData(object):
         self._print_warnings = True
         self.glider_is_simulator = glider_is_simulator
         self.ekman_depth = ekman_depth
+        self.dbd_cache = None
         
     def reset(self):
         '''
@@ -80,17 +356,27 @@ class GliderData(object):
         ''' Read bathymetry from a netcdf file
 
         Sets self.bathymetry_fun
+
+        If self.bathymetry_filename is a tile store (see tilestore.convert()), the
+        bathymetry is read lazily from the store, which must contain the water depth.
         '''
+        if tilestore.is_tile_store(self.bathymetry_filename):
+            store = tilestore.TileStore(self.bathymetry_filename)
+            self.bathymetry_fun = CellCachedBathymetry(store.lat, store.lon, store.bathymetry)
+            return
         dataset = netCDF4.Dataset(self.bathymetry_filename, 'r', keepweakref=True)
         bathymetry = self.NC_ELEVATION_FACTOR * dataset.variables[self.NC_ELEVATION_NAME][...].copy()
         lat = dataset.variables[self.NC_LAT_NAME][...].copy()
         lon = dataset.variables[self.NC_LON_NAME][...].copy()
         dataset.close()
-        self.bathymetry_fun = RegularGridInterpolator((lat, lon), bathymetry)
+        self.bathymetry_fun = CellCachedBathymetry(lat, lon, bathymetry)
 
     def read_gliderdata(self,tm, lat, lon):
         path = os.path.join(self.gliders_directory, self.glider_name, 'from-glider', '%s*.[st]bd'%(self.glider_name))
-        dbd = dbdreader.MultiDBD(pattern=path, cacheDir=self.DBDREADER_CACHEDIR)
+        if self.dbd_cache is None:
+            # kept over resets, so that only new files are decoded.
+            self.dbd_cache = dbdcache.DbdCache(self.DBD_CACHE_DIRECTORY, cacheDir=self.DBDREADER_CACHEDIR)
+        dbd = self.dbd_cache.read(path, self.DBD_PARAMETERS)
         if self.glider_is_simulator:
             logger.warning("Warning: assuming simulator. I am making up CTD data!")
             t, P = dbd.get("m_depth")
@@ -127,37 +413,25 @@ class GliderData(object):
         dbd.close()
         rho = fast_gsw.rho(C*10, T, P*10, lon, lat)
         SA = fast_gsw.SA(C*10, T, P*10, lon, lat)
-        # compute the age of each measurement, and the resulting weight.
-        dt = tm - t
-        weights = np.exp(-dt/(self.AGE*3600))
-        # make binned averages
-        max_depth = P.max()*10
-        dz = 5
-        zi = np.arange(dz/2, max_depth+dz/2, dz)
-        bins = np.arange(0, max_depth+dz, dz)
-        bins[0]=-10
-        idx = np.digitize(P*10, bins)-1
-        rho_avg = np.zeros_like(zi, float)
-        SA_avg = np.zeros_like(zi, float)
-        T_avg = np.zeros_like(zi, float)
-        weights_sum = np.zeros_like(zi, float)
-        for _idx, _w, _rho, _SA, _T in zip(idx, weights, rho, SA, T):
-            try:
-                rho_avg[_idx] += _rho*_w
-                SA_avg[_idx] += _SA*_w
-                T_avg[_idx] += _T*_w
-                weights_sum[_idx] += _w
-            except IndexError:
-                continue
-        # if data are sparse, it can be that ther are gaps
-        j = np.unique(idx)
-        zj = zi[j]
-        rho_avg = rho_avg[j]/weights_sum[j]
-        SA_avg = SA_avg[j]/weights_sum[j]
-        T_avg = T_avg[j]/weights_sum[j]
-        self.rho_fun = interp1d(zj, rho_avg, bounds_error = False, fill_value=(rho_avg[0], rho_avg[-1]))
-        self.SA_fun = interp1d(zj, SA_avg, bounds_error = False, fill_value=(SA_avg[0], SA_avg[-1]))
-        self.T_fun = interp1d(zj, T_avg, bounds_error = False, fill_value=(T_avg[0], T_avg[-1]))
+        # make binned averages, weighted with the age of each measurement.
+        if self.PROFILE_BINS is None:
+            max_depth = P.max()*10
+            dz = 5
+            zi = np.arange(dz/2, max_depth+dz/2, dz)
+            bins = np.arange(0, max_depth+dz, dz)
+            bins[0]=-10
+        else:
+            bins = np.asarray(self.PROFILE_BINS, float)
+            zi = None
+        # if data are sparse, it can be that there are gaps, which are left out.
+        self.profile = RollingProfile(bins, self.AGE*3600, z=zi, variance=self.PROFILE_VARIANCE)
+        self.profile.update(t, P*10, rho=rho, SA=SA, T=T)
+        self.rho_fun = self.profile.interpolator('rho')
+        self.SA_fun = self.profile.interpolator('SA')
+        self.T_fun = self.profile.interpolator('T')
+        z = self.profile.get('rho')[0]
+        self.profile_table = ProfileTable(z, [self.profile.get(k)[1] for k in ('rho', 'SA', 'T')],
+                                          self.PROFILE_RESOLUTION)
 
         if self.u_fun is None: # not intialised yet, use last water current estimate available.
             if self.ekman_depth is None:
@@ -212,9 +486,7 @@ class GliderData(object):
             sys.exit()
         eta = 0
         # z is given as negative, but fitted against depth...
-        S = float(self.SA_fun(-z))
-        T = float(self.T_fun(-z))
-        rho = float(self.rho_fun(-z))
+        rho, S, T = self.profile_table(-z)
         return u, v, w, water_depth, eta, S, T, rho
 
 
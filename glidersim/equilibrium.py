@@ -0,0 +1,262 @@
+'''Steady-state glide table
+
+During most of a dive or climb, pitch, buoyancy and density change
+slowly, and the RK4 integration of the flight model merely reproduces
+the steady-state glide velocity. This module provides a table of
+steady-state glides, so that the flight model can relax the glider
+velocity analytically towards the steady state instead.
+
+Scaling the velocity with V = sqrt(2|FBg|/(rho S)), where FBg is the net
+buoyancy force, shows that the steady-state glide depends on pitch and the
+sign of FBg only, given the drag and lift coefficients. The dependence on
+buoyancy change, density and pressure enters through FBg and rho, and is
+computed exactly. The table is therefore one-dimensional, and contains
+for each pitch and each sign of FBg:
+
+* the scaled horizontal and vertical steady-state velocities
+* the scaled Jacobian of the equations of motion at the steady state,
+  which governs the decay of small deviations from the steady state
+
+The table is computed on first use for a given set of model coefficients,
+and cached in memory and on disk (see CACHE_DIRECTORY).
+
+Use of the table is enabled through the flight model:
+
+>>> glider.gliderflight_model.set_equilibrium_tolerance(1e-3)
+'''
+import hashlib
+import math
+import os
+
+import numpy as np
+
+from . import common
+
+logger = common.get_logger(name="equilibrium")
+
+# Directory where tables are stored. If None, tables are not stored on disk.
+CACHE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'glidersim')
+
+N_PITCH = 1801 # number of pitch values in the table (0.1 degree resolution)
+MIN_FORCE = 1e-3 # (N) below this net buoyancy force the table is not used
+
+_tables = {} # tables in memory, by key
+
+
+class EquilibriumTable(object):
+    ''' Table of steady-state glides as a function of pitch
+
+    Parameters
+    ----------
+    pitch : array (N,)
+        equidistant pitch values (rad)
+    tables : dict
+        for sign of net buoyancy +1 (ascending) and -1 (descending), a tuple of
+        arrays (N,) with the scaled horizontal and vertical velocities and the
+        elements J11, J12, J21 and J22 of the scaled Jacobian. Invalid entries
+        (no stable steady state) are NaN.
+    '''
+    def __init__(self, pitch, tables):
+        self.pitch = np.asarray(pitch, float)
+        self.pitch0 = float(self.pitch[0])
+        self.dpitch = float(self.pitch[1]-self.pitch[0])
+        self.n = len(self.pitch)
+        # python lists, which are faster to index than arrays in the hot path.
+        self.ascending = tuple(np.asarray(a, float).tolist() for a in tables[1])
+        self.descending = tuple(np.asarray(a, float).tolist() for a in tables[-1])
+
+    def lookup(self, pitch, sign):
+        ''' Returns the scaled steady-state velocities and Jacobian for pitch
+
+        Returns
+        -------
+        tuple of 6 floats or None
+            scaled horizontal and vertical velocity and Jacobian elements J11, J12,
+            J21 and J22, or None if there is no stable steady state for this pitch.
+        '''
+        x = (pitch - self.pitch0)/self.dpitch
+        if not 0 <= x < self.n-1:
+            return None
+        i = int(x)
+        f = x - i
+        u, w, J11, J12, J21, J22 = self.ascending if sign > 0 else self.descending
+        j = i+1
+        a = J11[i] + (J11[j]-J11[i])*f
+        if a != a: # NaN
+            return None
+        return (u[i] + (u[j]-u[i])*f, w[i] + (w[j]-w[i])*f, a,
+                J12[i] + (J12[j]-J12[i])*f, J21[i] + (J21[j]-J21[i])*f, J22[i] + (J22[j]-J22[i])*f)
+
+    def relax(self, uh, w, pitch, rho, FBg, S, mg, h, tolerance):
+        ''' Advances a glider close to its steady state by a time step h
+
+        Parameters
+        ----------
+        uh, w : float
+            horizontal and vertical velocity (m/s)
+        pitch : float
+            pitch (rad)
+        rho : float
+            density (kg m^{-3})
+        FBg : float
+            net buoyancy force (N)
+        S : float
+            wing surface area (m^2)
+        mg : float
+            mass of the glider (kg)
+        h : float
+            time step (s)
+        tolerance : float
+            maximum difference (m/s) of the velocities with the steady state
+
+        Returns
+        -------
+        (float, float, float, float) or None
+            horizontal and vertical displacement (m) and velocity (m/s), or None if
+            the glider is not within tolerance of a stable steady state.
+        '''
+        if abs(FBg) < MIN_FORCE:
+            return None
+        r = self.lookup(pitch, FBg)
+        if r is None:
+            return None
+        u_hat, w_hat, a, b, c, d = r
+        V = math.sqrt(2*abs(FBg)/(rho*S))
+        uh_eq = V*u_hat
+        w_eq = V*w_hat
+        du = uh - uh_eq
+        dw = w - w_eq
+        if abs(du) > tolerance or abs(dw) > tolerance:
+            return None
+        # The deviations evolve as exp(A) with A = J h, evaluated in closed form for 2x2 matrices.
+        scale = abs(FBg)/(mg*V)*h
+        a *= scale
+        b *= scale
+        c *= scale
+        d *= scale
+        s = (a+d)/2
+        discriminant = (a-s)**2 + b*c
+        if discriminant > 0:
+            q = math.sqrt(discriminant)
+            ch = math.cosh(q)
+            sh = math.sinh(q)/q
+        elif discriminant < 0:
+            q = math.sqrt(-discriminant)
+            ch = math.cos(q)
+            sh = math.sin(q)/q
+        else:
+            ch = sh = 1.
+        es = math.exp(s)
+        du_new = es*((ch + sh*(a-s))*du + sh*b*dw)
+        dw_new = es*(sh*c*du + (ch + sh*(d-s))*dw)
+        # displacement of the deviations: h A^{-1} (exp(A) - I)
+        ru = du_new - du
+        rw = dw_new - dw
+        det = a*d - b*c
+        return (uh_eq*h + h*(d*ru - b*rw)/det, w_eq*h + h*(a*rw - c*ru)/det,
+                uh_eq + du_new, w_eq + dw_new)
+
+
+def table_key(gfm, n=N_PITCH):
+    ''' Returns the parameters of flight model gfm that determine its table'''
+    return tuple(float(v) for v in (gfm.Cd0, gfm.Cd1, gfm.aw + gfm.ah,
+                                    gfm.alpha_linear, gfm.alpha_stall, gfm.k1, gfm.k2)) + (n,)
+
+
+def compute_table(gfm, n=N_PITCH, dtau=0.25, max_iterations=1000, residual=1e-12):
+    ''' Computes the table of steady-state glides for flight model gfm
+
+    The steady states are found by integrating the scaled equations of
+    motion in pseudo time until the forces vanish. Steady states are
+    stable if both eigenvalues of the Jacobian have negative real parts.
+
+    Parameters
+    ----------
+    gfm : GliderFlightModel
+        flight model
+    n : int
+        number of pitch values between -pi/2 and pi/2
+
+    Returns
+    -------
+    EquilibriumTable
+    '''
+    pitch = np.linspace(-np.pi/2, np.pi/2, n)
+    # scaled inverted mass matrix (mg=1)
+    k1 = gfm.k1
+    k2 = gfm.k2
+    C2 = np.cos(pitch)**2
+    CS = np.cos(pitch)*np.sin(pitch)
+    denom = (1+k1)*(1+k2)
+    M = (((k2-k1)*C2 + k1 + 1)/denom, (k2-k1)*CS/denom, (k2-k1)*CS/denom, (-(k2-k1)*C2 + k2 + 1)/denom)
+    rho = 2/gfm.S # so that the dynamic pressure equals U**2
+    tables = {}
+    with np.errstate(all='ignore'):
+        for sign in (1, -1):
+            def forces(u, w, h=1.):
+                return gfm._compute_k_array(u, w, rho, pitch, float(sign), *M, h, gfm.Cd0)
+            u = np.cos(pitch)
+            w = np.sin(pitch)
+            converged = -1
+            for i in range(max_iterations):
+                k1_u, k1_w = forces(u, w, dtau)
+                k2_u, k2_w = forces(u + k1_u/2, w + k1_w/2, dtau)
+                k3_u, k3_w = forces(u + k2_u/2, w + k2_w/2, dtau)
+                k4_u, k4_w = forces(u + k3_u, w + k3_w, dtau)
+                u = u + (k1_u + 2*k2_u + 2*k3_u + k4_u)/6
+                w = w + (k1_w + 2*k2_w + 2*k3_w + k4_w)/6
+                if i%250 == 249:
+                    # stop when no more points converge (some have no steady state)
+                    n_converged = np.count_nonzero(np.hypot(*forces(u, w)) < residual)
+                    if n_converged == converged:
+                        break
+                    converged = n_converged
+            F = np.hypot(*forces(u, w))
+            # Jacobian by central differences
+            e = 1e-6
+            Ju = (np.array(forces(u+e, w)) - np.array(forces(u-e, w)))/(2*e)
+            Jw = (np.array(forces(u, w+e)) - np.array(forces(u, w-e)))/(2*e)
+            J = (Ju[0], Jw[0], Ju[1], Jw[1])
+            trace = J[0] + J[3]
+            det = J[0]*J[3] - J[1]*J[2]
+            valid = (F < 1e-9) & (u > 0) & (trace < 0) & (det > 0)
+            tables[sign] = tuple(np.where(valid, a, np.nan) for a in (u, w) + J)
+    return EquilibriumTable(pitch, tables)
+
+
+def _cache_filename(key):
+    digest = hashlib.sha1(repr(key).encode('utf8')).hexdigest()[:16]
+    return os.path.join(CACHE_DIRECTORY, f"equilibrium-{digest}.npz")
+
+
+def get_table(gfm, n=N_PITCH):
+    ''' Returns the table of steady-state glides for flight model gfm
+
+    The table is read from memory or disk if available, and computed and
+    stored otherwise.
+    '''
+    key = table_key(gfm, n)
+    try:
+        return _tables[key]
+    except KeyError:
+        pass
+    table = None
+    fn = _cache_filename(key) if CACHE_DIRECTORY else None
+    if fn and os.path.exists(fn):
+        try:
+            with np.load(fn) as data:
+                if tuple(data['key'].tolist()) == key:
+                    table = EquilibriumTable(data['pitch'], {1:data['ascending'], -1:data['descending']})
+        except (OSError, KeyError, ValueError):
+            logger.warning("Could not read equilibrium table %s.", fn)
+    if table is None:
+        table = compute_table(gfm, n)
+        if fn:
+            try:
+                os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+                np.savez(fn, key=np.array(key, float), pitch=table.pitch,
+                         ascending=np.array(table.ascending), descending=np.array(table.descending))
+            except OSError:
+                logger.warning("Could not write equilibrium table %s.", fn)
+    _tables[key] = table
+    return table
@@ -11,6 +11,7 @@ from latlonUTM import UTM2latlon
 from latlon import convertToNmea, convertToDecimal
 
 from . import getm_nc
+from . import tilestore
 
 
 class Bathymetry(object):
@@ -43,6 +44,13 @@ class Bathymetry(object):
             raise ValueError("Don't know how to get the bathymetry. Shapes don't match.")
     
     def __setBathymetry(self,fn):
+        if tilestore.is_tile_store(fn):
+            # masked, as the bathymetry read from the netcdf file
+            store=tilestore.TileStore(fn,masked=True)
+            self.increment_latitude=int(np.all(np.diff(store.lat)>0))*2-1
+            self.increment_longitude=int(np.all(np.diff(store.lon)>0))*2-1
+            Bathymetry.BATHYMETRY=store.bathymetry
+            return
         # select a file that has bathymetry info:
         nc=getm_nc.NcGetm(fn)
         bathymetry=nc.var(self.bathymetry)[...]
@@ -76,6 +84,12 @@ class Bathymetry(object):
         return i,j
 
     def __getGrids(self,fn):
+        if tilestore.is_tile_store(fn):
+            # read-only views, which take no memory for large grids
+            store=tilestore.TileStore(fn)
+            X=np.broadcast_to(store.lon,(len(store.lat),len(store.lon)))
+            Y=np.broadcast_to(store.lat[:,np.newaxis],X.shape)
+            return X,Y
         nc=getm_nc.NcGetm(fn)
         x=nc.var(self.longitude)[:]
         y=nc.var(self.latitude)[:]
@@ -162,6 +176,9 @@ class GetmEnvironment(object):
     def __setBathymetry(self):
         # select a file that has bathymetry info:
         fn=GetmEnvironment.NCBATHYMETRY
+        if tilestore.is_tile_store(fn):
+            GetmEnvironment.BATHYMETRY=tilestore.TileStore(fn,masked=True).bathymetry
+            return
         nc=getm_nc.NcGetm(fn)
         GetmEnvironment.BATHYMETRY=nc.var('bathymetry')[...]
         #lonc=nc.var('lonc')[...]
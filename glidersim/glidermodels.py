@@ -1,22 +1,80 @@
 from collections import deque
 import glob
 import math
-import random
 
 import arrow
 import numpy as np
 
-from latlonUTM import UTM2latlon, latlon2UTM
-from latlon import convertToNmea, convertToDecimal
+from latlonUTM import latlon2UTM
+from latlon import convertToDecimal
 import gliderflight
 
 from . import common
+from . import equilibrium
+from .gliderstate import GliderState, CLOCKS
+from .projection import LocalProjection
 
 logger = common.get_logger("glidermodels")
 
 class GliderException(Exception): pass
 
 
+class NoiseStream(object):
+    ''' Random numbers for actuator and fin noise
+
+    Numbers are drawn from a numpy Generator in blocks, and handed out
+    one at a time, which is much cheaper than calling the generator for
+    each number. With a given seed, the sequence of numbers is reproducible.
+
+    Parameters
+    ----------
+    seed : int, numpy.random.SeedSequence or None
+        seed of the generator. If None, fresh entropy is used.
+    enabled : bool
+        if False, no noise is generated: uniform() returns 0.5 and normal() returns 0.
+    block_size : int
+        number of random numbers generated at a time
+    '''
+    def __init__(self, seed=None, enabled=True, block_size=4096):
+        self.rng = np.random.default_rng(seed)
+        self.enabled = enabled
+        self.block_size = block_size
+        self._uniform = []
+        self._normal = []
+        self._i_uniform = 0
+        self._i_normal = 0
+
+    def uniform(self, size=None):
+        ''' Returns a random number (or an array of shape size) from U(0, 1)'''
+        if not self.enabled:
+            return 0.5 if size is None else np.full(size, 0.5)
+        if size is not None:
+            return self.rng.random(size)
+        try:
+            x = self._uniform[self._i_uniform]
+        except IndexError:
+            self._uniform = self.rng.random(self.block_size).tolist()
+            self._i_uniform = 0
+            x = self._uniform[0]
+        self._i_uniform += 1
+        return x
+
+    def normal(self, size=None):
+        ''' Returns a random number (or an array of shape size) from N(0, 1)'''
+        if not self.enabled:
+            return 0. if size is None else np.zeros(size)
+        if size is not None:
+            return self.rng.standard_normal(size)
+        try:
+            x = self._normal[self._i_normal]
+        except IndexError:
+            self._normal = self.rng.standard_normal(self.block_size).tolist()
+            self._i_normal = 0
+            x = self._normal[0]
+        self._i_normal += 1
+        return x
+
+
 class GPS(object):
     def __init__(self,acquiretime=30):
         self.acquiretime=acquiretime
@@ -44,6 +102,18 @@ class GPS(object):
             self.status*=(-1)
         return self.status
 
+    def next_change_time(self):
+        ''' Returns the time after which the status changes, while the glider stays at the surface
+
+        The status is that of the last call of get_status(). Returns -inf if
+        the change cannot be predicted, and inf if the status does not change.
+        '''
+        if not self.time or abs(self.status)==2:
+            return -math.inf
+        if self.status==0:
+            return math.inf
+        return self.time+self.acquiretime
+
 
 
 class PID(object):
@@ -91,6 +161,7 @@ class LinearActuator(object):
         self.deadbandWidth=deadbandWidth
         self.position_target=0.
         self.status=0   # 1 running <0 error, todo
+        self.noise=NoiseStream() # replaced by the glider model's stream, see BaseGliderModel.set_noise()
 
     def set_commanded(self,value):
         self.position_target=value
@@ -115,7 +186,7 @@ class LinearActuator(object):
             else:
                 factor=1
 
-            speed+=(random.random()-0.5)*speed*0.05
+            speed+=(self.noise.uniform()-0.5)*speed*0.05
             self.position+=speed*dt*factor
             delta_position=self.position_target-self.position
             if (speed>0 and delta_position<=0) or \
@@ -194,6 +265,17 @@ class SlocumDeepExtendedHardware(object):
        
 
 class BaseGliderModel(object):
+    # glider state parameters that are advanced by dt every time step
+    CLOCKS = CLOCKS
+    # parameters that advance with the time, that change every time step, and that change
+    # when the environment is sampled, while the glider floats at the surface with idle
+    # actuators (see surface_step()).
+    SURFACE_CLOCKS = CLOCKS + ('samedepth_for',)
+    SURFACE_DRIFTING = ('m_heading', 'm_heading_rate', 'm_lmc_x', 'm_lmc_y', 'm_lat', 'm_lon',
+                        'x_lmc_x', 'x_lmc_y', 'x_lat', 'x_lon', 'm_dist_to_wpt')
+    SURFACE_ENVIRONMENT = ('temp', 'salt', 'water_depth', 'rho', 'x_u', 'x_v', 'x_w', 'x_water_depth',
+                           'm_altitude')
+    
     def __init__(self):
         self.gps=GPS()
         self.gliderflight_model =  GliderFlightModel()
@@ -205,6 +287,11 @@ class BaseGliderModel(object):
         #
         self.environment_model = None # to be set later.
         self._speed_deque = deque(maxlen=60//4) # used for moving avg of speed.
+        self.projection_tolerance = 0.001 # m
+        self._projection = None
+        self.noise = None # NoiseStream, set by set_noise()
+        self._surface_environment = None # (time, environmental data) used by surface_step()
+        self._adaptive_steps = 1 # number of time steps of the last adaptive step
         
     def initialise_gliderflightmodel(self, Cd0, Vg, mg, T1=1235, T2=-28.8, T3=0.14, T4=0, **kwds):
         gfm = self.gliderflight_model
@@ -216,6 +303,22 @@ class BaseGliderModel(object):
             gfm.define(**kwds)
         
                 
+    def set_noise(self, seed=None, enabled=True):
+        ''' Sets a new noise stream for the actuators and the fin model
+
+        Parameters
+        ----------
+        seed : int or None
+            seed of the random number generator. Simulations with the same seed
+            are identical. If None, fresh entropy is used.
+        enabled : bool
+            if False, actuators and fin model are run without noise.
+        '''
+        self.noise = NoiseStream(seed, enabled)
+        for actuator in (self.buoyancypump, self.pitchmotor, self.finmotor):
+            actuator.noise = self.noise
+        self.gliderflight_model.fin_model.noise_stream = self.noise
+
     def initialise_gliderstate(self,datestr,timestr,lat,lon, mission_start):
         self.lmc_x = 0
         self.lmc_y = 0
@@ -226,12 +329,12 @@ class BaseGliderModel(object):
         gs['m_depth']=0
         gs['m_present_secs_into_mission']=0.
         gs['samedepth_for']=0
-        # Note the API of arrow.timestamp changed. 3.10+ it is a function
+        # Note the API of arrow.timestamp changed. 1.0+ it is a function
         if datestr:
             if timestr:
-                gs['m_present_time'] = arrow.get(" ".join([datestr, timestr]), "YYYYMMDD HH:mm").timestamp
+                gs['m_present_time'] = arrow.get(" ".join([datestr, timestr]), "YYYYMMDD HH:mm").timestamp()
             else:
-                gs['m_present_time'] = arrow.get(datestr, "YYYYMMDD").timestamp
+                gs['m_present_time'] = arrow.get(datestr, "YYYYMMDD").timestamp()
         else:
             gs['m_present_time']=0.
         gs['stack']=1 # number of commands given.
@@ -320,25 +423,32 @@ class BaseGliderModel(object):
         gs['x_lmc_x_wpt_calc'] = 0 # stores start point of transect, used to calculate heading from waypoints.
         gs['x_lmc_y_wpt_calc'] = 0
         gs['_is_grounded'] = 0 # checked when needed to stop simulation if glider ran aground. Set in update.
-        self.gs=gs
+        self.gs=GliderState(gs)
 
 
+    def get_projection(self):
+        ''' Returns the LocalProjection for the current utm_0
+
+        A new projection is made whenever utm_0 is changed (by the behaviors).
+        '''
+        utm_0 = self.gs['utm_0']
+        projection = self._projection
+        if projection is None or projection.utm_0 != utm_0:
+            projection = self._projection = LocalProjection(utm_0, self.projection_tolerance)
+        return projection
+        
     def translate_lmc_latlon(self,x,y):
-        (east,north),z0,z1=self.gs['utm_0']
-        east+=x
-        north+=y
-        latlon=UTM2latlon(z0,z1,east,north)
-        lat=convertToNmea(latlon[0])
-        lon=convertToNmea(latlon[1])
-        return lat,lon
-
-    def get_environmental_data(self, t, lat, lon, z):
+        return self.get_projection().nmea(x, y)
+
+    def get_environmental_data(self, t, lat, lon, z, decimal=False):
         '''Method to get environmental data. 
         Should be provided by a subclassed instance.
         For now, return some sensible values to keep going.
 
         When subclassed, this method should check for the
         reasonability of the values to be returned.
+
+        lat and lon are in NMEA format, or in decimal degrees if decimal is True.
         '''
 
         if self.environment_model is None:
@@ -349,14 +459,200 @@ class BaseGliderModel(object):
             water_depth = 40
             rho = 1025
             return u_ocean, v_ocean, w_ocean, water_depth, eta, S, T, rho
+        elif decimal:
+            return self.environment_model.get_data(t, lat, lon, z)
         else:
             declat = convertToDecimal(lat)
             declon = convertToDecimal(lon)
             return self.environment_model.get_data(t, declat, declon, z)
     
-    def update(self,t,dt):
-        self.gs['m_gps_status']=self.gps.get_status(self.gs['m_present_time'],self.z)
-        if self.gs['c_gps_on']: 
+    def is_quiescent(self):
+        ''' Returns True if the glider floats at the surface, with all actuators idle
+
+        In this state, the flight model leaves the glider at rest at the surface, and
+        update() can be replaced by the much cheaper surface_step().
+        '''
+        gs = self.gs
+        if self.z != 0 or gs['x_w'] != 0 or gs['x_eastward_glider_velocity'] != 0 or \
+           gs['x_northward_glider_velocity'] != 0 or gs['x_upward_glider_velocity'] != 0:
+            return False
+        return self.actuators_idle()
+
+    def actuators_idle(self):
+        ''' Returns True if none of the actuators is moving, or will start moving'''
+        for actuator in (self.pitchmotor, self.buoyancypump, self.finmotor):
+            if actuator.status != 0 or abs(actuator.position_target-actuator.position) > actuator.deadbandWidth:
+                return False
+        return True
+
+    def adaptive_steps(self, dt, max_steps, tolerance):
+        ''' Returns the number of time steps dt that can be taken as a single step
+
+        While actuators move, a single time step is returned. Otherwise, the
+        number of steps is limited by the local error of the flight model,
+        estimated by step doubling, which should not exceed tolerance per
+        second of the step, so that the accumulated error over a dive does
+        not depend on the number of steps.
+
+        Parameters
+        ----------
+        dt : float
+            time step (s)
+        max_steps : int
+            maximum number of steps
+        tolerance : float
+            maximum local error per unit time (m/s)
+        '''
+        if max_steps <= 1 or not self.actuators_idle():
+            return 1
+        gs = self.gs
+        state = (self.x, self.y, self.z,
+                 gs['x_eastward_glider_velocity'],
+                 gs['x_northward_glider_velocity'],
+                 gs['x_upward_glider_velocity'],
+                 gs['m_pitch'], gs['rho'], gs['m_ballast_pumped'], gs['m_heading'])
+        steps = min(max_steps, 2*self._adaptive_steps)
+        # a glider under water should not reach the surface during the step.
+        w = gs['x_upward_glider_velocity'] + gs['x_w']
+        z_surface = -self.gliderflight_model.max_depth_considered_surface
+        while steps > 1 and self.z < 0 and self.z + w*steps*dt > z_surface:
+            steps //= 2
+        while steps > 1 and self.gliderflight_model.step_error(*state, steps*dt) > tolerance*steps*dt:
+            steps //= 2
+        self._adaptive_steps = steps
+        return steps
+
+    def surface_change_times(self, interval):
+        ''' Returns the earliest time at which each parameter, other than the
+        clocks, may change while the glider floats at the surface (see surface_step())
+
+        Parameters
+        ----------
+        interval : float
+            interval at which the environment is sampled (s)
+
+        Returns
+        -------
+        dict
+            {parameter: time}
+        '''
+        t = self.gs['m_present_time']
+        if self._surface_environment is None:
+            t_sample = t
+        else:
+            t_sample = max(t, self._surface_environment[0] + interval)
+        change_times = dict.fromkeys(self.SURFACE_DRIFTING, t)
+        change_times.update(dict.fromkeys(self.SURFACE_ENVIRONMENT, t_sample))
+        return change_times
+
+    def surface_step(self, t, dt, interval, steps=1):
+        ''' Advances a glider at rest at the surface (see is_quiescent()) by steps time steps dt
+
+        Only the clocks, the GPS, the heading and the drift with the surface
+        current are updated. The environment model is queried every interval
+        seconds only. The heading is integrated with time step dt, and the GPS
+        status is that of the last time step. If interval<=dt and steps==1,
+        the result is the same as that of update().
+        '''
+        gs = self.gs
+        m_gps_status = gs['m_gps_status'] = self.gps.get_status(gs['m_present_time']+(steps-1)*dt,self.z)
+        if gs['c_gps_on']:
+            self.gps.enable()
+        else:
+            self.gps.disable()
+        projection = self.get_projection()
+        if self._surface_environment is None or t - self._surface_environment[0] >= interval:
+            realLat,realLon=projection(self.x,self.y)
+            data = self.get_environmental_data(t,realLat,realLon,self.z, decimal=True)
+            self._surface_environment = (t, data)
+            u_water, v_water, w_water, water_depth, eta, S, T, rho = data
+            gs['temp']=T
+            gs['salt']=S
+            gs['water_depth']=water_depth
+            gs['rho']= rho
+            gs['x_u']=u_water
+            gs['x_v']=v_water
+            gs['x_w']=w_water
+            gs['x_water_depth']=water_depth+eta
+            gs['m_altitude']=water_depth-gs['m_depth']
+        else:
+            u_water, v_water = gs['x_u'], gs['x_v']
+        m_heading, m_heading_rate, m_fin, m_speed = gs['m_heading'], gs['m_heading_rate'], gs['m_fin'], gs['m_speed']
+        for i in range(steps):
+            m_heading, m_heading_rate = self.gliderflight_model.compute_heading_from_fin(gs['m_present_time'],
+                                                                                        m_heading,
+                                                                                        m_heading_rate,
+                                                                                        m_fin,
+                                                                                        m_speed)
+        gs['m_heading'] = m_heading
+        gs['m_heading_rate'] = m_heading_rate
+        self.x += u_water * dt * steps
+        self.y += v_water * dt * steps
+        if m_gps_status==0:
+            self.lmc_x=self.x
+            self.lmc_y=self.y
+            n_corrections = 1
+        else:
+            n_corrections = steps
+        if gs['u_use_current_correction']:
+            self.lmc_x += dt * gs['m_water_vx'] * n_corrections
+            self.lmc_y += dt * gs['m_water_vy'] * n_corrections
+        gs['m_lmc_x']=self.lmc_x
+        gs['m_lmc_y']=self.lmc_y
+        gs.defer(('m_lat', 'm_lon'), projection.nmea, self.lmc_x, self.lmc_y)
+        gs['samedepth_for']+=dt*steps
+        gs.increment(self.CLOCKS, dt*steps)
+        gs['x_lmc_x']=self.x
+        gs['x_lmc_y']=self.y
+        gs.defer(('x_lat', 'x_lon'), projection.nmea, self.x, self.y)
+
+    def update(self, t, dt, steps=1):
+        ''' Advances the glider by one time step dt
+
+        If steps>1, the glider is advanced by steps time steps dt, in a single
+        step of steps*dt (see adaptive_steps()).
+        '''
+        if steps == 1:
+            self.__update(t, dt, 1)
+            return
+        gfm = self.gliderflight_model
+        gfm.dt = steps*dt
+        try:
+            self.__update(t, steps*dt, steps)
+        finally:
+            gfm.dt = dt
+
+    def __integrate_heading(self, dt, steps, m_fin):
+        # Integrates the heading over steps time steps dt, as update() would do step by step. The
+        # speed, which is not known yet, is extrapolated from the last two samples of the moving
+        # average. Returns the heading and heading rate, and the mean heading over the steps.
+        gfm = self.gliderflight_model
+        gs = self.gs
+        m_heading, m_heading_rate, m_speed = gs['m_heading'], gs['m_heading_rate'], gs['m_speed']
+        speeds = deque(self._speed_deque, maxlen=self._speed_deque.maxlen)
+        ds = speeds[-1] - speeds[-2] if len(speeds) > 1 else 0.
+        headings = []
+        gfm.dt = dt
+        try:
+            for i in range(steps):
+                m_heading, m_heading_rate = gfm.compute_heading_from_fin(gs['m_present_time'], m_heading,
+                                                                         m_heading_rate, m_fin, m_speed)
+                headings.append(m_heading)
+                if speeds:
+                    speeds.append(speeds[-1] + ds)
+                    m_speed = np.mean(speeds)
+        finally:
+            gfm.dt = dt*steps
+        # the mean of the (unwrapped) headings of the two middle steps.
+        h0, h1 = np.unwrap(headings[(steps-1)//2:steps//2+1])[[0, -1]]
+        return m_heading, m_heading_rate, ((h0 + h1)/2) % (2*np.pi)
+
+    def __update(self, t, dt, steps):
+        gs = self.gs
+        self._surface_environment = None
+        # for steps>1, the status is that of the last time step.
+        m_gps_status = gs['m_gps_status'] = self.gps.get_status(gs['m_present_time'] + dt*(steps-1)/steps,self.z)
+        if gs['c_gps_on']: 
             self.gps.enable() 
         else: 
             self.gps.disable()
@@ -365,68 +661,107 @@ class BaseGliderModel(object):
         self.buoyancypump.actuate(dt)
         self.finmotor.actuate(dt)
         #
-        self.gs['m_ballast_pumped']=self.buoyancypump.get_measured()
-        self.gs['m_fin']=self.finmotor.get_measured()
-        self.gs['m_battpos']=self.pitchmotor.get_measured()
+        m_ballast_pumped = gs['m_ballast_pumped'] = self.buoyancypump.get_measured()
+        m_fin = gs['m_fin'] = self.finmotor.get_measured()
+        m_battpos = gs['m_battpos'] = self.pitchmotor.get_measured()
         #
-        realLat,realLon=self.translate_lmc_latlon(self.x,self.y)
-        u_water, v_water, w_water, water_depth, eta, S, T, rho = self.get_environmental_data(t,realLat,realLon,self.z)
+        projection = self.get_projection()
+        if steps == 1:
+            t_env, x, y, z = t, self.x, self.y, self.z
+        else:
+            # the environment is sampled where the glider is expected halfway the time
+            # steps, where it is sampled on average when the time steps are taken one by one.
+            lead = dt*(steps-1)/(2*steps)
+            t_env = t + lead
+            x = self.x + (gs['x_eastward_glider_velocity'] + gs['x_u'])*lead
+            y = self.y + (gs['x_northward_glider_velocity'] + gs['x_v'])*lead
+            z = self.z + (gs['x_upward_glider_velocity'] + gs['x_w'])*lead
+        realLat,realLon=projection(x,y)
+        u_water, v_water, w_water, water_depth, eta, S, T, rho = self.get_environmental_data(t_env,realLat,realLon,z,
+                                                                                             decimal=True)
 
         # set glider parameters
-        self.gs['temp']=T
-        self.gs['salt']=S
-        self.gs['water_depth']=water_depth
-        self.gs['rho']= rho
-        self.gs['x_u']=u_water
-        self.gs['x_v']=v_water
-        self.gs['x_w']=w_water
-        self.gs['x_water_depth']=water_depth+eta
+        gs['temp']=T
+        gs['salt']=S
+        gs['water_depth']=water_depth
+        gs['rho']= rho
+        gs['x_u']=u_water
+        gs['x_v']=v_water
+        gs['x_w']=w_water
+        gs['x_water_depth']=water_depth+eta
 
         # for the CTD, we have only temperature. We would need to back-calculate C
         
         # compute heading and heading_rate from fin position, and pitch:
 
-        p = [self.gs[i] for i in 'm_present_time m_heading m_heading_rate m_fin m_speed'.split()]
-        m_heading, m_heading_rate = self.gliderflight_model.compute_heading_from_fin(*p)
-
-        p = [self.gs[i] for i in 'm_battpos m_ballast_pumped m_pressure'.split()]
-        m_pitch = self.gliderflight_model.compute_pitch_from_battpos_buoyancy_drive(*p)
+        if steps == 1:
+            m_heading, m_heading_rate = self.gliderflight_model.compute_heading_from_fin(gs['m_present_time'],
+                                                                                        gs['m_heading'],
+                                                                                        gs['m_heading_rate'],
+                                                                                        m_fin,
+                                                                                        gs['m_speed'])
+            heading = m_heading
+        else:
+            # the heading is integrated with time step dt, and the mean heading is used for
+            # the single step of the flight model.
+            m_heading, m_heading_rate, heading = self.__integrate_heading(dt/steps, steps, m_fin)
+        m_pitch = self.gliderflight_model.compute_pitch_from_battpos_buoyancy_drive(m_battpos,
+                                                                                    m_ballast_pumped,
+                                                                                    gs['m_pressure'])
 
         # update glider state with new variables:
 
-        self.gs['m_heading'] = m_heading
-        self.gs['m_heading_rate'] = m_heading_rate
-        self.gs['m_pitch'] = m_pitch
+        gs['m_heading'] = m_heading
+        gs['m_heading_rate'] = m_heading_rate
+        gs['m_pitch'] = m_pitch
 
         # compute the new dynamic status of the glider.
+        # for steps>1, it is integrated from the depth halfway the time steps, which sets the
+        # pressure, and shifted back.
         tmp = self.gliderflight_model.step_integrate(self.x,
                                                      self.y,
-                                                     self.z,
-                                                     self.gs['x_eastward_glider_velocity'],
-                                                     self.gs['x_northward_glider_velocity'],
-                                                     self.gs['x_upward_glider_velocity'],
+                                                     z,
+                                                     gs['x_eastward_glider_velocity'],
+                                                     gs['x_northward_glider_velocity'],
+                                                     gs['x_upward_glider_velocity'],
                                                      m_pitch,
                                                      rho,
-                                                     self.gs['m_ballast_pumped'],
-                                                     m_heading)
+                                                     m_ballast_pumped,
+                                                     heading)
         _x, _y, _z, _u, _v, _w = tmp
+        if steps > 1 and _z < 0:
+            _z += self.z - z
         # check and set when glider grounded.
         if _z + water_depth + eta < 0:
             # grounded.
             _u = _v = _w = 0
-            self.gs['_is_grounded'] = 1
+            gs['_is_grounded'] = 1
         else:
-            self.gs['_is_grounded'] = 0
+            gs['_is_grounded'] = 0
 
-        self.x, self.y, self.z, self.gs['x_eastward_glider_velocity'],\
-            self.gs['x_northward_glider_velocity'], self.gs['x_upward_glider_velocity'] = _x, _y, _z, _u, _v, _w
-        speed = (self.gs['x_eastward_glider_velocity']**2 + self.gs['x_northward_glider_velocity']**2)**0.5
+        self.x, self.y, self.z = _x, _y, _z
+        if steps == 1:
+            u_dr, v_dr = _u, _v
+        else:
+            # dead reckoned with the velocities of the time steps, interpolated linearly.
+            f = (steps+1)/(2*steps)
+            u_dr = gs['x_eastward_glider_velocity'] + (_u - gs['x_eastward_glider_velocity'])*f
+            v_dr = gs['x_northward_glider_velocity'] + (_v - gs['x_northward_glider_velocity'])*f
+        gs['x_eastward_glider_velocity'] = _u
+        gs['x_northward_glider_velocity'] = _v
+        gs['x_upward_glider_velocity'] = _w
+        speed = (_u**2 + _v**2)**0.5
         
-        self.gs['x_speed']=speed
+        gs['x_speed']=speed
         # use Kalman filter to estiamte running average
         if speed>0: # not at the surface
-            self._speed_deque.append(speed)
-            self.gs['m_speed']=np.mean(self._speed_deque)
+            if steps == 1 or not self._speed_deque:
+                self._speed_deque.append(speed)
+            else:
+                # one sample per time step, interpolated, to keep the averaging window the same.
+                previous = self._speed_deque[-1]
+                self._speed_deque.extend(previous + (speed-previous)*i/steps for i in range(1, steps+1))
+            gs['m_speed']=np.mean(self._speed_deque)
                             
         # update real position of the glider:
         self.x += u_water * dt
@@ -434,45 +769,42 @@ class BaseGliderModel(object):
         self.z += w_water * dt        
 
         # update new position (dead reckoned)
-        self.gs['m_depth'] = - self.z
-        self.gs['m_pressure'] = max(0, -self.z * rho *9.81 * 1e-5)
-        if self.gs['m_gps_status']==0:
+        m_depth = gs['m_depth'] = - self.z
+        gs['m_pressure'] = max(0, -self.z * rho *9.81 * 1e-5)
+        if m_gps_status==0:
             # at the surface, and got a signal.
             self.lmc_x=self.x
             self.lmc_y=self.y
         else:
-            self.lmc_x += dt * self.gs['x_northward_glider_velocity']
-            self.lmc_y += dt * self.gs['x_eastward_glider_velocity']
-        if self.gs['u_use_current_correction']:
-            self.lmc_x += dt * self.gs['m_water_vx']
-            self.lmc_y += dt * self.gs['m_water_vy']
+            self.lmc_x += dt * v_dr
+            self.lmc_y += dt * u_dr
+        if gs['u_use_current_correction']:
+            self.lmc_x += dt * gs['m_water_vx']
+            self.lmc_y += dt * gs['m_water_vy']
             
-        self.gs['m_lmc_x']=self.lmc_x
-        self.gs['m_lmc_y']=self.lmc_y
+        gs['m_lmc_x']=self.lmc_x
+        gs['m_lmc_y']=self.lmc_y
         #
-        self.gs['m_lat'],self.gs['m_lon']=self.translate_lmc_latlon(self.lmc_x,self.lmc_y)
+        # lat/lon are only computed when read or recorded.
+        gs.defer(('m_lat', 'm_lon'), projection.nmea, self.lmc_x, self.lmc_y)
 
-        m_depth_rate = self.gs['x_upward_glider_velocity']
+        m_depth_rate = _w
         if abs(m_depth_rate)<1e-4:
-            self.gs['samedepth_for']+=dt
+            gs['samedepth_for']+=dt
             if self.z>0.1:
-                self.gs['hover_for']+=dt
-                self.gs['stalled_for']+=dt
+                gs['hover_for']+=dt
+                gs['stalled_for']+=dt
         else:
-            self.gs['samedepth_for']=0
-            self.gs['hover_for']=0
-            self.gs['stalled_for']=0
-        self.gs['m_altitude']=water_depth-self.gs['m_depth']
-        self.gs['m_present_time']+=dt
-        self.gs['m_present_secs_into_mission']+=dt
-        self.gs['nocomms']+=dt
-        self.gs['time_since_cycle_start']+=dt
-        self.gs['time_since_cycle_end']+=dt
+            gs['samedepth_for']=0
+            gs['hover_for']=0
+            gs['stalled_for']=0
+        gs['m_altitude']=water_depth-m_depth
+        gs.increment(self.CLOCKS, dt)
         # store real glider positions too.
-        self.gs['x_lmc_x']=self.x
-        self.gs['x_lmc_y']=self.y
-        self.gs['x_lmc_z']=self.z
-        self.gs['x_lat'],self.gs['x_lon']=self.translate_lmc_latlon(self.x,self.y)        
+        gs['x_lmc_x']=self.x
+        gs['x_lmc_y']=self.y
+        gs['x_lmc_z']=self.z
+        gs.defer(('x_lat', 'x_lon'), projection.nmea, self.x, self.y)
 
 
     
@@ -481,12 +813,13 @@ class FinModel(object):
         self.c0 = c0
         self.c1 = c1
         self.sigma_noise=0.01
+        self.noise_stream = NoiseStream()
+
+    def noise(self, size=None):
+        return self.sigma_noise*self.noise_stream.normal(size)
 
-    def noise(self):
-        return np.random.normal(loc=0, scale=self.sigma_noise)
-    
     def compute_heading_rate(self, dt, m_fin, m_speed, m_heading_rate):
-        m_fin += self.noise()
+        m_fin += self.noise(np.shape(m_fin) or None)
         
         m_heading_rate = self.c0/self.c1*np.sin(m_fin)*m_speed**2*dt + m_heading_rate*(1-dt/2/self.c1)
         m_heading_rate /= 1+dt/2/self.c1
@@ -500,13 +833,52 @@ class GliderFlightModel(gliderflight.DynamicGliderModel):
 
     This class inherits from the DynamicGliderModel class, but implements a new method step_integrate(), 
     meant to compute a new speed *and position* for a single time step. 
+
+    Two backends are available for step_integrate(): "float" (default) uses plain python
+    float arithmetic, and "numpy" uses the methods of DynamicGliderModel. Both give the same
+    results up to round-off errors. The backend can be set with set_backend().
+
+    Optionally, the velocity is relaxed analytically towards the steady-state glide
+    when it is close to it, instead of integrating the equations of motion (see
+    set_equilibrium_tolerance() and the module equilibrium).
     '''
+    BACKENDS = ('float', 'numpy')
+    
     def __init__(self, dt=None, rho0=None, k1=0.20, k2=0.92, alpha_linear=90, alpha_stall=90,
-                 max_depth_considered_surface=0.5):
+                 max_depth_considered_surface=0.5, backend='float'):
         super().__init__(dt, rho0, k1, k2, max_depth_considered_surface=max_depth_considered_surface)
         self.pitch_model_parameters=(1235,-28.8, 0.138, 0) # T1, T2, T3 and T4from glidertrim program.
         self.fin_model = FinModel()
-        
+        self._mass_matrix_cache = (None, None)
+        self._equilibrium_table = (None, None)
+        self.equilibrium_tolerance = None
+        self.set_backend(backend)
+
+    def set_backend(self, backend):
+        ''' Sets the backend used by step_integrate()
+
+        Parameters
+        ----------
+        backend : str
+            "float" or "numpy"
+        '''
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend {backend}. Choose from {self.BACKENDS}.")
+        self.backend = backend
+
+    def set_equilibrium_tolerance(self, tolerance):
+        ''' Sets the tolerance for the use of the steady-state glide table
+
+        Parameters
+        ----------
+        tolerance : float or None
+            if the horizontal and vertical velocities differ less than tolerance (m/s)
+            from the steady-state glide, step_integrate() relaxes the velocities
+            analytically towards the steady state. If None (default), the equations
+            of motion are always integrated.
+        '''
+        self.equilibrium_tolerance = tolerance
+
     def step_integrate(self, x, y, z, u, v, w, pitch, rho, buoyancy_change, heading):
         ''' Integrate the equations for a single time step.
 
@@ -527,7 +899,12 @@ class GliderFlightModel(gliderflight.DynamicGliderModel):
         -------
         x, y, z, y, v, w : updated parameters (description as in input)
         '''
-        
+        if self.equilibrium_tolerance is not None:
+            r = self._step_equilibrium(x, y, z, u, v, w, pitch, rho, buoyancy_change, heading)
+            if r is not None:
+                return r
+        if self.backend == 'float':
+            return self._step_integrate_float(x, y, z, u, v, w, pitch, rho, buoyancy_change, heading)
         h = self.dt
         pressure = max(-z/10,0) # in bar
         pressure, Vbp = self.convert_pressure_Vbp_to_SI(pressure, buoyancy_change)
@@ -580,6 +957,246 @@ class GliderFlightModel(gliderflight.DynamicGliderModel):
         z += sz
         return x, y, z, u, v, w
 
+    def step_error(self, x, y, z, u, v, w, pitch, rho, buoyancy_change, heading, h):
+        ''' Estimates the local error of step_integrate() for a time step h
+
+        The error is estimated from the difference between a single step h
+        and two steps h/2 (step doubling).
+
+        Returns
+        -------
+        float
+            maximum difference in position (m), or in velocity times h (m)
+        '''
+        dt = self.dt
+        try:
+            self.dt = h
+            r1 = self.step_integrate(x, y, z, u, v, w, pitch, rho, buoyancy_change, heading)
+            self.dt = h/2
+            r2 = self.step_integrate(x, y, z, u, v, w, pitch, rho, buoyancy_change, heading)
+            r2 = self.step_integrate(*r2, pitch, rho, buoyancy_change, heading)
+        finally:
+            self.dt = dt
+        dx = max(abs(a-b) for a, b in zip(r1[:3], r2[:3]))
+        du = max(abs(a-b) for a, b in zip(r1[3:], r2[3:]))
+        return max(dx, du*h)
+
+    def _step_equilibrium(self, x, y, z, u, v, w, pitch, rho, buoyancy_change, heading):
+        # Relaxes the velocity towards the steady-state glide. Returns None if the glider
+        # is not close to it, or would reach the surface.
+        key = (self.Cd0, self.Cd1, self.aw, self.ah, self.alpha_linear, self.alpha_stall, self.k1, self.k2)
+        cached_key, table = self._equilibrium_table
+        if key != cached_key:
+            table = equilibrium.get_table(self)
+            self._equilibrium_table = (key, table)
+        h = float(self.dt)
+        z = float(z)
+        rho = float(rho)
+        pressure = max(-z/10, 0)*1e5 # in Pa
+        Vbp = float(buoyancy_change)*1e-6
+        g = self.G
+        mg = float(self.mg)
+        FBg = g*rho*(self.Vg*(1.-self.epsilon*pressure) + Vbp) - mg*g
+        uh = math.sqrt(float(u)**2 + float(v)**2)
+        r = table.relax(uh, float(w), float(pitch), rho, FBg, float(self.S), mg, h, self.equilibrium_tolerance)
+        if r is None:
+            return None
+        sx, sz, uh, w = r
+        if z+sz>0:
+            return None
+        hdg = math.pi/2 - heading
+        ch = math.cos(hdg)
+        sh = math.sin(hdg)
+        return x + sx * ch, y + sx * sh, z + sz, ch * uh, sh * uh, w
+
+    def _inverted_mass_matrix_float(self, pitch, mg):
+        # inverted mass matrix as python floats, cached for as long as pitch (and mass) do not change.
+        key = (pitch, mg, self.k1, self.k2)
+        cached_key, M = self._mass_matrix_cache
+        if key != cached_key:
+            mg = float(mg)
+            m11 = self.k1*mg
+            m22 = self.k2*mg
+            C = math.cos(pitch)
+            C2 = C*C
+            CS = C*math.sin(pitch)
+            denom = mg*mg + (m22+m11)*mg + m11*m22
+            M = (((m22-m11)*C2 + m11 + mg) / denom,
+                 ((m22-m11)*CS) / denom,
+                 (-(m22-m11)*C2 + m22 + mg) / denom)
+            self._mass_matrix_cache = (key, M)
+        return M
+    
+    def _step_integrate_float(self, x, y, z, u, v, w, pitch, rho, buoyancy_change, heading,
+                              Cd0=None, mg=None, Vg=None):
+        # Same as the numpy backend of step_integrate(), written out in plain float arithmetic.
+        # Cd0, mg and Vg optionally override the model settings (see step_integrate_array()).
+        Cd0 = self.Cd0 if Cd0 is None else Cd0
+        mg = self.mg if mg is None else mg
+        Vg = self.Vg if Vg is None else Vg
+        cos = math.cos
+        sin = math.sin
+        atan2 = math.atan2
+        exp = math.exp
+        h = float(self.dt)
+        pitch = float(pitch)
+        rho = float(rho)
+        z = float(z)
+        w = float(w)
+        pressure = max(-z/10, 0)*1e5 # in Pa
+        Vbp = float(buoyancy_change)*1e-6
+        g = self.G
+        FBg = g*rho*(Vg*(1.-self.epsilon*pressure) + Vbp) - float(mg)*g
+        m11, m12, m22 = self._inverted_mass_matrix_float(pitch, mg)
+        
+        Cd0 = float(Cd0)
+        Cd1 = float(self.Cd1)
+        qS = 0.5 * rho * float(self.S)
+        a = float(self.aw + self.ah)
+        alpha_linear = self.alpha_linear
+        tau_alpha = self.alpha_stall - self.alpha_linear
+        stall = tau_alpha>=1e-9
+        
+        def k(_u, _w):
+            U2 = _u*_u + _w*_w
+            alpha = atan2(_w, _u) - pitch
+            q = qS * U2
+            if stall and abs(alpha)>=alpha_linear:
+                L = q * a * alpha * exp(-(abs(alpha)-alpha_linear)/tau_alpha)
+            else:
+                L = q * a * alpha
+            D = q * (Cd0 + Cd1*alpha*alpha)
+            ca = cos(pitch + alpha)
+            sa = sin(pitch + alpha)
+            Fx = -ca * D + sa * L
+            Fy = -ca * L - sa * D + FBg
+            return h * (m11*Fx + m12*Fy), h * (m12*Fx + m22*Fy)
+
+        uh = math.sqrt(float(u)**2 + float(v)**2)
+        k1_u, k1_w = k(uh, w)
+        _uh2 = uh + k1_u*0.5
+        _w2 = w + k1_w*0.5
+        k2_u, k2_w = k(_uh2, _w2)
+        _uh3 = uh + k2_u*0.5
+        _w3 = w + k2_w*0.5
+        k3_u, k3_w = k(_uh3, _w3)
+        _uh4 = uh + k3_u
+        _w4 = w + k3_w
+        k4_u, k4_w = k(_uh4, _w4)
+        sx = h * (uh + 2*_uh2 + 2*_uh3 + _uh4)/6
+        sz = h * (w + 2*_w2 + 2*_w3 + _w4)/6
+        uh += (k1_u + 2*k2_u + 2*k3_u + k4_u)/6
+        w += (k1_w + 2*k2_w + 2*k3_w + k4_w)/6
+
+        if z+sz>0: # at the surface
+            sx=uh=w=0.
+            sz = -z # so we get exactly at the surface.
+
+        hdg = math.pi/2 - heading
+        ch = cos(hdg)
+        sh = sin(hdg)
+        return x + sx * ch, y + sx * sh, z + sz, ch * uh, sh * uh, w
+    
+    def step_integrate_array(self, x, y, z, u, v, w, pitch, rho, buoyancy_change, heading,
+                             Cd0=None, mg=None, Vg=None):
+        ''' Integrate the equations for a single time step for an array of gliders.
+
+        Vectorised version of step_integrate(). All state parameters are arrays of
+        shape (N,), and are integrated with a single RK4 step.
+
+        Parameters
+        ----------
+        x, y, z, u, v, w, pitch, rho, buoyancy_change, heading : array-like (N,)
+            as in step_integrate()
+        Cd0, mg, Vg : float, array-like (N,) or None
+            optional per-member model coefficients. If None, the model settings are used.
+
+        Returns
+        -------
+        x, y, z, u, v, w : arrays (N,) with updated parameters
+        '''
+        h = self.dt
+        Cd0 = self.Cd0 if Cd0 is None else Cd0
+        mg = self.mg if mg is None else mg
+        Vg = self.Vg if Vg is None else Vg
+        z = np.asarray(z, float)
+        pressure = np.maximum(-z/10, 0) # in bar
+        pressure, Vbp = self.convert_pressure_Vbp_to_SI(pressure, buoyancy_change)
+        FB, Fg = self.compute_FB_and_Fg(pressure, rho, Vbp, mg, Vg)
+        FBg = FB-Fg
+        # inverted mass matrix, allowing for per-member masses
+        m11 = self.k1*mg
+        m22 = self.k2*mg
+        C2 = np.cos(pitch)**2
+        CS = np.cos(pitch)*np.sin(pitch)
+        denom = mg**2 + (m22+m11)*mg + m11*m22
+        M11 = ((m22-m11)*C2 + m11 + mg) / denom
+        M12 = ((m22-m11)*CS) / denom
+        M22 = (-(m22-m11)*C2 + m22 + mg) / denom
+        uh = np.sqrt(u**2 + v**2)
+        w = np.asarray(w, float)
+        args = (rho, pitch, FBg, M11, M12, M12, M22, h, Cd0)
+        # stage 1
+        k1_u, k1_w = self._compute_k_array(uh, w, *args)
+        k1_sx = h * uh
+        k1_sz = h * w
+        # stage 2
+        _uh = uh + k1_u*0.5
+        _w = w + k1_w*0.5
+        k2_u, k2_w = self._compute_k_array(_uh, _w, *args)
+        k2_sx = h * _uh
+        k2_sz = h * _w
+        # stage 3
+        _uh = uh + k2_u*0.5
+        _w = w + k2_w*0.5
+        k3_u, k3_w = self._compute_k_array(_uh, _w, *args)
+        k3_sx = h * _uh
+        k3_sz = h * _w
+        # stage 4
+        _uh = uh + k3_u
+        _w = w + k3_w
+        k4_u, k4_w = self._compute_k_array(_uh, _w, *args)
+        k4_sx = h * _uh
+        k4_sz = h * _w
+        uh = uh + (k1_u + 2*k2_u + 2*k3_u + k4_u)/6
+        w = w + (k1_w + 2*k2_w + 2*k3_w + k4_w)/6
+        sx = (k1_sx + 2*k2_sx + 2*k3_sx + k4_sx)/6
+        sz = (k1_sz + 2*k2_sz + 2*k3_sz + k4_sz)/6
+
+        surfaced = z+sz>0 # at the surface
+        sx = np.where(surfaced, 0, sx)
+        uh = np.where(surfaced, 0, uh)
+        w = np.where(surfaced, 0, w)
+        sz = np.where(surfaced, -z, sz) # so we get exactly at the surface.
+
+        hdg = np.pi/2 - heading
+        u = np.cos(hdg) * uh
+        v = np.sin(hdg) * uh
+        x = x + sx * np.cos(hdg)
+        y = y + sx * np.sin(hdg)
+        z = z + sz
+        return x, y, z, u, v, w
+
+    def _compute_k_array(self, _u, _w, _rho, _pitch, _FBg, _m11, _m12, _m21, _m22, h, _Cd0):
+        # array version of DynamicGliderModel.__compute_k, with a vectorised stall factor.
+        U = (_u**2 + _w**2)**(0.5)
+        alpha = np.arctan2(_w, _u) - _pitch
+        alpha_abs = np.abs(alpha)
+        tau_alpha = self.alpha_stall - self.alpha_linear
+        if tau_alpha<1e-9:
+            stall_factor = 1.
+        else:
+            stall_factor = np.where(alpha_abs<self.alpha_linear, 1.,
+                                    np.exp(-(alpha_abs-self.alpha_linear)/tau_alpha))
+        q = 0.5 * _rho * self.S * U**2
+        L = q * (self.aw + self.ah)*alpha*stall_factor
+        D = q * (_Cd0 + self.Cd1*alpha**2)
+        Fx = -np.cos(_pitch + alpha) * D + np.sin(_pitch + alpha)*L
+        Fy = -np.cos(_pitch + alpha) * L - np.sin(_pitch + alpha)*D + _FBg
+        k_u = h * (_m11*Fx + _m12*Fy)
+        k_w = h * (_m21*Fx + _m22*Fy)
+        return k_u, k_w
+
     def compute_heading_from_fin(self, t, heading, heading_rate, m_fin, m_speed):
         heading_rate = self.fin_model.compute_heading_rate(self.dt, m_fin, m_speed, heading_rate)
         heading += heading_rate * self.dt
@@ -1,12 +1,17 @@
+import math
 from math import atan2, pi,sqrt
 import numpy as np
+import json
 import os
+import pickle
 
 from . import behaviors
 from . import common
 from . import datastore
 from . import glidermodels
 from . import parser
+from . import profiling
+from . import tracing
 
 from .glidermodels import GliderException
 
@@ -77,9 +82,11 @@ class LayeredControl(object):
         else:
             # all is fine, let state engine set b, p and f
             for b,beh in enumerate(self.stack):
-                behaviors.CLRS.g("processing "+beh.behaviorName+ "(%d)"%(b))
+                if behaviors.VERBOSE:
+                    behaviors.CLRS.g("processing "+beh.behaviorName+ "(%d)"%(b))
                 beh.process(gs)   # new values here
-                behaviors.CLRS.g("processing "+beh.behaviorName+ "(%d) Done"%(b))
+                if behaviors.VERBOSE:
+                    behaviors.CLRS.g("processing "+beh.behaviorName+ "(%d) Done"%(b))
                 for i in beh.fsm.memory:
                     if i and i[1]: # exclude when value is None
                         self.controls.set(i)
@@ -92,6 +99,26 @@ class LayeredControl(object):
             self.controls.reset()
         return b,p,f
 
+    def next_event_time(self,gs,clocks,drifting):
+        ''' Returns the earliest time at which a cycle may differ from idle_cycle(),
+            while the glider floats at the surface (see behaviors.Behavior.next_event_time())
+        '''
+        t=gs['m_present_time']
+        pitch_command=None
+        for beh in self.stack:
+            for i in beh.fsm.memory:
+                if i and i[1] and self.controls.cmd[i[0]]=='pitch_motor':
+                    pitch_command=i[0]
+        if pitch_command=='c_pitch':
+            # the pitch PID controller is updated every cycle.
+            return t
+        return min([beh.next_event_time(gs,clocks,drifting) for beh in self.stack]+[math.inf])
+
+    def idle_cycle(self,gs):
+        ''' Applies the effects of a cycle before the next event (see next_event_time())'''
+        for beh in self.stack:
+            beh.idle_cycle(gs)
+
     def resolvePitch(self,c_pitch,m_pitch,c_battpos,t):
         delta_battpos=-self.pitchPID.output(t,np.tan(m_pitch),np.tan(c_pitch))
         x_battpos=c_battpos+delta_battpos
@@ -172,6 +199,11 @@ class LayeredControl(object):
             else:
                 raise ValueError("unknown fin control")
             gs['c_fin']=c_fin
+        if tracing.TRACER is not None:
+            # the command as given by the behavior, and the resulting actuator setting.
+            for actuator, value in (('pitch_motor', c_battpos), ('pump', c_ballast_pumped), ('fin', c_fin)):
+                if value is not None:
+                    tracing.TRACER.command(t, actuator, self.controls.actuator[actuator].commanded[0], value)
         return c_battpos,c_ballast_pumped,c_fin
 
 
@@ -201,16 +233,21 @@ class GliderMission(datastore.Data):
 
         self.datatransfertime=0.
         self.mission_initialisation_time=0.
+        self._loop_state = None # state of the main loop in run(), used to resume a simulation.
+        self._resume = False
+        self.profiler = None
         
         self.glider=glider_model
         self.glider.environment_model = environment_model
+        self.glider.set_noise(config.seed, config.noise)
         self.glider.initialise_gliderstate(datestr, timestr, lat, lon, mission_start)
         self.LC=LayeredControl()
         # set the PIDs for LC, as they are hardware dependent:
         self.LC.set_PIDS(self.glider.finPID,self.glider.pitchPID)
         config.set_sensors(self)
         config.set_special_settings(self)
-        datastore.Data.__init__(self,self.glider.gs,period=config.storePeriod)
+        datastore.Data.__init__(self,self.glider.gs,period=config.storePeriod, spec=config.recording_spec,
+                                projection_tolerance=self.glider.projection_tolerance)
         self._set_glider_settings_from_special_settings(config)
         
     def _set_glider_settings_from_special_settings(self, config):
@@ -272,9 +309,6 @@ class GliderMission(datastore.Data):
             if verbose:
                 b.printInfo()
 
-    def get(self,parameter):
-        return np.asarray(self.data[parameter])
-
     def sensor(self,parameter,value):
         if parameter in self.glider.gs:
             if value==None:
@@ -296,12 +330,95 @@ class GliderMission(datastore.Data):
     def check_if_grounded(self):
         return self.glider.gs['_is_grounded']
     
-    def _npfy_data(self):
-        object_types = dict([(k, type(v[0])) for k, v in self.data.items()]) # set the type equal to the first element for each element in data.
-        self.data = dict([(k,np.array(v, dtype=object_types[k])) for k,v in self.data.items()])
+    def save_checkpoint(self, filename):
+        ''' Saves the complete state of the simulation
+
+        The checkpoint contains the glider mission, including the glider
+        model with its noise streams, the behaviors and the recorded data,
+        and the mission status. The environment model is not included.
+
+        Parameters
+        ----------
+        filename : str
+            name of checkpoint file
+        '''
+        environment_model = self.glider.environment_model
+        self.glider.environment_model = None
+        try:
+            checkpoint = dict(mission=self,
+                              mission_status=behaviors.Behavior.MS,
+                              actuator_busy=Actuator.busy)
+            with open(filename, 'wb') as fp:
+                if self.profiler is None:
+                    pickle.dump(checkpoint, fp)
+                else:
+                    with self.profiler.uninstalled(self):
+                        pickle.dump(checkpoint, fp)
+        finally:
+            self.glider.environment_model = environment_model
+        logger.info(f"Checkpoint written to {filename}.")
+
+    @classmethod
+    def load_checkpoint(cls, filename, environment_model):
+        ''' Loads a glider mission from a checkpoint
+
+        The next call of run() continues the simulation from the point
+        where the checkpoint was saved. The run() arguments
+        (maxSimulationTime, end_on_surfacing etc.) have to be given again.
+
+        Parameters
+        ----------
+        filename : str
+            name of checkpoint file
+        environment_model : environment model
+            the environment model (as used for the original simulation)
+
+        Returns
+        -------
+        GliderMission
+        '''
+        with open(filename, 'rb') as fp:
+            checkpoint = pickle.load(fp)
+        GM = checkpoint['mission']
+        GM.glider.environment_model = environment_model
+        behaviors.Behavior.MS = checkpoint['mission_status']
+        Actuator.busy = checkpoint['actuator_busy']
+        GM._resume = GM._loop_state is not None
+        if GM.profiler is not None:
+            GM.profiler.install(GM)
+        return GM
+
+    def enable_profiling(self):
+        ''' Accumulates wall time and call counts per phase of the simulation
+
+        The results are available with profile_report(), and are written
+        to the metadata of the output file (attribute profile) at the end of run().
+
+        Returns
+        -------
+        profiling.PhaseProfiler
+        '''
+        if self.profiler is None:
+            self.profiler = profiling.PhaseProfiler()
+        self.profiler.install(self)
+        return self.profiler
+
+    def disable_profiling(self):
+        ''' Stops profiling and removes the profiler'''
+        if self.profiler is not None:
+            self.profiler.uninstall()
+            self.profiler = None
+
+    def profile_report(self):
+        ''' Returns the profiling results as a dictionary (see profiling.PhaseProfiler.report())'''
+        if self.profiler is None:
+            raise ValueError("Profiling is not enabled. Use enable_profiling() first.")
+        return self.profiler.report()
 
     def run(self,dt=1,CPUcycle=4,maxSimulationTime=None,
-            end_on_surfacing=False, end_on_grounding=False, verbose=False):
+            end_on_surfacing=False, end_on_grounding=False, verbose=False,
+            checkpoint_filename=None, checkpoint_interval=None, fast_forward=None,
+            adaptive=None):
         ''' dt : time step in seconds
             CPUcycle: time step per CPU cycle.
             maxSimulationTime: maximum simulation time in days
@@ -312,30 +429,51 @@ class GliderMission(datastore.Data):
 
             end_on_grounding True:
             Stops simulation when the glider hits the bottom.
+
+            checkpoint_filename, checkpoint_interval:
+            If both set, a checkpoint is saved every checkpoint_interval
+            seconds (simulated time). See save_checkpoint().
+
+            fast_forward:
+            If set, the glider is not integrated while it floats at the
+            surface with idle actuators (waiting for GPS, data transfer
+            etc.). Instead, it drifts with the surface current, which is
+            sampled every fast_forward seconds, up to the next event: the
+            first time a behavior may act, or the GPS status changes. Up
+            to then, the behaviors are not processed, and the glider is
+            advanced in steps that end at each CPU cycle and at each time
+            a record is due. Not used with end_on_surfacing or tracing.
+
+            adaptive:
+            If set, the flight model is integrated with a variable time
+            step, a multiple of dt, of which the local error per unit time
+            (m/s) does not exceed adaptive. Steps end at each CPU cycle and
+            at each time a record is due; while actuators move, the time
+            step is dt.
         '''
         # make sure that the glider flight model is run with the same time step as the hardware is updated.
         self.glider.gliderflight_model.dt = dt
         
         behaviors.VERBOSE = self.verbose
         self.verbose = verbose
-        behaviors.Behavior.MS=0
-        # surface conditions:
-        self.glider.gs['c_ballast_pumped']=self.glider.buoyancypump.set_commanded(1000)        
-        self.glider.gs['c_battpos']=self.glider.pitchmotor.set_commanded(100)
-        self.glider.gs['c_fin']=self.glider.finmotor.set_commanded(0)        
-        subcycle_time = 1e3 # make sure we update LC on the first round.
-        simulationTime = self.glider.gs['m_present_time']
-        
-        if self.glider.gs['_pickup'] == True: # we're continuing an existing mission (affects goto_l behavior only)
-            self.glider.gs['time_since_cycle_start']=self.datatransfertime
+        if self.profiler is not None:
+            self.profiler.start(self.glider.gs['m_present_time'])
+        if self._resume:
+            # continue the simulation from a checkpoint.
+            simulationTime, subcycle_time, b, p, f = self._loop_state
+            self._resume = False
         else:
-            # new mission start, simulate mission initialisation
-            mission_initialised_time = simulationTime + self.mission_initialisation_time
-            while simulationTime < mission_initialised_time:
-                self.glider.update(simulationTime,dt)
-                self.add_data()
-                simulationTime+=dt
+            simulationTime, subcycle_time = self.__start_mission(dt, fast_forward)
+            b = p = f = None
+        if checkpoint_filename and checkpoint_interval:
+            next_checkpoint_time = simulationTime + checkpoint_interval
+        else:
+            next_checkpoint_time = np.inf
         while True:
+            if simulationTime >= next_checkpoint_time:
+                self._loop_state = (simulationTime, subcycle_time, b, p, f)
+                self.save_checkpoint(checkpoint_filename)
+                next_checkpoint_time += checkpoint_interval
             if subcycle_time>=CPUcycle: # a new cpucycle
                 b,p,f=self.LC.cycle(self.glider.gs)
                 subcycle_time=0
@@ -356,7 +494,10 @@ class GliderMission(datastore.Data):
             if f!=None: 
                 self.glider.gs['c_fin']=self.glider.finmotor.set_commanded(f)        
             if behaviors.Behavior.MS&behaviors.TOQUIT and self.glider.gs['m_depth']<0.1:
+                previous = behaviors.Behavior.MS
                 behaviors.Behavior.MS+= ~behaviors.Behavior.MS&behaviors.COMPLETED # setting COMPLETED flag
+                if tracing.TRACER is not None and behaviors.Behavior.MS!=previous:
+                    tracing.TRACER.mission_status(self.glider.gs['m_present_time'], previous, behaviors.Behavior.MS)
             if behaviors.Behavior.MS&behaviors.COMPLETED or \
                     (behaviors.Behavior.MS>=8 and self.glider.gs['m_depth']<0.1):
                 break
@@ -387,11 +528,31 @@ class GliderMission(datastore.Data):
                         break
                     else:
                         logger.info(s+"Continuing")
-            self.glider.update(simulationTime,dt)
-            self.add_data()
-            simulationTime+=dt
-            subcycle_time+=dt
+            if fast_forward and not end_on_surfacing and tracing.TRACER is None and \
+                    behaviors.Behavior.MS<behaviors.TOQUIT and self.glider.is_quiescent():
+                t_limit = next_checkpoint_time
+                if maxSimulationTime:
+                    t_limit = min(t_limit, self.glider.gs['m_present_time'] + maxSimulationTime*86400. -
+                                  self.glider.gs['m_present_secs_into_mission'])
+                r = self.__fast_forward(simulationTime, subcycle_time, dt, CPUcycle, fast_forward, t_limit)
+                if r is not None:
+                    simulationTime, subcycle_time = r
+                    continue
+            if adaptive:
+                max_steps = min(max(1, math.ceil((CPUcycle-subcycle_time)/dt - 1e-9)),
+                                self.steps_to_next_record(dt))
+                steps = self.glider.adaptive_steps(dt, max_steps, adaptive)
+            else:
+                steps = 1
+            if steps == 1:
+                self.__update(simulationTime, dt, fast_forward)
+            else:
+                self.glider.update(simulationTime, dt, steps)
+            self.add_data(steps=steps)
+            simulationTime+=steps*dt
+            subcycle_time+=steps*dt
         # mission is finialised. End of while 1:
+        self._loop_state = (simulationTime, subcycle_time, b, p, f)
 
         if behaviors.Behavior.MS&behaviors.COMPLETED:
             logger.info("Mission completed.")
@@ -399,8 +560,77 @@ class GliderMission(datastore.Data):
             for k,v in behaviors.ABORTS.items():
                 if behaviors.Behavior.MS&v:
                     logger.info("Mission abort: %s"%(k.upper()))
-        self._npfy_data()
+        if self.profiler is not None:
+            self.profiler.stop(self.glider.gs['m_present_time'])
+            self.metadata['profile'] = json.dumps(self.profiler.report())
+        self.flush()
+
+    def __update(self, t, dt, fast_forward):
+        if fast_forward and self.glider.is_quiescent():
+            self.glider.surface_step(t, dt, fast_forward)
+        else:
+            self.glider.update(t, dt)
+
+    def __fast_forward(self, simulationTime, subcycle_time, dt, CPUcycle, interval, t_limit):
+        ''' Advances the glider at rest at the surface up to the next event
+
+        The next event is the first time at which a behavior may act (see
+        LayeredControl.next_event_time()), the GPS status changes, or
+        t_limit. If CPUcycle is None, the behaviors are not considered.
 
+        Returns the simulation time and the time into the CPU cycle, or None
+        if the next event is too close.
+        '''
+        gs = self.glider.gs
+        t_event = min(t_limit, self.glider.gps.next_change_time())
+        if CPUcycle is not None:
+            t_event = min(t_event, self.LC.next_event_time(gs, self.glider.SURFACE_CLOCKS,
+                                                           self.glider.surface_change_times(interval)))
+        # round-off in the clocks
+        t_event -= behaviors.Condition.WAKE_MARGIN
+        n = math.ceil((t_event - gs['m_present_time'])/dt) - 1
+        if n < 2:
+            return None
+        while n > 0:
+            steps = min(n, self.steps_to_next_record(dt))
+            if CPUcycle is not None:
+                if subcycle_time >= CPUcycle:
+                    self.LC.idle_cycle(gs)
+                    subcycle_time = 0
+                steps = min(steps, max(1, math.ceil((CPUcycle-subcycle_time)/dt - 1e-9)))
+            self.glider.surface_step(simulationTime, dt, interval, steps)
+            self.add_data(steps=steps)
+            simulationTime += steps*dt
+            subcycle_time += steps*dt
+            n -= steps
+        return simulationTime, subcycle_time
+
+    def __start_mission(self, dt, fast_forward=None):
+        behaviors.Behavior.MS=0
+        # surface conditions:
+        self.glider.gs['c_ballast_pumped']=self.glider.buoyancypump.set_commanded(1000)        
+        self.glider.gs['c_battpos']=self.glider.pitchmotor.set_commanded(100)
+        self.glider.gs['c_fin']=self.glider.finmotor.set_commanded(0)        
+        subcycle_time = 1e3 # make sure we update LC on the first round.
+        simulationTime = self.glider.gs['m_present_time']
+        
+        if self.glider.gs['_pickup'] == True: # we're continuing an existing mission (affects goto_l behavior only)
+            self.glider.gs['time_since_cycle_start']=self.datatransfertime
+        else:
+            # new mission start, simulate mission initialisation
+            mission_initialised_time = simulationTime + self.mission_initialisation_time
+            while simulationTime < mission_initialised_time:
+                if fast_forward and self.glider.is_quiescent():
+                    r = self.__fast_forward(simulationTime, subcycle_time, dt, None, fast_forward,
+                                            mission_initialised_time)
+                    if r is not None:
+                        simulationTime = r[0]
+                        continue
+                self.__update(simulationTime, dt, fast_forward)
+                self.add_data()
+                simulationTime+=dt
+        return simulationTime, subcycle_time
+    
     def printInfo(self):
         if self.verbose:
             gs = self.gs
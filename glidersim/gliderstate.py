@@ -0,0 +1,334 @@
+'''Glider state
+
+The glider state holds all parameters (sensors) that describe the
+state of the simulated glider. It is read and written by the glider
+model, the layered control and all behaviors.
+
+GliderState behaves as a dictionary, but all numerical values are
+stored in a single float64 array, in which each parameter has a fixed
+slot. Non-numerical values, such as utm_0 and boolean flags, are kept
+in a separate dictionary. Values are accessed by key, as for a dictionary,
+or by their slot index in the array:
+
+>>> gs = GliderState(m_depth=0, utm_0=None)
+>>> gs['m_depth'] = 10
+>>> gs.vector[gs.slot('m_depth')]
+10.0
+
+The numerical part of the state is available as a numpy array through
+the attribute vector (no copy), and the whole state can be saved and
+restored with snapshot() and restore().
+
+The computation of numerical values that are expensive and seldom read
+can be deferred with defer(). The values are computed when they are
+read, or when vector is accessed:
+
+>>> gs.defer(('m_lat', 'm_lon'), projection.nmea, x, y)
+
+Objects that depend on parameters, such as behavior conditions, can
+watch them with watch(). Their attribute changed is set to True when
+the value of any of the watched parameters changes.
+'''
+from array import array
+from collections.abc import MutableMapping
+import numbers
+import weakref
+
+import numpy as np
+
+
+# parameters that advance with the simulation time (see increment())
+CLOCKS = ('m_present_time', 'm_present_secs_into_mission', 'nocomms',
+          'time_since_cycle_start', 'time_since_cycle_end')
+
+
+def is_numeric(value):
+    ''' Returns True if value is stored in the float64 array of GliderState'''
+    return isinstance(value, numbers.Real) and not isinstance(value, (bool, np.bool_))
+
+
+class GliderState(MutableMapping):
+    ''' Dictionary-like glider state, backed by a float64 array
+
+    Parameters
+    ----------
+    *p, **kwds :
+        as for dict()
+
+    Notes
+    -----
+    The type of a parameter (numerical or not) is determined when it is first set. Numerical
+    values are returned as python floats. Setting a numerical parameter to a non-numerical
+    value raises a TypeError.
+    '''
+    __slots__ = ('_index', '_data', '_objects', '_deferred', '_watchers', '_increment_watchers')
+
+    def __init__(self, *p, **kwds):
+        self._index = {} # parameter -> slot, or None for non-numerical and deferred values
+        self._data = array('d')
+        self._objects = {}
+        self._deferred = {} # parameter -> (keys, slots, function, args)
+        self._watchers = {} # parameter -> list of weak references to watchers
+        self._increment_watchers = {}
+        self.update(*p, **kwds)
+
+    def __getitem__(self, key):
+        try:
+            return self._data[self._index[key]]
+        except TypeError: # slot is None: non-numerical or deferred value
+            if key in self._deferred:
+                self.__resolve(key)
+                return self._data[self._index[key]]
+            return self._objects[key]
+
+    def __setitem__(self, key, value):
+        if key in self._watchers:
+            self.__set_watched(key, value)
+            return
+        try:
+            self._data[self._index[key]] = value
+        except (KeyError, TypeError):
+            self.__set_new_or_object(key, value)
+
+    def __set_watched(self, key, value):
+        try:
+            previous = self[key]
+        except KeyError:
+            previous = None
+        try:
+            self._data[self._index[key]] = value
+        except (KeyError, TypeError):
+            self.__set_new_or_object(key, value)
+        if previous != value:
+            self.__notify(self._watchers, key)
+
+    def __set_new_or_object(self, key, value):
+        i = self._index.get(key, -1)
+        if i is None and key in self._deferred:
+            self.__resolve(key)
+            self[key] = value
+        elif i is None:
+            self._objects[key] = value
+        elif i >= 0:
+            raise TypeError(f"Glider state parameter {key} is numerical and cannot be set to {value!r}.")
+        elif is_numeric(value):
+            self._index[key] = len(self._data)
+            # Create a new array rather than resizing, so that existing views
+            # on the values do not prevent adding parameters.
+            self._data = self._data + array('d', [value])
+        else:
+            self._index[key] = None
+            self._objects[key] = value
+
+    def __delitem__(self, key):
+        self.resolve()
+        i = self._index.pop(key)
+        if i is None:
+            del self._objects[key]
+            return
+        data = self._data[:i] + self._data[i+1:]
+        self._data = data
+        for k, j in self._index.items():
+            if j is not None and j > i:
+                self._index[k] = j-1
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({dict(self.items())!r})"
+
+    def __getstate__(self):
+        return dict(self.items())
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+    def copy(self):
+        return self.__class__(self.items())
+
+    @property
+    def vector(self):
+        ''' numpy array with all numerical values (a view, not a copy)'''
+        if self._deferred:
+            self.resolve()
+        return np.frombuffer(self._data, dtype=np.float64)
+
+    @property
+    def numerical_keys(self):
+        ''' list of parameters that are stored in vector, in slot order'''
+        self.resolve()
+        keys = [None]*len(self._data)
+        for k, i in self._index.items():
+            if i is not None:
+                keys[i] = k
+        return keys
+
+    @property
+    def object_keys(self):
+        ''' list of parameters with non-numerical values'''
+        self.resolve()
+        return [k for k, i in self._index.items() if i is None]
+
+    def slot(self, key):
+        ''' Returns the index of parameter key in vector
+
+        Raises
+        ------
+        KeyError if key is not a numerical parameter.
+        '''
+        i = self._index[key]
+        if i is None and key in self._deferred:
+            keys, slots, _, _ = self._deferred[key]
+            i = slots[keys.index(key)]
+        if i is None:
+            raise KeyError(f"{key} is not a numerical parameter.")
+        return i
+
+    def slots(self, keys):
+        ''' Returns an array of indices in vector for a list of numerical parameters'''
+        return np.array([self.slot(k) for k in keys], dtype=int)
+
+    def increment(self, keys, value):
+        ''' Adds value to each of the numerical parameters keys'''
+        data = self._data
+        index = self._index
+        for k in keys:
+            data[index[k]] += value
+        if self._increment_watchers:
+            for k in keys:
+                if k in self._increment_watchers:
+                    self.__notify(self._increment_watchers, k)
+
+    def watch(self, key, watcher, increments=True):
+        ''' Sets watcher.changed to True whenever the value of parameter key changes
+
+        Parameters
+        ----------
+        key : str
+            parameter
+        watcher : object
+            object with attribute changed. Only a weak reference is kept.
+        increments : bool
+            if False, changes by increment() are not notified (used for
+            conditions on clocks, of which the changes can be predicted).
+        '''
+        self._watchers.setdefault(key, []).append(weakref.ref(watcher))
+        if increments:
+            self._increment_watchers.setdefault(key, []).append(weakref.ref(watcher))
+
+    def __notify(self, watchers, key):
+        references = watchers[key]
+        for r in references:
+            watcher = r()
+            if watcher is None:
+                watchers[key] = [r for r in references if r() is not None]
+                if not watchers[key]:
+                    del watchers[key]
+                continue
+            watcher.changed = True
+
+    def __notify_all(self):
+        for watchers in (self._watchers, self._increment_watchers):
+            for k in list(watchers):
+                self.__notify(watchers, k)
+
+    def snapshot(self):
+        ''' Returns a copy of the current state
+
+        Returns
+        -------
+        tuple of (numpy array, dict)
+            numerical values and non-numerical values
+        '''
+        return np.array(self.vector), dict(self._objects)
+
+    def restore(self, snapshot):
+        ''' Restores the state from a snapshot
+
+        Parameters
+        ----------
+        snapshot : tuple of (numpy array, dict)
+            as returned by snapshot()
+        '''
+        values, objects = snapshot
+        if len(values) != len(self._data) or set(objects) != set(self._objects):
+            raise ValueError("Snapshot does not match the parameters of this glider state.")
+        self.resolve()
+        self.vector[:] = values
+        self._objects.update(objects)
+        self.__notify_all()
+
+    def defer(self, keys, function, *args):
+        ''' Defers the computation of numerical parameters
+
+        Parameters
+        ----------
+        keys : tuple of str
+            numerical parameters
+        function : callable
+            function(*args) returns a value for each of the parameters in keys.
+        *args :
+            arguments of function
+
+        Notes
+        -----
+        The function is called when any of the parameters is read, or when
+        vector is accessed. A pending computation is discarded when the
+        parameters are deferred again before they have been read.
+        '''
+        deferred = self._deferred
+        entry = deferred.get(keys[0])
+        if entry is not None and entry[0] == keys:
+            slots = entry[1]
+        else:
+            for k in keys:
+                if k in deferred:
+                    self.__resolve(k)
+            slots = tuple(self.slot(k) for k in keys)
+            for k in keys:
+                self._index[k] = None
+        entry = (keys, slots, function, args)
+        for k in keys:
+            deferred[k] = entry
+            if k in self._watchers:
+                self.__notify(self._watchers, k)
+
+    def __resolve(self, key):
+        keys, slots, function, args = self._deferred[key]
+        values = function(*args)
+        for k, i, v in zip(keys, slots, values):
+            self._index[k] = i
+            self._data[i] = v
+            del self._deferred[k]
+
+    def resolve(self, keys=None):
+        ''' Computes the values of deferred parameters
+
+        Parameters
+        ----------
+        keys : container of str or None
+            parameters to compute, if deferred. If None, all deferred parameters are computed.
+        '''
+        if keys is None:
+            while self._deferred:
+                self.__resolve(next(iter(self._deferred)))
+        else:
+            for k in [k for k in self._deferred if k in keys]:
+                if k in self._deferred:
+                    self.__resolve(k)
+
+    def view(self, keys):
+        ''' Returns vector, computing only the deferred parameters in keys
+
+        Values of other deferred parameters in the returned array are not up to date.
+        '''
+        if self._deferred:
+            self.resolve(keys)
+        return np.frombuffer(self._data, dtype=np.float64)
@@ -7,6 +7,7 @@ from latlon import convertToDecimal
 
 from . import getm_nc
 from . import geometry
+from . import tilestore
 
 class Cache(object):
     def __init__(self):
@@ -85,6 +86,12 @@ class NemoEnvironment(object):
     def __setBathymetry(self):
         # select a file that has bathymetry info:
         fn=NemoEnvironment.NCBATHYMETRY
+        if fn is not None and tilestore.is_tile_store(fn):
+            # the store should contain the water depth in m, for example by converting
+            # with the z-level to depth conversion as transform. Missing values are
+            # land, which has 0 z levels, and thus a water depth of 0 m.
+            NemoEnvironment.BATHYMETRY=tilestore.TileStore(fn,fill_value=0.).bathymetry
+            return
         if fn==None:
             fn=self.__netcdf_files[0]
         nc=getm_nc.NcGetm(fn)
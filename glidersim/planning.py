@@ -0,0 +1,606 @@
+'''Reduced-order dive-cycle model for mission planning
+
+The full simulator (GliderMission) runs the glider software, the
+actuators and the flight model with time steps of typically 0.5 s. For
+route planning, where many estimates of the time needed to reach a
+waypoint are required, DiveCycleModel computes the timing and the
+horizontal progress of yo cycles and surfacings directly from
+
+* the settings of the Yo and Surface behaviors of a mission,
+* the actuator speeds of the glider model, and
+* its flight model (GliderFlightModel).
+
+Each half yo (dive or climb) is split in two parts. The inflection, while
+the actuators move and the glider accelerates, is integrated with a few
+time steps of one CPU cycle. The remaining steady glide is computed from
+the steady-state glide table (see glidersim.equilibrium), in depth
+segments. Heading control, hovering and stalls are not modelled, and
+currents are taken depth averaged and constant.
+
+Example
+-------
+
+>>> model = DiveCycleModel.from_mission(glider_model, 'nsb3.mi', '../data/comet/nsb3')
+>>> model.yo(water_depth=40)
+>>> model.dive_cycle(water_depth=40)
+>>> model.time_to_reach(5000, bearing=np.radians(120), u=0.1, v=-0.05, water_depth=40)
+
+The model can be compared with the full simulator on a mission with
+validate(), or from the command line:
+
+$ python -m glidersim.planning ../data/comet/nsb3 nsb3.mi --hours 8 --water-depth 40
+'''
+import argparse
+import json
+import math
+import os
+
+import numpy as np
+
+from . import behaviors
+from . import common
+from . import equilibrium
+from . import parser
+
+logger = common.get_logger(name='planning')
+
+INIT_DIVE_TIME = 80. # time (s) the glider needs at the surface before diving (see BaseGliderModel)
+MAX_HALF_CYCLE_TIME = 6*3600. # (s) a dive or climb that takes longer is considered to fail
+
+
+class ConstantEnvironment(object):
+    ''' Environment model with constant currents and water depth
+
+    Parameters
+    ----------
+    water_depth : float
+        water depth (m)
+    u, v : float
+        eastward and northward current (m/s)
+    rho : float
+        density at the surface (kg m^{-3})
+    drho_dz : float
+        increase of density with depth (kg m^{-4})
+    '''
+    def __init__(self, water_depth=40., u=0., v=0., rho=1025., drho_dz=0., S=35., T=10.):
+        self.water_depth = water_depth
+        self.u = u
+        self.v = v
+        self.rho = rho
+        self.drho_dz = drho_dz
+        self.S = S
+        self.T = T
+
+    def get_density(self, depth):
+        return self.rho + self.drho_dz*depth
+
+    def get_data(self, t, lat, lon, z):
+        ''' Returns u, v, w, water_depth, eta, S, T, rho for position lat, lon (decimal) and depth z (<0)'''
+        return self.u, self.v, 0, self.water_depth, 0, self.S, self.T, self.get_density(max(-z, 0))
+
+
+class DiveCycleModel(object):
+    ''' Reduced-order model of the dive cycles of a glider
+
+    Parameters
+    ----------
+    glider_model : BaseGliderModel
+        glider model, with initialised flight model
+    yo : behaviors.Yo
+        yo behavior, with the dive (d_*) and climb (c_*) settings
+    surface : behaviors.Surface or None
+        surface behavior that ends a dive cycle (see dive_cycle())
+    environment : ConstantEnvironment or None
+        density profile. If None, a constant density of 1025 kg m^{-3} is used.
+    cpu_cycle : float
+        CPU cycle (s) of the glider
+    dt : float
+        time step (s) of the integration of the inflections
+    segment_depth : float
+        depth (m) of the segments of steady glides
+    tolerance : float
+        maximum difference (m/s) of the velocities with the steady-state glide
+        for the glider to be in steady state
+    init_dive_time : float
+        time (s) the glider needs at the surface before diving
+    '''
+    def __init__(self, glider_model, yo, surface=None, environment=None, cpu_cycle=4., dt=2.,
+                 segment_depth=5., tolerance=1e-3, init_dive_time=INIT_DIVE_TIME):
+        self.glider_model = glider_model
+        self.gfm = glider_model.gliderflight_model
+        self.yo_behavior = yo
+        self.surface_behavior = surface
+        self.environment = environment or ConstantEnvironment()
+        self.cpu_cycle = cpu_cycle
+        self.dt = dt
+        self.segment_depth = segment_depth
+        self.tolerance = tolerance
+        self.init_dive_time = init_dive_time
+
+    @classmethod
+    def from_mission(cls, glider_model, mission, mission_directory, use_glider_directory_structure=True, **kwds):
+        ''' Creates a DiveCycleModel from the Yo and Surface behaviors of a mission file
+
+        Parameters
+        ----------
+        glider_model : BaseGliderModel
+            glider model, with initialised flight model
+        mission : str
+            mission name
+        mission_directory : str
+            directory with the missions and mafiles directories (or the mission and ma files
+            if use_glider_directory_structure is False)
+        kwds :
+            passed on to DiveCycleModel
+
+        Raises
+        ------
+        ValueError
+            if the mission has no Yo behavior
+        '''
+        if use_glider_directory_structure:
+            mission = os.path.join(mission_directory, 'missions', mission)
+            mafiles_directory = os.path.join(mission_directory, 'mafiles')
+        else:
+            mission = os.path.join(mission_directory, mission)
+            mafiles_directory = mission_directory
+        MP = parser.MissionParser(verbose=False)
+        MP.parse(mission, mafiles_directory)
+        yos = [b for b in MP.behaviors if isinstance(b, behaviors.Yo)]
+        if not yos:
+            raise ValueError(f"Mission {mission} has no yo behavior.")
+        return cls(glider_model, yos[0], surface=cls.timed_surface_behavior(MP.behaviors), **kwds)
+
+    @staticmethod
+    def timed_surface_behavior(behavior_list):
+        ''' Returns the surface behavior that is triggered first by a timer, or None'''
+        timed = [b for b in behavior_list if isinstance(b, behaviors.Surface) and b.start_when in (6, 9, 12)]
+        if not timed:
+            return None
+        return min(timed, key=lambda b: b.when_secs)
+
+    # actuator settings
+
+    def __pressure(self, depth):
+        # pressure (bar) as recorded by the glider (m_pressure)
+        return depth*self.environment.get_density(depth)*9.81e-5
+
+    def __pitch(self, battpos, bpump, depth):
+        return float(self.gfm.compute_pitch_from_battpos_buoyancy_drive(battpos, bpump, self.__pressure(depth)))
+
+    def __settings(self, use_bpump, bpump_value, use_pitch, pitch_value, depth):
+        # commanded pump and battery positions, after clipping by the actuators.
+        bpump = behaviors.UpDownSettings(use_bpump, bpump_value, use_pitch, pitch_value).get_ballast_pumped()[1]
+        pump = self.glider_model.buoyancypump
+        bpump = min(max(bpump, pump.position_min), pump.position_max)
+        if use_pitch == 3: # servo on pitch: the battery position that gives the commanded pitch.
+            T1, T2, T3, T4 = self.gfm.pitch_model_parameters
+            battpos = (math.tan(pitch_value) - T1*bpump*1e-6 - T3 - T4*self.__pressure(depth)*1e-3)/(T2*2.56e-2)
+        else:
+            battpos = behaviors.UpDownSettings(use_bpump, bpump_value, use_pitch, pitch_value).get_pitch()[1]
+        motor = self.glider_model.pitchmotor
+        battpos = min(max(battpos, motor.position_min), motor.position_max)
+        return bpump, battpos
+
+    def dive_settings(self, depth=0.):
+        yo = self.yo_behavior
+        return self.__settings(yo.d_use_bpump, yo.d_bpump_value, yo.d_use_pitch, yo.d_pitch_value, depth)
+
+    def climb_settings(self, depth=0.):
+        yo = self.yo_behavior
+        return self.__settings(yo.c_use_bpump, yo.c_bpump_value, yo.c_use_pitch, yo.c_pitch_value, depth)
+
+    def surface_settings(self, depth=0.):
+        s = self.surface_behavior
+        return self.__settings(s.c_use_bpump, s.c_bpump_value, s.c_use_pitch, s.c_pitch_value, depth)
+
+    def dive_depth(self, water_depth=None):
+        ''' Returns the depth at which a dive is ended'''
+        yo = self.yo_behavior
+        depth = yo.d_target_depth
+        if water_depth is not None and yo.d_target_altitude > 0:
+            depth = min(depth, water_depth - yo.d_target_altitude)
+        return depth
+
+    # flight
+
+    def steady_state(self, depth, bpump, battpos):
+        ''' Returns the horizontal and vertical velocity (m/s) of the steady-state glide
+
+        Returns None if there is no stable steady state.
+        '''
+        gfm = self.gfm
+        rho = self.environment.get_density(depth)
+        g = gfm.G
+        FBg = g*rho*(gfm.Vg*(1.-gfm.epsilon*depth*1e4) + bpump*1e-6) - gfm.mg*g
+        if abs(FBg) < equilibrium.MIN_FORCE:
+            return None
+        r = equilibrium.get_table(gfm).lookup(self.__pitch(battpos, bpump, depth), FBg)
+        if r is None:
+            return None
+        V = math.sqrt(2*abs(FBg)/(rho*gfm.S))
+        return V*r[0], V*r[1]
+
+    def half_cycle(self, state, settings, target_depth, max_time=None):
+        ''' Computes a dive or climb to target_depth
+
+        Parameters
+        ----------
+        state : dict
+            depth (m), uh and w (m/s, w positive upwards), bpump (cc) and battpos (inch)
+            at the start
+        settings : (float, float)
+            commanded pump and battery positions
+        target_depth : float
+            depth at which the dive or climb is ended. The direction (dive or climb)
+            follows from the commanded pump position.
+        max_time : float or None
+            if given, the computation stops after max_time seconds
+
+        Returns
+        -------
+        dict
+            time (s), horizontal distance through the water (m), and the state at the end.
+        '''
+        pump = self.glider_model.buoyancypump
+        motor = self.glider_model.pitchmotor
+        bpump_target, battpos_target = settings
+        climbing = bpump_target > 0
+        depth, uh, w = state['depth'], state['uh'], state['w']
+        bpump, battpos = state['bpump'], state['battpos']
+        max_time = MAX_HALF_CYCLE_TIME if max_time is None else max_time
+        def reached(depth):
+            return depth <= target_depth if climbing else depth >= target_depth
+        # actuators that are within their dead band do not move
+        moving = [abs(bpump_target-bpump) > pump.deadbandWidth, abs(battpos_target-battpos) > motor.deadbandWidth]
+        h = self.dt
+        gfm = self.gfm
+        t = distance = 0.
+        dt = gfm.dt
+        gfm.dt = h
+        try:
+            # inflection: integrate while the actuators move, or the glider is not in steady state.
+            while not reached(depth) and t < max_time:
+                steady = None
+                if not any(moving):
+                    steady = self.steady_state(depth, bpump, battpos)
+                    if steady is not None and abs(steady[0]-uh) < self.tolerance and abs(steady[1]-w) < self.tolerance:
+                        break
+                if moving[0]:
+                    bpump, moving[0] = self.__actuate(bpump, bpump_target, pump.speed, h)
+                if moving[1]:
+                    battpos, moving[1] = self.__actuate(battpos, battpos_target, motor.speed, h)
+                pitch = self.__pitch(battpos, bpump, depth)
+                x, _, z, uh, _, w = gfm.step_integrate(0., 0., -depth, uh, 0., w, pitch,
+                                                       self.environment.get_density(depth), bpump, math.pi/2)
+                distance += x
+                depth = -z
+                t += h
+            else:
+                steady = None
+        finally:
+            gfm.dt = dt
+        if steady is not None:
+            # steady glide, in depth segments, until the target depth is reached and detected.
+            delay = self.cpu_cycle/2
+            while t < max_time:
+                uh, w = steady
+                remaining = target_depth - depth
+                if climbing != (w > 0) or remaining == 0:
+                    break
+                dz = math.copysign(min(abs(remaining), self.segment_depth), remaining)
+                segment = min(dz/-w, max_time - t)
+                t += segment
+                depth -= w*segment
+                distance += uh*segment
+                if reached(depth) or t >= max_time:
+                    break
+                steady = self.steady_state(depth + dz/2, bpump, battpos) or steady
+            if reached(depth):
+                delay = min(delay, max_time - t)
+                t += delay
+                depth = max(depth - w*delay, 0)
+                distance += uh*delay
+        return dict(time=t, distance=distance,
+                    state=dict(depth=depth, uh=uh, w=w, bpump=bpump, battpos=battpos))
+
+    @staticmethod
+    def __actuate(position, target, speed, h):
+        # moves an actuator for a time h; returns the position and whether it still moves.
+        step = speed*h
+        if abs(target-position) <= step:
+            return target, False
+        return position + math.copysign(step, target-position), True
+
+    def surface_state(self):
+        ''' Returns the state of the glider at the surface, before a dive'''
+        pump = self.glider_model.buoyancypump
+        motor = self.glider_model.pitchmotor
+        return dict(depth=0., uh=0., w=0., bpump=pump.position_max, battpos=motor.position_max)
+
+    # cycles
+
+    def yo(self, water_depth=None):
+        ''' Computes a yo cycle (dive and climb)
+
+        The cycle is computed after a first yo, so that it represents the periodic
+        yo cycles that follow the first dive.
+
+        Parameters
+        ----------
+        water_depth : float or None
+            water depth (m), used if the yo behavior has a target altitude
+
+        Returns
+        -------
+        dict
+            time, dive_time and climb_time (s), horizontal distance through the water
+            (m), and the minimum and maximum depth (m)
+        '''
+        dive_depth = self.dive_depth(water_depth)
+        climb_depth = self.yo_behavior.c_target_depth
+        state = self.surface_state()
+        for i in range(2):
+            dive = self.half_cycle(state, self.dive_settings(state['depth']), dive_depth)
+            climb = self.half_cycle(dive['state'], self.climb_settings(dive['state']['depth']), climb_depth)
+            state = climb['state']
+        return dict(time=dive['time'] + climb['time'],
+                    dive_time=dive['time'],
+                    climb_time=climb['time'],
+                    distance=dive['distance'] + climb['distance'],
+                    max_depth=dive['state']['depth'],
+                    min_depth=climb['state']['depth'])
+
+    def surface_time(self):
+        ''' Returns an estimate of the time (s) spent at the surface
+
+        The glider waits for a GPS fix, for keystroke_wait_time if the surface
+        behavior has end_action 1, and for the initialisation of the dive. The
+        time until the glider has left the surface is part of the dive.
+        '''
+        s = self.surface_behavior
+        gps_time = self.glider_model.gps.acquiretime
+        wait = min(gps_time, s.gps_wait_time)
+        if s.end_action == 1:
+            wait = max(wait, s.keystroke_wait_time, s.datatransfertime)
+        # each state of the surface behavior, from Complete to Busy, takes at least one CPU cycle.
+        return wait + self.init_dive_time + 5*self.cpu_cycle
+
+    def dive_cycle(self, water_depth=None, surface_interval=None):
+        ''' Computes a dive cycle, from leaving the surface to leaving the surface again
+
+        The glider dives from the surface and makes yos until the surface
+        behavior is triggered by its timer, after which it climbs to the surface.
+
+        Parameters
+        ----------
+        water_depth : float or None
+            water depth (m)
+        surface_interval : float or None
+            time (s) after which the surface behavior is triggered. If None, it
+            is taken from the surface behavior (when_secs).
+
+        Returns
+        -------
+        dict
+            time, dive_time (underwater) and surface_time (s), horizontal distance
+            through the water (m) and the number of yos.
+
+        Raises
+        ------
+        ValueError
+            if there is no surface behavior with a timer
+        '''
+        s = self.surface_behavior
+        if s is None:
+            raise ValueError("The mission has no surface behavior triggered by a timer.")
+        surface_time = self.surface_time()
+        if surface_interval is None:
+            surface_interval = s.when_secs
+            if s.start_when == 9: # counted from the surfacing, including the time at the surface
+                surface_interval -= surface_time
+        dive_depth = self.dive_depth(water_depth)
+        climb_depth = self.yo_behavior.c_target_depth
+        state = self.surface_state()
+        t = distance = 0.
+        n_half_cycles = 0
+        while t < surface_interval:
+            if n_half_cycles%2 == 0:
+                r = self.half_cycle(state, self.dive_settings(state['depth']), dive_depth, surface_interval - t)
+            else:
+                r = self.half_cycle(state, self.climb_settings(state['depth']), climb_depth, surface_interval - t)
+            t += r['time']
+            distance += r['distance']
+            state = r['state']
+            n_half_cycles += 1
+        r = self.half_cycle(state, self.surface_settings(state['depth']), 0.)
+        t += r['time']
+        distance += r['distance']
+        return dict(time=t + surface_time, dive_time=t, surface_time=surface_time,
+                    distance=distance, yos=n_half_cycles/2)
+
+    def time_to_reach(self, distance, bearing, u=0., v=0., water_depth=None, surface_interval=None):
+        ''' Estimates the time needed to travel a distance under constant currents
+
+        The glider steers such that it compensates the cross-track current,
+        including the drift at the surface. All arguments except water_depth
+        and surface_interval can be arrays.
+
+        Parameters
+        ----------
+        distance : float or array
+            distance (m) to the waypoint
+        bearing : float or array
+            bearing (rad, clockwise from north) of the waypoint
+        u, v : float or array
+            eastward and northward depth-averaged current (m/s)
+        water_depth, surface_interval :
+            see dive_cycle()
+
+        Returns
+        -------
+        float or array
+            time (s), or inf if the waypoint cannot be reached against the current
+        '''
+        if self.surface_behavior is None and surface_interval is None:
+            c = self.yo(water_depth)
+            T, T_under = c['time'], c['time']
+        else:
+            c = self.dive_cycle(water_depth, surface_interval)
+            T, T_under = c['time'], c['dive_time']
+        speed = c['distance']/T_under # through the water, while underwater
+        along = u*np.sin(bearing) + v*np.cos(bearing)
+        cross = u*np.cos(bearing) - v*np.sin(bearing)
+        # cross-track velocity needed underwater to compensate the drift over a whole cycle
+        cross_under = cross*T/T_under
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ground_speed = (T_under*np.sqrt(speed**2 - cross_under**2) + T*along)/T
+            t = np.where(ground_speed > 0, distance/ground_speed, np.inf)
+        t = np.where(np.isnan(t), np.inf, t)
+        return t if t.ndim else float(t)
+
+
+def simulation_statistics(t, depth, x, y, u=0., v=0., surface_depth=0.05):
+    ''' Extracts yo and dive cycle statistics from a simulated time series
+
+    Parameters
+    ----------
+    t, depth, x, y : arrays
+        time (s), depth (m) and true position (x_lmc_x, x_lmc_y) of the glider
+    u, v : float
+        constant current (m/s), subtracted to obtain distances through the water
+
+    Returns
+    -------
+    dict
+        mean yo time, dive_time, climb_time (between depth extrema), horizontal
+        path length through the water (distance), max_depth, and if available, the mean dive cycle time,
+        underwater time (dive_time) and surface_time.
+    '''
+    t = np.asarray(t, float)
+    depth = np.asarray(depth, float)
+    # horizontal path length through the water
+    path = np.hstack(([0], np.cumsum(np.hypot(np.diff(np.asarray(x, float) - u*t),
+                                              np.diff(np.asarray(y, float) - v*t)))))
+    stats = {}
+    at_surface = depth < surface_depth
+    edges = np.flatnonzero(np.diff(at_surface.astype(int))) + 1
+    dives = [i for i in edges if not at_surface[i]] # leaving the surface
+    surfacings = [i for i in edges if at_surface[i]]
+    # depth extrema, excluding the first dive and last climb of each dive cycle
+    sign = np.sign(np.diff(depth))
+    extrema = np.flatnonzero(sign[1:]*sign[:-1] < 0) + 1
+    extrema = [i for i in extrema if not at_surface[i]]
+    bottoms = [i for i in extrema if depth[i] > depth[i-1]]
+    tops = [i for i in extrema if depth[i] < depth[i-1]]
+    yos = []
+    for i0 in tops:
+        b = [i for i in bottoms if i > i0]
+        n = [i for i in tops if i > i0]
+        if not b or not n or any(i0 < s <= n[0] for s in surfacings):
+            continue
+        i1, i2 = b[0], n[0]
+        yos.append((t[i1]-t[i0], t[i2]-t[i1], path[i2]-path[i0], depth[i1]))
+    if yos:
+        dive_time, climb_time, distance, max_depth = np.mean(yos, axis=0)
+        stats.update(time=dive_time+climb_time, dive_time=dive_time, climb_time=climb_time,
+                     distance=distance, max_depth=max_depth, yos=len(yos))
+    cycles = []
+    for i0 in dives:
+        s = [i for i in surfacings if i > i0]
+        d = [i for i in dives if i > i0]
+        if s and d:
+            cycles.append((t[d[0]]-t[i0], t[s[0]]-t[i0], t[d[0]]-t[s[0]]))
+    if cycles:
+        time, dive_time, surface_time = np.mean(cycles, axis=0)
+        stats['dive_cycle'] = dict(time=time, dive_time=dive_time, surface_time=surface_time,
+                                   cycles=len(cycles))
+    return stats
+
+
+def validate(config, glider_model, environment=None, hours=8, dt=0.5, CPUcycle=4,
+             use_glider_directory_structure=True):
+    ''' Compares the reduced-order model with the full simulator
+
+    Runs the mission of config with GliderMission in a constant environment,
+    and compares the yo and dive cycle statistics with those of DiveCycleModel.
+
+    Parameters
+    ----------
+    config : Config
+        configuration of the mission
+    glider_model : BaseGliderModel
+        glider model, with initialised flight model
+    environment : ConstantEnvironment or None
+        environment. If None, ConstantEnvironment() is used.
+    hours : float
+        simulated time (h)
+
+    Returns
+    -------
+    dict
+        simulation and model statistics, and the relative differences (model-simulation)/simulation
+    '''
+    from . import glidersim
+    environment = environment or ConstantEnvironment()
+    if config.special_settings and 'glider.gps.acquiretime' in config.special_settings:
+        glider_model.gps.acquiretime = config.special_settings['glider.gps.acquiretime']
+    model = DiveCycleModel.from_mission(glider_model, config.missionName, config.mission_directory,
+                                        use_glider_directory_structure, environment=environment,
+                                        cpu_cycle=CPUcycle)
+    GM = glidersim.GliderMission(config, glider_model=glider_model, environment_model=environment, verbose=False)
+    GM.loadmission(verbose=False, use_glider_directory_structure=use_glider_directory_structure)
+    GM.run(dt=dt, CPUcycle=CPUcycle, maxSimulationTime=hours/24.)
+    simulation = simulation_statistics(GM.get('m_present_time'), GM.get('m_depth'),
+                                       GM.get('x_lmc_x'), GM.get('x_lmc_y'), environment.u, environment.v)
+    yo = model.yo(environment.water_depth)
+    result = dict(simulation=simulation, model=dict(yo), differences={})
+    for k in ('time', 'dive_time', 'climb_time', 'distance', 'max_depth'):
+        if k in simulation:
+            result['differences'][k] = (yo[k]-simulation[k])/simulation[k]
+    if model.surface_behavior is not None:
+        cycle = model.dive_cycle(environment.water_depth)
+        result['model']['dive_cycle'] = cycle
+        if 'dive_cycle' in simulation:
+            for k in ('time', 'dive_time', 'surface_time'):
+                result['differences']['dive_cycle_'+k] = (cycle[k]-simulation['dive_cycle'][k])/simulation['dive_cycle'][k]
+    return result
+
+
+def main():
+    ''' Validates the reduced-order model against the full simulator on a mission
+
+    Uses a Shallow100mGliderModel with the flight model settings of the
+    example in the README.
+    '''
+    from . import configuration
+    from . import glidermodels
+    ap = argparse.ArgumentParser(description="Compares the reduced-order dive-cycle model with the full simulator.")
+    ap.add_argument('mission_directory', help="directory with the missions and mafiles directories")
+    ap.add_argument('mission', help="mission name (e.g. nsb3.mi)")
+    ap.add_argument('--hours', type=float, default=8, help="simulated time (h)")
+    ap.add_argument('--water-depth', type=float, default=40., help="water depth (m)")
+    ap.add_argument('-u', type=float, default=0., help="eastward current (m/s)")
+    ap.add_argument('-v', type=float, default=0., help="northward current (m/s)")
+    ap.add_argument('--datestr', default='20190809')
+    ap.add_argument('--timestr', default='15:20')
+    ap.add_argument('--lat', type=float, default=5440.1099, help="initial latitude (NMEA)")
+    ap.add_argument('--lon', type=float, default=646.5619, help="initial longitude (NMEA)")
+    args = ap.parse_args()
+    glider_model = glidermodels.Shallow100mGliderModel()
+    glider_model.initialise_gliderflightmodel(Cd0=0.20, mg=73.3, Vg=71.542e-3, T1=2052, T2=-35.5, T3=0.36)
+    config = configuration.Config(args.mission, description="planning validation",
+                                  datestr=args.datestr, timestr=args.timestr,
+                                  lat_ini=args.lat, lon_ini=args.lon,
+                                  mission_directory=args.mission_directory,
+                                  noise=False,
+                                  special_settings={'glider.gps.acquiretime':100.,
+                                                    'mission_initialisation_time':400,
+                                                    'initial_heading':0})
+    environment = ConstantEnvironment(args.water_depth, args.u, args.v)
+    result = validate(config, glider_model, environment, hours=args.hours)
+    print(json.dumps(result, indent=2, default=float))
+
+
+if __name__ == '__main__':
+    main()
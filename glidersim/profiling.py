@@ -0,0 +1,160 @@
+'''Per-phase profiling
+
+PhaseProfiler accumulates the wall time and the number of calls of
+the phases of a simulation:
+
+* behaviors : the layered control (LayeredControl.cycle)
+* actuators : actuator updates (set_commanded, actuate and get_measured)
+* environment : environment model lookups (get_environmental_data)
+* flight_model : compute_heading_from_fin, compute_pitch_from_battpos_buoyancy_drive
+  and step_integrate
+* coordinates : conversion of LMC coordinates to latitude and longitude
+* recording : recording of the glider state (add_data)
+
+The profiler wraps the methods concerned, by setting instance
+attributes, so that there is no cost at all when profiling is not
+enabled. Times are exclusive: the time of a phase called from within
+another phase (for example a coordinate conversion triggered by the
+recording) is not counted twice.
+
+Profiling is normally enabled through GliderMission:
+
+>>> GM.enable_profiling()
+>>> GM.run(dt=0.5, CPUcycle=4, maxSimulationTime=1)
+>>> GM.profile_report()
+'''
+from contextlib import contextmanager
+import time
+
+
+PHASES = ('behaviors', 'actuators', 'environment', 'flight_model', 'coordinates', 'recording')
+
+
+class TimedProjection(object):
+    ''' Wrapper around a LocalProjection that times the conversions'''
+    def __init__(self, projection, profiler):
+        self.projection = projection
+        self.__call__ = profiler.timed('coordinates', projection.__call__)
+        self.nmea = profiler.timed('coordinates', projection.nmea)
+
+    def __call__(self, x, y):
+        return self.__call__(x, y)
+
+    def __getattr__(self, name):
+        return getattr(self.projection, name)
+
+
+class PhaseProfiler(object):
+    ''' Accumulates wall time and call counts per phase of a glider mission'''
+    def __init__(self):
+        self.times = {}
+        self.calls = {}
+        self._stack = [] # time spent in nested phases, for each active phase
+        self._installed = [] # (object, method name) of the wrapped methods
+        self._projection = None # TimedProjection of the current projection
+        self.reset()
+
+    def reset(self):
+        ''' Sets all counters to zero'''
+        # update in place: the dictionaries are shared with the installed wrappers.
+        self.times.update((k, 0.) for k in PHASES)
+        self.calls.update((k, 0) for k in PHASES)
+        self.wall_time = 0.
+        self.simulated_time = 0.
+        self._t0 = None
+
+    def timed(self, phase, function):
+        ''' Returns function, wrapped such that its calls are accounted to phase'''
+        times = self.times
+        calls = self.calls
+        stack = self._stack
+        def wrapper(*p, **kwds):
+            t0 = time.perf_counter()
+            stack.append(0.)
+            try:
+                return function(*p, **kwds)
+            finally:
+                elapsed = time.perf_counter() - t0
+                times[phase] += elapsed - stack.pop()
+                calls[phase] += 1
+                if stack:
+                    stack[-1] += elapsed
+        return wrapper
+
+    def __wrap(self, obj, name, phase):
+        setattr(obj, name, self.timed(phase, getattr(obj, name)))
+        self._installed.append((obj, name))
+
+    def install(self, mission):
+        ''' Wraps the methods of a GliderMission, its glider model and layered control'''
+        if self._installed:
+            return
+        glider = mission.glider
+        self.__wrap(mission.LC, 'cycle', 'behaviors')
+        for actuator in (glider.pitchmotor, glider.buoyancypump, glider.finmotor):
+            for name in ('set_commanded', 'actuate', 'get_measured'):
+                self.__wrap(actuator, name, 'actuators')
+        self.__wrap(glider, 'get_environmental_data', 'environment')
+        gfm = glider.gliderflight_model
+        for name in ('compute_heading_from_fin', 'compute_pitch_from_battpos_buoyancy_drive', 'step_integrate'):
+            self.__wrap(gfm, name, 'flight_model')
+        get_projection = glider.get_projection
+        def timed_get_projection():
+            projection = get_projection()
+            if self._projection is None or self._projection.projection is not projection:
+                self._projection = TimedProjection(projection, self)
+            return self._projection
+        glider.get_projection = timed_get_projection
+        self._installed.append((glider, 'get_projection'))
+        self.__wrap(mission, 'add_data', 'recording')
+
+    def uninstall(self):
+        ''' Removes all wrappers'''
+        for obj, name in self._installed:
+            delattr(obj, name)
+        self._installed = []
+        self._projection = None
+
+    @contextmanager
+    def uninstalled(self, mission):
+        ''' Context in which the wrappers are removed (for pickling the mission)'''
+        installed = bool(self._installed)
+        self.uninstall()
+        try:
+            yield
+        finally:
+            if installed:
+                self.install(mission)
+
+    def start(self, simulation_time):
+        self._t0 = time.perf_counter()
+        self._simulation_time0 = simulation_time
+
+    def stop(self, simulation_time):
+        if self._t0 is not None:
+            self.wall_time += time.perf_counter() - self._t0
+            self.simulated_time += simulation_time - self._simulation_time0
+            self._t0 = None
+
+    def report(self):
+        ''' Returns a dictionary with the profiling results
+
+        Returns
+        -------
+        dict
+            wall_time (s), simulated_time (s), speed (simulated seconds per wall
+            second), and for each phase the time (s), number of calls and fraction
+            of the wall time. Time not spent in any of the phases is reported as
+            phase "other".
+        '''
+        wall_time = self.wall_time
+        phases = {}
+        for k in PHASES:
+            phases[k] = dict(time=self.times[k], calls=self.calls[k],
+                             fraction=self.times[k]/wall_time if wall_time else 0.)
+        other = max(0., wall_time - sum(self.times.values()))
+        phases['other'] = dict(time=other, calls=0, fraction=other/wall_time if wall_time else 0.)
+        return dict(wall_time=wall_time,
+                    simulated_time=self.simulated_time,
+                    speed=self.simulated_time/wall_time if wall_time else 0.,
+                    phases=phases)
@@ -0,0 +1,163 @@
+'''Local projection
+
+Positions of the simulated glider are integrated in local mission
+coordinates (LMC), in metres east and north of the UTM position
+utm_0. Converting these to latitude and longitude with UTM2latlon
+every time step is relatively expensive. LocalProjection replaces the
+full inverse UTM projection by a second-order Taylor expansion around
+anchor points, which is accurate to within a given tolerance (in
+metres) in a square cell around each anchor.
+
+The cells form a regular grid in LMC coordinates, with an anchor at the
+centre of each cell. Anchors are computed when the glider first enters
+a cell, so that the result for a given position does not depend on the
+track followed to get there.
+
+>>> projection = LocalProjection(gs['utm_0'])
+>>> lat, lon = projection(x, y) # decimal degrees
+>>> lat_nmea, lon_nmea = decimal_to_nmea(lat), decimal_to_nmea(lon)
+'''
+import math
+
+import numpy as np
+
+from latlonUTM import UTM2latlon
+
+
+def decimal_to_nmea(x):
+    ''' Converts a decimal latitude or longitude to NMEA format (DDDMM.MMMM)'''
+    d = int(x)
+    return d*100 + (x-d)*60
+
+
+def decimal_to_nmea_array(x):
+    ''' Converts an array of decimal latitudes or longitudes to NMEA format'''
+    d = np.trunc(x)
+    return d*100 + (x-d)*60
+
+
+class LocalProjection(object):
+    ''' Conversion of local mission coordinates to decimal latitude and longitude
+
+    Parameters
+    ----------
+    utm_0 : tuple
+        ((easting, northing), zone number, zone letter) of the origin of the LMC coordinates
+    tolerance : float
+        maximum position error (m) of the local expansion
+    max_cell_size : float
+        upper limit of the size (m) of the cells with a common anchor
+
+    Notes
+    -----
+    The error of a second-order expansion scales with the third power of the
+    distance to the anchor. The cell size is derived from the error found at a
+    probe point when the projection is created.
+    '''
+    STEP = 50. # step size (m) for the finite differences
+    PROBE_DISTANCE = 2000.
+    METRES_PER_DEGREE = 111.2e3
+
+    def __init__(self, utm_0, tolerance=0.001, max_cell_size=20000.):
+        self.utm_0 = utm_0
+        self.tolerance = tolerance
+        (self.east, self.north), self.zone_number, self.zone_letter = utm_0
+        self.anchors = {}
+        self.cell_size = self.__calibrate(max_cell_size)
+
+    def __utm2latlon(self, x, y):
+        return UTM2latlon(self.zone_number, self.zone_letter, self.east+x, self.north+y)
+
+    def __expand(self, x, y):
+        ''' Returns the expansion coefficients of latitude and longitude around (x, y)'''
+        h = self.STEP
+        c = self.__utm2latlon(x, y)
+        xp = self.__utm2latlon(x+h, y)
+        xm = self.__utm2latlon(x-h, y)
+        yp = self.__utm2latlon(x, y+h)
+        ym = self.__utm2latlon(x, y-h)
+        pp = self.__utm2latlon(x+h, y+h)
+        pm = self.__utm2latlon(x+h, y-h)
+        mp = self.__utm2latlon(x-h, y+h)
+        mm = self.__utm2latlon(x-h, y-h)
+        coefficients = [x, y]
+        for i in range(2):
+            coefficients += [c[i],
+                             (xp[i]-xm[i])/(2*h),
+                             (yp[i]-ym[i])/(2*h),
+                             (xp[i]-2*c[i]+xm[i])/(2*h*h),
+                             (pp[i]-pm[i]-mp[i]+mm[i])/(4*h*h),
+                             (yp[i]-2*c[i]+ym[i])/(2*h*h)]
+        return tuple(coefficients)
+
+    @staticmethod
+    def __evaluate(coefficients, x, y):
+        x0, y0, a0, ax, ay, axx, axy, ayy, b0, bx, by, bxx, bxy, byy = coefficients
+        dx = x-x0
+        dy = y-y0
+        lat = a0 + dx*(ax + dx*axx + dy*axy) + dy*(ay + dy*ayy)
+        lon = b0 + dx*(bx + dx*bxx + dy*bxy) + dy*(by + dy*byy)
+        return lat, lon
+
+    def __error(self, coefficients, x, y):
+        lat, lon = self.__evaluate(coefficients, x, y)
+        true_lat, true_lon = self.__utm2latlon(x, y)
+        dlat = (lat-true_lat)*self.METRES_PER_DEGREE
+        dlon = (lon-true_lon)*self.METRES_PER_DEGREE*math.cos(math.radians(true_lat))
+        return math.hypot(dlat, dlon)
+
+    def __calibrate(self, max_cell_size):
+        coefficients = self.__expand(0, 0)
+        r = self.PROBE_DISTANCE
+        error = self.__error(coefficients, r, r)/(r*2**0.5)**3 # error per m**3
+        if error > 0:
+            radius = 0.8 * (self.tolerance/error)**(1/3) # distance from anchor to cell corner
+            cell_size = min(max_cell_size, radius * 2**0.5)
+        else:
+            cell_size = max_cell_size
+        return cell_size
+
+    def anchor(self, x, y):
+        ''' Returns the expansion coefficients for the cell that contains (x, y)'''
+        cell = (math.floor(x/self.cell_size), math.floor(y/self.cell_size))
+        try:
+            return self.anchors[cell]
+        except KeyError:
+            return self.__new_anchor(cell)
+
+    def __new_anchor(self, cell):
+        coefficients = self.anchors[cell] = self.__expand((cell[0]+0.5)*self.cell_size,
+                                                          (cell[1]+0.5)*self.cell_size)
+        return coefficients
+
+    def __call__(self, x, y):
+        ''' Returns decimal latitude and longitude of LMC position (x, y)'''
+        return self.__evaluate(self.anchor(x, y), x, y)
+
+    def nmea(self, x, y):
+        ''' Returns latitude and longitude of LMC position (x, y) in NMEA format'''
+        lat, lon = self.__evaluate(self.anchor(x, y), x, y)
+        return decimal_to_nmea(lat), decimal_to_nmea(lon)
+
+    def evaluate_array(self, x, y):
+        ''' Returns decimal latitude and longitude for arrays of LMC positions
+
+        The results are identical to those of calling the projection for each position.
+        '''
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        cells = np.stack([np.floor(x/self.cell_size), np.floor(y/self.cell_size)]).astype(int)
+        unique_cells, inverse = np.unique(cells.reshape(2, -1), axis=1, return_inverse=True)
+        coefficients = []
+        for i, j in unique_cells.T.tolist():
+            try:
+                coefficients.append(self.anchors[(i, j)])
+            except KeyError:
+                coefficients.append(self.__new_anchor((i, j)))
+        coefficients = np.array(coefficients).reshape(-1, 14)[inverse.ravel()].T
+        return self.__evaluate(coefficients, x.ravel(), y.ravel())
+
+    def nmea_array(self, x, y):
+        ''' Returns latitude and longitude in NMEA format for arrays of LMC positions'''
+        lat, lon = self.evaluate_array(x, y)
+        return decimal_to_nmea_array(lat), decimal_to_nmea_array(lon)
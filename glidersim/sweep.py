@@ -0,0 +1,410 @@
+'''Parameter sweeps
+
+This module runs a GliderMission for each of a set of parameter
+overrides in separate worker processes. Each job writes its results to
+its own output file as soon as it is finished, and is registered in a
+manifest file (one JSON record per line). When a sweep is restarted,
+jobs that are registered as completed in the manifest are skipped,
+unless the base of the sweep (the configuration, the mission files, the
+flight model of the glider model factory or the run() keywords) has
+changed since (see base_digest()).
+
+An override is a dictionary, for example
+
+>>> dict(Cd0=0.18, T1=2000, sensor_settings=dict(m_water_vx=0.2))
+
+Keys sensor_settings and special_settings update the corresponding
+dictionaries of the configuration. The keys T1..T4 set the pitch model
+parameters, and all other keys are passed to the define() method of
+the glider flight model (Cd0, Vg, mg, ...). Keys of the form
+"sensor_settings.m_water_vx" are accepted as well. Other keys, such as
+attributes of the configuration, raise a ValueError before any job is
+started.
+
+Example
+-------
+
+>>> overrides = grid(Cd0=[0.18, 0.20, 0.22], mg=[73.1, 73.3])
+>>> sweep = ParameterSweep(conf, Shallow100mGliderModel_factory, environment_model,
+...                        overrides, output_directory='sweep', max_workers=4, timeout=3600)
+>>> sweep.run()
+
+The sweep can also be run from the command line, see main().
+'''
+import argparse
+import copy
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import runpy
+import sys
+import time
+import traceback
+
+from latlon import convertToDecimal
+
+from . import common
+from . import glidersim
+
+logger = common.get_logger(name='sweep')
+
+PITCH_PARAMETERS = ('T1', 'T2', 'T3', 'T4')
+SETTINGS = ('sensor_settings', 'special_settings')
+MANIFEST = 'manifest.jsonl'
+
+
+def nest_overrides(overrides):
+    ''' Converts keys like "sensor_settings.m_water_vx" into nested dictionaries.'''
+    r = {}
+    for k, v in overrides.items():
+        if "." in k:
+            group, parameter = k.split(".", 1)
+            if group not in SETTINGS:
+                raise ValueError(f"Unknown override group {group}.")
+            r.setdefault(group, {})[parameter] = v
+        elif k in SETTINGS:
+            r.setdefault(k, {}).update(v)
+        else:
+            r[k] = v
+    return r
+
+
+def grid(**parameters):
+    ''' Returns a list of overrides spanning all combinations of the given values.
+
+    Parameters
+    ----------
+    parameters : keyword arguments
+        parameter name and list of values
+
+    Returns
+    -------
+    list of dict
+        overrides
+
+    Examples
+    --------
+    >>> grid(Cd0=[0.18, 0.2], **{'sensor_settings.m_water_vx':[0, 0.2]})
+    '''
+    names = list(parameters.keys())
+    return [nest_overrides(dict(zip(names, values)))
+            for values in itertools.product(*[parameters[k] for k in names])]
+
+
+def job_id(overrides):
+    ''' Returns a short identifier, unique for a set of overrides.'''
+    s = json.dumps(overrides, sort_keys=True)
+    return hashlib.sha1(s.encode()).hexdigest()[:12]
+
+
+def base_digest(config, glider_model, run_kwds):
+    ''' Returns a short digest of what, besides the overrides, determines the results of a job
+
+    Parameters
+    ----------
+    config : configuration.Config
+        base configuration. The mission file and the mafiles it refers to are
+        included, if they exist.
+    glider_model : glidermodels.BaseGliderModel
+        glider model, of which the flight model parameters are included
+    run_kwds : dict
+        keywords passed to GliderMission.run()
+
+    Returns
+    -------
+    str
+    '''
+    gfm = glider_model.gliderflight_model
+    flight_model = dict((k, getattr(gfm, k)) for k in gfm.parameters)
+    flight_model['pitch_model_parameters'] = list(gfm.pitch_model_parameters)
+    base = dict(config=vars(config), flight_model=flight_model, run_kwds=run_kwds)
+    # objects, such as a datastore.RecordingSpec, are represented by their attributes.
+    s = json.dumps(base, sort_keys=True, default=lambda o: getattr(o, '__dict__', repr(o)))
+    h = hashlib.sha1(s.encode())
+    mission = os.path.join(config.mission_directory, glidersim.MISSIONS, config.missionName)
+    mafiles_directory = os.path.join(config.mission_directory, glidersim.MAFILES)
+    filenames = [mission]
+    if os.path.isdir(mafiles_directory):
+        filenames += [os.path.join(mafiles_directory, fn) for fn in sorted(os.listdir(mafiles_directory))]
+    for filename in filenames:
+        if os.path.isfile(filename):
+            h.update(filename.encode())
+            with open(filename, 'rb') as fp:
+                h.update(fp.read())
+    return h.hexdigest()[:12]
+
+
+def check_overrides(glider_model, overrides):
+    ''' Checks that all keys of overrides are known
+
+    Parameters
+    ----------
+    glider_model : glidermodels.BaseGliderModel
+        glider model, of which the flight model parameters are accepted as keys
+    overrides : dict
+        overrides
+
+    Raises
+    ------
+    ValueError
+        if a key is neither a settings group, a pitch model parameter nor a
+        parameter of the glider flight model.
+    '''
+    parameters = list(glider_model.gliderflight_model.parameters)
+    for k in nest_overrides(overrides):
+        if k not in SETTINGS and k not in PITCH_PARAMETERS and k not in parameters:
+            known = ", ".join(list(SETTINGS) + list(PITCH_PARAMETERS) + parameters)
+            raise ValueError(f"Unknown override {k} (known: {known}).")
+
+
+def apply_overrides(config, glider_model, overrides):
+    ''' Applies overrides to the glider model and a copy of the configuration
+
+    Parameters
+    ----------
+    config : configuration.Config
+        base configuration (not modified)
+    glider_model : glidermodels.BaseGliderModel
+        glider model, of which the flight model is modified.
+    overrides : dict
+        overrides
+
+    Returns
+    -------
+    configuration.Config
+        modified copy of config
+
+    Raises
+    ------
+    ValueError
+        if overrides contain unknown keys (see check_overrides())
+    '''
+    check_overrides(glider_model, overrides)
+    config = copy.deepcopy(config)
+    gfm = glider_model.gliderflight_model
+    pitch_model_parameters = list(gfm.pitch_model_parameters)
+    flight_parameters = {}
+    for k, v in nest_overrides(overrides).items():
+        if k in SETTINGS:
+            settings = dict(getattr(config, k))
+            settings.update(v)
+            setattr(config, k, settings)
+        elif k in PITCH_PARAMETERS:
+            pitch_model_parameters[PITCH_PARAMETERS.index(k)] = v
+        else:
+            flight_parameters[k] = v
+    gfm.pitch_model_parameters = tuple(pitch_model_parameters)
+    if flight_parameters:
+        gfm.define(**flight_parameters)
+    return config
+
+
+class ParameterSweep(object):
+    ''' Runs GliderMissions for a list of overrides in parallel
+
+    Parameters
+    ----------
+    config : configuration.Config
+        base configuration
+    glider_model_factory : callable
+        called without arguments, returns a new glider model with initialised flight model.
+    environment_model : environment model
+        environment model, shared by all jobs. Worker processes are forked, so that
+        data loaded by the environment model before the sweep starts are not loaded again.
+    overrides : list of dict
+        overrides, one for each job.
+    output_directory : str
+        directory where output files and the manifest are written.
+    run_kwds : dict or None
+        keywords passed to GliderMission.run()
+    max_workers : int or None
+        maximum number of concurrent jobs. If None, the number of CPUs is used.
+    timeout : float or None
+        maximum wall time (s) per job, after which the job is terminated.
+    preload_environment : bool
+        if True, the environment model is queried once for the start time and
+        position of the base configuration before the workers are started.
+    '''
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, config, glider_model_factory, environment_model, overrides,
+                 output_directory='.', run_kwds=None, max_workers=None, timeout=None,
+                 preload_environment=True):
+        self.config = config
+        self.glider_model_factory = glider_model_factory
+        self.environment_model = environment_model
+        self.overrides = list(overrides)
+        self.output_directory = output_directory
+        self.run_kwds = run_kwds or dict(dt=0.5, CPUcycle=4)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.preload_environment = preload_environment
+        self.manifest_filename = os.path.join(output_directory, MANIFEST)
+        self._base_digest = None
+
+    @property
+    def base_digest(self):
+        ''' digest of the base of the sweep (see base_digest())'''
+        if self._base_digest is None:
+            self._base_digest = base_digest(self.config, self.glider_model_factory(), self.run_kwds)
+        return self._base_digest
+
+    def get_jobs(self):
+        jobs = [(job_id(o), o) for o in self.overrides]
+        ids = [i for i, _ in jobs]
+        if len(set(ids)) != len(ids):
+            raise ValueError("Overrides contain duplicates.")
+        return jobs
+
+    def output_filename(self, jid):
+        _, extension = os.path.splitext(self.config.output or "output.nc")
+        return os.path.join(self.output_directory, f"{jid}{extension}")
+
+    def read_manifest(self):
+        ''' Returns a dictionary of job id -> last manifest record.'''
+        records = {}
+        if os.path.exists(self.manifest_filename):
+            with open(self.manifest_filename, 'r') as fp:
+                for line in fp:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue # partially written line of an interrupted sweep.
+                    records[record['id']] = record
+        return records
+
+    def completed_jobs(self):
+        ''' Returns the ids of the jobs completed with the current base of the sweep'''
+        return set(k for k, v in self.read_manifest().items()
+                   if v['status']=='completed' and v.get('base')==self.base_digest)
+
+    def _write_manifest(self, record):
+        with open(self.manifest_filename, 'a') as fp:
+            fp.write(json.dumps(record)+"\n")
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    def initialise_environment(self):
+        ''' Makes the environment model load its data, before forking the workers.'''
+        c = self.config
+        glider_model = self.glider_model_factory()
+        glider_model.initialise_gliderstate(c.datestr, c.timestr, c.lat_ini, c.lon_ini, c.mission_start)
+        t = glider_model.gs['m_present_time']
+        try:
+            self.environment_model.get_data(t, convertToDecimal(c.lat_ini), convertToDecimal(c.lon_ini), 0)
+        except Exception as e:
+            logger.warning(f"Could not initialise environment model ({e}).")
+
+    def run_job(self, jid, overrides):
+        ''' Runs a single job in the current process.'''
+        glider_model = self.glider_model_factory()
+        config = apply_overrides(self.config, glider_model, overrides)
+        GM = glidersim.GliderMission(config, glider_model=glider_model,
+                                     environment_model=self.environment_model, verbose=False)
+        GM.loadmission(verbose=False)
+        GM.run(**self.run_kwds)
+        GM.save(self.output_filename(jid))
+
+    def _worker(self, jid, overrides):
+        try:
+            self.run_job(jid, overrides)
+        except BaseException:
+            with open(os.path.join(self.output_directory, f"{jid}.err"), 'w') as fp:
+                fp.write(traceback.format_exc())
+            sys.exit(1)
+
+    def run(self):
+        ''' Runs all jobs that have not been completed yet.
+
+        Returns
+        -------
+        dict
+            number of jobs per status (completed, failed, timeout, skipped)
+
+        Raises
+        ------
+        ValueError
+            if any of the overrides contains unknown keys
+        '''
+        jobs = self.get_jobs()
+        glider_model = self.glider_model_factory()
+        for _, o in jobs:
+            check_overrides(glider_model, o)
+        os.makedirs(self.output_directory, exist_ok=True)
+        completed = self.completed_jobs()
+        pending = [(jid, o) for jid, o in jobs if jid not in completed]
+        summary = dict(completed=0, failed=0, timeout=0, skipped=len(jobs)-len(pending))
+        logger.info(f"Sweep: {len(jobs)} jobs, {summary['skipped']} already completed.")
+        if not pending:
+            return summary
+        if self.preload_environment:
+            self.initialise_environment()
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing.get_context()
+        running = {}
+        try:
+            while pending or running:
+                while pending and len(running)<self.max_workers:
+                    jid, o = pending.pop(0)
+                    p = context.Process(target=self._worker, args=(jid, o), name=f"glidersim-{jid}")
+                    p.start()
+                    running[jid] = (p, o, time.time())
+                time.sleep(self.POLL_INTERVAL)
+                for jid, (p, o, t0) in list(running.items()):
+                    elapsed = time.time()-t0
+                    if p.is_alive():
+                        if self.timeout is None or elapsed<self.timeout:
+                            continue
+                        p.terminate()
+                        p.join()
+                        status = 'timeout'
+                    else:
+                        p.join()
+                        status = 'completed' if p.exitcode==0 else 'failed'
+                    running.pop(jid)
+                    summary[status] += 1
+                    self._write_manifest(dict(id=jid, status=status, overrides=o, base=self.base_digest,
+                                              output=self.output_filename(jid),
+                                              elapsed=round(elapsed, 3), exitcode=p.exitcode,
+                                              finished=time.time()))
+                    logger.info(f"Job {jid}: {status} ({elapsed:.1f} s).")
+        finally:
+            for p, _, _ in running.values():
+                p.terminate()
+        return summary
+
+
+def main(argv=None):
+    ''' Command line interface
+
+    The sweep is defined by a python file, which should define the variables
+
+    * config : configuration.Config, the base configuration
+    * glider_model_factory : callable returning a new glider model
+    * environment_model : the environment model
+    * overrides : list of overrides (see grid())
+
+    and optionally run_kwds, a dictionary with keywords for GliderMission.run().
+    '''
+    ap = argparse.ArgumentParser(description="Run a glidersim parameter sweep.")
+    ap.add_argument("spec", help="python file defining config, glider_model_factory, environment_model and overrides")
+    ap.add_argument("-o", "--output-directory", default="sweep", help="directory for output files and manifest")
+    ap.add_argument("-j", "--max-workers", type=int, default=None, help="maximum number of concurrent jobs")
+    ap.add_argument("-t", "--timeout", type=float, default=None, help="maximum wall time per job (s)")
+    args = ap.parse_args(argv)
+    spec = runpy.run_path(args.spec)
+    sweep = ParameterSweep(spec['config'], spec['glider_model_factory'], spec['environment_model'],
+                           spec['overrides'], output_directory=args.output_directory,
+                           run_kwds=spec.get('run_kwds'), max_workers=args.max_workers,
+                           timeout=args.timeout)
+    summary = sweep.run()
+    print(" ".join(f"{k}: {v}" for k, v in summary.items()))
+    return 0 if summary['failed']==summary['timeout']==0 else 1
+
+
+if __name__=='__main__':
+    sys.exit(main())
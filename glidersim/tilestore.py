@@ -0,0 +1,249 @@
+'''Memory-mapped tile store for bathymetry
+
+Regional bathymetry grids can be large, whereas a simulation uses only
+a small area around the mission. Reading the complete grid from NetCDF
+each time an environment is (re)initialised costs time and memory.
+
+convert() converts a bathymetry variable from a NetCDF file, once, into
+a tile store: a directory with the grid values in square tiles, stored
+contiguously in a binary (.npy) file, and the coordinates and metadata.
+TileStore opens the tile file memory-mapped and read-only, so that only
+the pages of the tiles that are accessed, near the glider, are read
+from disk. Several simulation processes using the same store share
+these pages through the page cache of the operating system.
+
+The values are accessed through TiledArray, which can be indexed as a
+two-dimensional array with integers, integer arrays and slices, in the
+orientation of the original NetCDF variable. Missing values are returned
+as NaN, or, if the store is opened with masked=True or a fill_value, as
+masked values or the fill value, like the NetCDF variable would return.
+
+The environments accept a tile store directory instead of a NetCDF file
+name for their bathymetry (GliderData.bathymetry_filename,
+getm.Bathymetry, GetmEnvironment.NCBATHYMETRY and
+NemoEnvironment.NCBATHYMETRY).
+
+>>> tilestore.convert('bathymetry.nc', 'bathymetry_tiles', 'elevation', 'lat', 'lon', factor=-1)
+>>> store = tilestore.TileStore('bathymetry_tiles')
+>>> lat, lon, water_depth = store.subregion(54, 54.5, 6.5, 7.5)
+'''
+import json
+import os
+
+import numpy as np
+import netCDF4
+
+from . import common
+
+logger = common.get_logger(name="tilestore")
+
+FORMAT_VERSION = 1
+METADATA_FILENAME = 'metadata.json'
+TILES_FILENAME = 'tiles.npy'
+COORDINATES_FILENAME = 'coordinates.npz'
+
+
+def is_tile_store(path):
+    ''' Returns True if path is a tile store directory'''
+    return os.path.isfile(os.path.join(path, METADATA_FILENAME))
+
+
+def convert(nc_filename, directory, variable_name, lat_name, lon_name, factor=1., tile_size=64,
+            dtype='float32', transform=None):
+    ''' Converts a bathymetry variable of a NetCDF file into a tile store
+
+    The variable is read one row of tiles at a time, so that the complete
+    grid need not fit in memory. Masked values are stored as NaN.
+
+    Parameters
+    ----------
+    nc_filename : str
+        NetCDF file
+    directory : str
+        directory of the tile store, which is created if necessary
+    variable_name : str
+        name of the two-dimensional (lat, lon) bathymetry variable
+    lat_name, lon_name : str
+        names of the coordinate variables
+    factor : float
+        factor applied to the values, for example -1 to convert elevation into water depth
+    tile_size : int
+        number of grid points along the sides of a tile
+    dtype : str
+        data type of the stored values
+    transform : function or None
+        if given, applied to each block of values (after factor)
+
+    Returns
+    -------
+    TileStore
+    '''
+    dataset = netCDF4.Dataset(nc_filename, 'r')
+    try:
+        variable = dataset.variables[variable_name]
+        lat = np.asarray(dataset.variables[lat_name][...], float)
+        lon = np.asarray(dataset.variables[lon_name][...], float)
+        M, N = variable.shape
+        T = tile_size
+        n_i = -(-M//T)
+        n_j = -(-N//T)
+        os.makedirs(directory, exist_ok=True)
+        tmp_filename = os.path.join(directory, TILES_FILENAME + '.tmp')
+        tiles = np.lib.format.open_memmap(tmp_filename, mode='w+', dtype=dtype, shape=(n_i, n_j, T, T))
+        for ti in range(n_i):
+            block = np.ma.filled(np.ma.asarray(variable[ti*T:(ti+1)*T, :], float), np.nan)*factor
+            if transform is not None:
+                block = transform(block)
+            padded = np.full((T, n_j*T), np.nan)
+            padded[:block.shape[0], :N] = block
+            tiles[ti] = padded.reshape(T, n_j, T).transpose(1, 0, 2)
+        tiles.flush()
+        del tiles
+    finally:
+        dataset.close()
+    np.savez(os.path.join(directory, COORDINATES_FILENAME), lat=lat, lon=lon)
+    os.replace(tmp_filename, os.path.join(directory, TILES_FILENAME))
+    metadata = dict(version=FORMAT_VERSION, shape=[M, N], tile_size=T, dtype=dtype,
+                    source=os.path.abspath(nc_filename), variable=variable_name, factor=factor,
+                    transformed=transform is not None)
+    with open(os.path.join(directory, METADATA_FILENAME), 'w') as fp:
+        json.dump(metadata, fp, indent=2)
+    logger.info(f"Converted {variable_name} of {nc_filename} ({M}x{N}) into {n_i}x{n_j} tiles.")
+    return TileStore(directory)
+
+
+class TiledArray(object):
+    ''' Two-dimensional array view of tiles
+
+    Parameters
+    ----------
+    tiles : array (n_i, n_j, T, T)
+        tiles, typically memory-mapped
+    shape : (int, int)
+        shape of the array
+    reverse : (bool, bool)
+        if True, the corresponding axis is reversed
+    masked : bool
+        if True, missing values are returned masked (np.ma.masked)
+    fill_value : float or None
+        if given, missing values are returned as fill_value instead of NaN
+    '''
+    def __init__(self, tiles, shape, reverse=(False, False), masked=False, fill_value=None):
+        self.tiles = tiles
+        self.shape = tuple(shape)
+        self.ndim = 2
+        self.tile_size = tiles.shape[2]
+        self.reverse = tuple(reverse)
+        self.masked = masked
+        self.fill_value = fill_value
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        full = (slice(None), slice(None, None, -1))
+        if all(isinstance(k, slice) and k in full for k in key):
+            # whole axes, possibly reversed: a view, no data are read.
+            return TiledArray(self.tiles, self.shape,
+                              [r ^ (k.step == -1) for r, k in zip(self.reverse, key)],
+                              self.masked, self.fill_value)
+        i = self.__index(key[0], 0)
+        j = self.__index(key[1], 1)
+        if isinstance(key[0], slice) and isinstance(key[1], slice):
+            i, j = np.ix_(i, j)
+        ti, ii = np.divmod(i, self.tile_size)
+        tj, jj = np.divmod(j, self.tile_size)
+        r = self.tiles[ti, tj, ii, jj]
+        if np.ndim(r) == 0:
+            r = float(r)
+            if np.isnan(r):
+                if self.masked:
+                    return np.ma.masked
+                if self.fill_value is not None:
+                    return self.fill_value
+            return r
+        r = r.astype(float)
+        missing = np.isnan(r)
+        if self.masked:
+            return np.ma.masked_where(missing, r)
+        if self.fill_value is not None:
+            r[missing] = self.fill_value
+        return r
+
+    def __index(self, k, axis):
+        n = self.shape[axis]
+        if isinstance(k, slice):
+            k = np.arange(*k.indices(n))
+        else:
+            k = np.asarray(k)
+            if np.any((k < -n) | (k >= n)):
+                raise IndexError(f"Index out of bounds for axis {axis} with size {n}.")
+            k = k % n
+        if self.reverse[axis]:
+            k = n - 1 - k
+        return k
+
+    def __array__(self, dtype=None, copy=None):
+        r = np.ma.getdata(self[:self.shape[0], :self.shape[1]])
+        return r if dtype is None else r.astype(dtype)
+
+
+class TileStore(object):
+    ''' Bathymetry tile store, opened memory-mapped and read-only
+
+    Parameters
+    ----------
+    directory : str
+        directory of the tile store (see convert())
+    masked : bool
+        if True, missing values of the bathymetry are returned masked
+    fill_value : float or None
+        if given, missing values of the bathymetry are returned as fill_value
+
+    Attributes
+    ----------
+    lat, lon : array
+        coordinates
+    bathymetry : TiledArray
+        values, in the orientation of the original NetCDF variable
+
+    Raises
+    ------
+    ValueError
+        if directory is not a tile store of a supported version
+    '''
+    def __init__(self, directory, masked=False, fill_value=None):
+        if not is_tile_store(directory):
+            raise ValueError(f"{directory} is not a tile store.")
+        with open(os.path.join(directory, METADATA_FILENAME)) as fp:
+            self.metadata = json.load(fp)
+        if self.metadata['version'] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported tile store version {self.metadata['version']}.")
+        with np.load(os.path.join(directory, COORDINATES_FILENAME)) as coordinates:
+            self.lat = coordinates['lat']
+            self.lon = coordinates['lon']
+        tiles = np.load(os.path.join(directory, TILES_FILENAME), mmap_mode='r')
+        self.bathymetry = TiledArray(tiles, self.metadata['shape'], masked=masked, fill_value=fill_value)
+        self.directory = directory
+
+    def subregion(self, lat_min, lat_max, lon_min, lon_max):
+        ''' Returns the coordinates and values of a subregion
+
+        The subregion includes the grid points just outside the given
+        limits, so that positions within the limits can be interpolated.
+
+        Returns
+        -------
+        lat, lon, bathymetry : arrays (m,), (n,), (m, n)
+        '''
+        i = self.__range(self.lat, lat_min, lat_max)
+        j = self.__range(self.lon, lon_min, lon_max)
+        return self.lat[i], self.lon[j], self.bathymetry[i, j]
+
+    @staticmethod
+    def __range(x, x_min, x_max):
+        inside = np.flatnonzero((x >= x_min) & (x <= x_max))
+        if not inside.size:
+            # region between two grid points
+            k = int(np.argmin(np.abs(x - (x_min + x_max)/2)))
+            inside = np.array([k])
+        return slice(max(inside[0]-1, 0), min(inside[-1]+2, len(x)))
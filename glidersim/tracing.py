@@ -0,0 +1,206 @@
+'''Event tracing
+
+This module records events of the layered control during a simulation:
+
+* condition : a condition (b_arg) of a behavior is met
+* transition : the state machine of a behavior changes state
+* mission_status : the mission status (Behavior.MS) changes
+* command : a command is sent to an actuator
+
+Tracing is disabled by default. When disabled, the only cost is a
+check whether TRACER is None where events can occur. When enabled,
+the events are written to a file, either as JSON lines (extension
+.jsonl), or in a compact binary format (any other extension).
+
+Example
+-------
+
+>>> from glidersim import tracing
+>>> tracing.start("run.trc", events=['transition', 'mission_status'])
+>>> GM.run(dt=0.5, CPUcycle=4, maxSimulationTime=1)
+>>> tracing.stop()
+>>> events = tracing.read("run.trc")
+
+Each event is returned as a dictionary with at least the keys event
+and time (m_present_time).
+'''
+import json
+import struct
+
+EVENTS = ('condition', 'transition', 'mission_status', 'command')
+
+TRACER = None # the active tracer, or None if tracing is disabled.
+
+
+class JSONLWriter(object):
+    ''' Writes events as JSON lines'''
+    def __init__(self, fn):
+        self.fp = open(fn, 'w')
+
+    def write(self, event, t, fields):
+        record = dict(event=event, time=t)
+        record.update(fields)
+        self.fp.write(json.dumps(record)+"\n")
+
+    def close(self):
+        self.fp.close()
+
+    @staticmethod
+    def read(fn):
+        with open(fn, 'r') as fp:
+            return [json.loads(line) for line in fp if line.strip()]
+
+
+class BinaryWriter(object):
+    ''' Writes events in a compact binary format
+
+    The file starts with MAGIC. Each record starts with an event code
+    (uint8) and, except for string definitions, the time (float64). Names
+    (behaviors, states, ...) are stored once in a string definition record
+    and referred to by their index (uint16).
+    '''
+    MAGIC = b'GSTRACE1'
+    STRING = 0
+    RECORDS = {'condition':(1, 'HH', ('behavior', 'argument')),
+               'transition':(2, 'HHHH', ('behavior', 'input', 'state', 'next_state')),
+               'mission_status':(3, 'ii', ('previous', 'status')),
+               'command':(4, 'HHd', ('actuator', 'command', 'value'))}
+
+    def __init__(self, fn):
+        self.fp = open(fn, 'wb')
+        self.fp.write(self.MAGIC)
+        self.strings = {}
+        self.structs = dict((k, (code, struct.Struct('<Bd'+fmt), names))
+                            for k, (code, fmt, names) in self.RECORDS.items())
+
+    def __string(self, s):
+        s = str(s)
+        try:
+            return self.strings[s]
+        except KeyError:
+            i = self.strings[s] = len(self.strings)
+            b = s.encode('utf8')
+            self.fp.write(struct.pack('<BHH', self.STRING, i, len(b)) + b)
+            return i
+
+    def write(self, event, t, fields):
+        code, s, names = self.structs[event]
+        fmt = self.RECORDS[event][1]
+        values = [self.__string(fields[k]) if c == 'H' else fields[k] for k, c in zip(names, fmt)]
+        self.fp.write(s.pack(code, t, *values))
+
+    def close(self):
+        self.fp.close()
+
+    @classmethod
+    def read(cls, fn):
+        with open(fn, 'rb') as fp:
+            buffer = fp.read()
+        if not buffer.startswith(cls.MAGIC):
+            raise ValueError(f"{fn} is not a glidersim trace file.")
+        decoders = dict((code, (event, struct.Struct('<d'+fmt), fmt, names))
+                        for event, (code, fmt, names) in cls.RECORDS.items())
+        strings = []
+        records = []
+        i = len(cls.MAGIC)
+        while i < len(buffer):
+            code = buffer[i]
+            i += 1
+            if code == cls.STRING:
+                _, n = struct.unpack_from('<HH', buffer, i)
+                i += 4
+                strings.append(buffer[i:i+n].decode('utf8'))
+                i += n
+                continue
+            event, s, fmt, names = decoders[code]
+            t, *values = s.unpack_from(buffer, i)
+            i += s.size
+            record = dict(event=event, time=t)
+            for k, c, v in zip(names, fmt, values):
+                record[k] = strings[v] if c == 'H' else v
+            records.append(record)
+        return records
+
+
+class Tracer(object):
+    ''' Writes the selected events with writer
+
+    Parameters
+    ----------
+    writer : JSONLWriter or BinaryWriter
+        writer
+    events : list of str or None
+        events to record (see EVENTS). If None, all events are recorded.
+    '''
+    def __init__(self, writer, events=None):
+        self.writer = writer
+        self.events = set(events or EVENTS)
+        unknown = self.events.difference(EVENTS)
+        if unknown:
+            raise ValueError(f"Unknown trace event(s): {', '.join(sorted(unknown))}.")
+
+    def emit(self, event, t, **fields):
+        if event in self.events:
+            self.writer.write(event, t, fields)
+
+    def condition(self, t, behavior, argument):
+        self.emit('condition', t, behavior=behavior, argument=argument)
+
+    def transition(self, t, behavior, input_symbol, state, next_state):
+        self.emit('transition', t, behavior=behavior, input=input_symbol, state=state, next_state=next_state)
+
+    def mission_status(self, t, previous, status):
+        self.emit('mission_status', t, previous=previous, status=status)
+
+    def command(self, t, actuator, command, value):
+        self.emit('command', t, actuator=actuator, command=command, value=float(value))
+
+    def close(self):
+        self.writer.close()
+
+
+def start(fn, events=None):
+    ''' Starts tracing to file fn
+
+    Parameters
+    ----------
+    fn : str
+        filename. Events are written as JSON lines if the extension is .jsonl,
+        and in binary format otherwise.
+    events : list of str or None
+        events to record (see EVENTS). If None, all events are recorded.
+
+    Returns
+    -------
+    Tracer
+        the active tracer
+    '''
+    global TRACER
+    stop()
+    if fn.lower().endswith('.jsonl'):
+        writer = JSONLWriter(fn)
+    else:
+        writer = BinaryWriter(fn)
+    TRACER = Tracer(writer, events)
+    return TRACER
+
+
+def stop():
+    ''' Stops tracing and closes the trace file'''
+    global TRACER
+    if TRACER is not None:
+        TRACER.close()
+        TRACER = None
+
+
+def read(fn):
+    ''' Reads a trace file
+
+    Returns
+    -------
+    list of dict
+        events
+    '''
+    if fn.lower().endswith('.jsonl'):
+        return JSONLWriter.read(fn)
+    return BinaryWriter.read(fn)
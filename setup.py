@@ -43,4 +43,5 @@ setup(
     ],
     keywords=['ocean gliders', 'glider flight', 'oceanography'],
     install_requires=install_requires,
+    entry_points={'console_scripts':['glidersim_sweep = glidersim.sweep:main']},
 )
@@ -0,0 +1,75 @@
+import sys; sys.path.insert(0, "..")
+import unittest
+
+from glidersim.behaviors import Condition, ConditionAnd, ConditionOr, Flag
+from glidersim.gliderstate import GliderState, CLOCKS
+
+class Condition_test(unittest.TestCase):
+    def __init__(self, *p):
+        super().__init__(*p)
+        self.gs = dict(m_depth=10., m_altitude=float('nan'), stack=0)
+
+    def test_condition(self):
+        assert Condition('stack', '==', 0, (None, None)).check(self.gs)
+        assert not Condition('m_depth', '>', 20, (0, None)).check(self.gs)
+        assert Condition('m_depth', '>', 20, (0, None), 'stack', '==', 0, (None, None)).check(self.gs)
+
+    def test_valuerange(self):
+        # value outside the value range: condition is never met.
+        assert not Condition('m_depth', '>', -1, (0, None)).check(self.gs)
+
+    def test_and_or(self):
+        args = ('m_depth', '>', 5, (0, None), 'm_depth', '<', 8, (0, None))
+        assert not ConditionAnd(*args).check(self.gs)
+        assert ConditionOr(*args).check(self.gs)
+        c = Condition('m_depth', '<', 5, (0, None))
+        c.addCondition('m_depth', '>', 8, (0, None))
+        assert c.check(self.gs) and c.check_params(self.gs) == [False, True]
+
+    def test_nan(self):
+        assert not Condition('m_altitude', '<', 10, (0, None)).check(self.gs)
+
+    def test_missing_parameter(self):
+        with self.assertRaises(ValueError):
+            Condition('m_pitch', '>', 0, (None, None)).check(self.gs)
+
+class ConditionTracking_test(unittest.TestCase):
+    def __init__(self, *p):
+        super().__init__(*p)
+        self.gs = GliderState(dict((k, 0.) for k in CLOCKS), stack=0, m_depth=10.)
+
+    def test_changes(self):
+        c = Condition('stack', '==', 0, (None, None))
+        assert c.check(self.gs) and not c.changed
+        self.gs['stack'] = 0 # same value: no change
+        assert not c.changed
+        self.gs['stack'] = 1
+        assert c.changed and not c.check(self.gs)
+
+    def test_wake_time(self):
+        c = Condition('time_since_cycle_start', '>', 100, (0, None))
+        results = []
+        for i in range(300):
+            results.append(c.check(self.gs))
+            self.gs.increment(CLOCKS, 0.5)
+            if i == 250:
+                self.gs['time_since_cycle_start'] = 0
+        assert not c.changed
+        assert results.index(True) == 201 and not any(results[252:])
+
+    def test_surface_wake_time(self):
+        gs = GliderState(dict((k, 0.) for k in CLOCKS), m_depth=0., m_altitude=40.)
+        gs['m_present_time'] = 1000.
+        gs['nocomms'] = 300.
+        drifting = dict(m_altitude=1060.)
+        c = Condition('nocomms', '>', 600, (0, None), 'm_depth', '>', 50, (0, None))
+        assert c.surface_wake_time(gs, CLOCKS, drifting) == 1300.
+        c = Condition('nocomms', '<', 600, (0, None))
+        assert c.surface_wake_time(gs, CLOCKS, drifting) == 1000.
+        c = Condition('m_altitude', '<', 4, (0, None), 'nocomms', '>', 600, (0, None))
+        assert c.surface_wake_time(gs, CLOCKS, drifting) == 1060.
+        c = Condition('m_depth', '>', 50, (0, None))
+        assert c.surface_wake_time(gs, CLOCKS, drifting) == float('inf')
+        assert Flag(True).surface_wake_time(gs) == 1000. and Flag(False).surface_wake_time(gs) == float('inf')
+
+unittest.main()
@@ -0,0 +1,134 @@
+import sys; sys.path.insert(0, "..")
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from latlonUTM import latlon2UTM
+
+from glidersim import datastore
+from glidersim.gliderstate import GliderState
+from glidersim.projection import LocalProjection
+
+
+T0 = 1565364000.
+
+def glider_state():
+    return GliderState(m_present_time=T0, m_depth=0., temp=10., c_wpt_lat=5418.,
+                       _private=0., utm_0=None)
+
+def simulate(data_stores, gs, n, dt=0.5):
+    for i in range(n):
+        gs['m_present_time'] += dt
+        step = round((gs['m_present_time']-T0)/dt)
+        gs['m_depth'] = step*0.1
+        gs['temp'] = 10 + step*0.01
+        if step == 8:
+            gs['c_wpt_lat'] = 5419.
+        for data in data_stores:
+            data.add_data()
+
+
+class Data_test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.spec = datastore.RecordingSpec(exclude=['_*', 'utm_0'], intervals={'temp':3.},
+                                            on_change=['c_wpt_*'])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_buffer_growth(self):
+        capacity = datastore.RecordGroup.INITIAL_CAPACITY
+        datastore.RecordGroup.INITIAL_CAPACITY = 4
+        try:
+            gs = glider_state()
+            data = datastore.Data(gs, period=1)
+            simulate([data], gs, 11)
+        finally:
+            datastore.RecordGroup.INITIAL_CAPACITY = capacity
+        depth = data.get('m_depth')
+        assert np.allclose(depth, np.arange(1, 12)*0.1)
+        assert not depth.flags.owndata # a view on the record buffer
+        assert np.array_equal(data.data['m_present_time'], T0 + np.arange(1, 12)*0.5)
+
+    def test_schedules(self):
+        gs = glider_state()
+        data = datastore.Data(gs, period=4, spec=self.spec)
+        assert '_private' not in data.data and 'utm_0' not in data.data
+        assert data.time_key('temp') == 'time_3s' and data.time_key('c_wpt_lat') == 'time_c_wpt_lat'
+        assert data.time_key('m_depth') == 'm_present_time'
+        # steps_to_next_record() agrees with the steps at which records are made.
+        n_records = []
+        predicted = []
+        for i in range(40):
+            predicted.append(data.steps_to_next_record(0.5))
+            simulate([data], gs, 1)
+            n_records.append(len(data.get('m_present_time')) + len(data.get_time('temp')))
+        steps = np.flatnonzero(np.diff([0] + n_records)) + 1 # steps after which records were made
+        for i, p in enumerate(predicted):
+            assert p == steps[steps > i][0] - i
+        assert np.allclose(np.diff(data.get('m_present_time')), 2.)
+        # first recorded at the start, then at multiples of the interval.
+        t = data.get_time('temp') - T0
+        assert t[0] == 0.5 and np.allclose(t[1:], 3.*np.arange(1, len(t)))
+        assert np.array_equal(data.get('c_wpt_lat'), [5418., 5419.])
+        assert np.allclose(data.get_time('c_wpt_lat'), T0 + np.array([0.5, 4.]))
+
+    def test_output_stream(self):
+        gs = glider_state()
+        reference = datastore.Data(gs, period=2, spec=self.spec)
+        data = datastore.Data(glider_state(), period=2, spec=self.spec)
+        data.gs = gs
+        data.set_output_stream(os.path.join(self.directory.name, 'stream.nc'), flush_records=3)
+        simulate([reference, data], gs, 25)
+        assert os.path.exists(data._stream.fn)
+        for k in ['m_present_time', 'm_depth', 'temp', 'time_3s', 'c_wpt_lat', 'time_c_wpt_lat']:
+            assert np.array_equal(data.get(k), reference.get(k)), k
+        streamed = data.data
+        for k, v in reference.data.items():
+            assert np.array_equal(streamed[k], v), k
+
+    def test_derive_latlon(self):
+        # a glider moving north-east, with a new utm_0 halfway, as set by the goto behavior.
+        utm_0 = [latlon2UTM(54.6685, 6.9427), latlon2UTM(54.7, 7.0)]
+        gs = GliderState(m_present_time=T0, m_lmc_x=0., m_lmc_y=0., x_lmc_x=0., x_lmc_y=0.,
+                         m_lat=0., m_lon=0., x_lat=0., x_lon=0., utm_0=utm_0[0])
+        recorded = datastore.Data(gs, period=3)
+        derived = datastore.Data(gs, period=3, spec=datastore.RecordingSpec(derive_latlon=True))
+        for i in range(200):
+            if i == 100:
+                gs['utm_0'] = utm_0[1]
+            projection = LocalProjection(gs['utm_0'])
+            x = (i % 100)*3.
+            gs['m_present_time'] += 0.5
+            gs['m_lmc_x'] = gs['m_lmc_y'] = x
+            gs['x_lmc_x'] = x + 5
+            gs['x_lmc_y'] = x - 5
+            gs['m_lat'], gs['m_lon'] = projection.nmea(x, x)
+            gs['x_lat'], gs['x_lon'] = projection.nmea(x + 5, x - 5)
+            recorded.add_data()
+            derived.add_data()
+        lat = recorded.get('m_lat')
+        assert len(np.unique(lat)) == len(lat)
+        for k in ['m_lat', 'm_lon', 'x_lat', 'x_lon']:
+            assert np.array_equal(derived.get(k), recorded.get(k)), k
+            assert np.array_equal(derived.data[k], recorded.data[k]), k
+
+    def test_pickle(self):
+        gs = glider_state()
+        data = datastore.Data(gs, period=2, spec=self.spec)
+        data.metadata['seed'] = 3
+        simulate([data], gs, 20)
+        fn = os.path.join(self.directory.name, 'data.pck')
+        data.save(fn)
+        loaded = datastore.Data()
+        loaded.load(fn)
+        assert loaded.metadata == {'seed':3}
+        assert loaded.time_key('temp') == 'time_3s' and loaded.time_key('m_depth') == 'm_present_time'
+        for k in ['m_depth', 'temp', 'c_wpt_lat']:
+            assert np.array_equal(loaded.get(k), data.get(k)), k
+            assert np.array_equal(loaded.get_time(k), data.get_time(k)), k
+
+unittest.main()
@@ -0,0 +1,51 @@
+import sys; sys.path.insert(0, "..")
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import dbdreader
+
+from glidersim import dbdcache
+
+PATTERN = '../data/comet/from-glider/comet*.[st]bd'
+CACHEDIR = '../data/cac'
+PARAMETERS = ['sci_water_cond', 'sci_water_temp', 'sci_water_pressure', 'm_water_vx', 'm_water_vy']
+
+class DbdCache_test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_same_as_multidbd(self):
+        dbd = dbdreader.MultiDBD(pattern=PATTERN, cacheDir=CACHEDIR)
+        cache = dbdcache.DbdCache(self.directory.name, cacheDir=CACHEDIR)
+        for data in (cache.read(PATTERN, PARAMETERS), # decoded
+                     dbdcache.DbdCache(self.directory.name).read(PATTERN, PARAMETERS)): # from disk
+            for a, b in zip(data.get_sync(*PARAMETERS[:3]), dbd.get_sync(*PARAMETERS[:3])):
+                assert np.array_equal(a, b)
+            for a, b in zip(data.get('m_water_vx'), dbd.get('m_water_vx')):
+                assert np.array_equal(a, b)
+        self.assertRaises(dbdreader.DbdError, data.get, 'no_such_parameter')
+
+    def test_changed_files_are_decoded(self):
+        cache = dbdcache.DbdCache(self.directory.name, cacheDir=CACHEDIR)
+        cache.read(PATTERN, PARAMETERS)
+        decoded = []
+        decode = cache._DbdCache__decode
+        cache._DbdCache__decode = lambda fn, parameters: decoded.append(fn) or decode(fn, parameters)
+        cache.read(PATTERN, PARAMETERS)
+        assert not decoded
+        fn = sorted(cache._files)[0]
+        st = os.stat(fn)
+        try:
+            os.utime(fn, ns=(st.st_atime_ns, st.st_mtime_ns+10**9))
+            cache.read(PATTERN, PARAMETERS)
+        finally:
+            os.utime(fn, ns=(st.st_atime_ns, st.st_mtime_ns))
+        assert decoded == [fn]
+
+unittest.main()
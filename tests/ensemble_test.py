@@ -0,0 +1,67 @@
+import sys; sys.path.insert(0, "..")
+import unittest
+
+import numpy as np
+
+from glidersim import configuration, ensemble, glidermodels, glidersim, planning
+
+
+def config(noise=False):
+    return configuration.Config('nsb3.mi', datestr='20190809', timestr='15:20',
+                                lat_ini=5440.1099, lon_ini=646.5619,
+                                mission_directory='../data/comet/nsb3', storePeriod=1, noise=noise,
+                                special_settings={'initial_heading':0})
+
+def glider_model():
+    glider = glidermodels.Shallow100mGliderModel()
+    glider.initialise_gliderflightmodel(Cd0=0.20, mg=73.3, Vg=71.542e-3, T1=2052, T2=-35.5, T3=0.36)
+    return glider
+
+environment = planning.ConstantEnvironment(water_depth=40., rho=1025., drho_dz=0.02)
+
+
+class EnsembleMission_test(unittest.TestCase):
+    PARAMETERS = ['m_present_time', 'm_depth', 'm_lat', 'm_lon', 'x_lat', 'x_lon', 'm_lmc_x', 'm_lmc_y',
+                  'm_gps_status', 'm_ballast_pumped', 'm_battpos', 'm_fin', 'm_heading', 'm_pitch', 'm_speed']
+
+    def run_ensemble(self, n_members, scalar_members=None, seeds=None):
+        EM = ensemble.EnsembleMission(config(seeds is not None), glider_model(), n_members,
+                                      environment_model=environment, seeds=seeds)
+        if scalar_members is not None:
+            EM.glider.SCALAR_MEMBERS = scalar_members
+        EM.loadmission()
+        EM.run(dt=0.5, CPUcycle=4, maxSimulationTime=0.25/24)
+        return EM
+
+    def test_single_member_equals_glidermission(self):
+        GM = glidersim.GliderMission(config(), glider_model=glider_model(), environment_model=environment)
+        GM.loadmission()
+        GM.run(dt=0.5, CPUcycle=4, maxSimulationTime=0.25/24)
+        EM = self.run_ensemble(1)
+        assert GM.get('m_depth').max() > 10 # the glider has dived
+        fix = GM.get('m_gps_status')==0
+        assert fix.any() and np.array_equal(fix, EM.get('m_gps_status')[:, 0]==0)
+        for p in self.PARAMETERS:
+            assert np.allclose(GM.get(p), EM.get(p)[:, 0], rtol=0, atol=1e-9), p
+
+    def test_members_without_noise_are_identical(self):
+        # integrated member by member, and as arrays.
+        depths = []
+        for scalar_members in [None, 0]:
+            EM = self.run_ensemble(3, scalar_members)
+            for p in self.PARAMETERS:
+                x = EM.get(p)
+                assert np.array_equal(x[:, 1:], x[:, :1].repeat(2, axis=1)), p
+            depths.append(EM.get('m_depth'))
+        assert np.allclose(depths[0], depths[1], rtol=0, atol=1e-6)
+
+    def test_members_have_independent_noise(self):
+        # the trajectory of a member does not depend on the seeds of the other members.
+        reference = self.run_ensemble(1, seeds=[11])
+        for seeds in [[11, 22], [11, 33]]:
+            EM = self.run_ensemble(2, seeds=seeds)
+            for p in self.PARAMETERS:
+                assert np.array_equal(EM.get(p)[:, 0], reference.get(p)[:, 0]), p
+        assert not np.array_equal(EM.get('m_depth')[:, 1], EM.get('m_depth')[:, 0])
+
+unittest.main()
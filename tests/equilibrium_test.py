@@ -0,0 +1,60 @@
+import sys; sys.path.insert(0, "..")
+import math
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from glidersim import equilibrium, glidermodels
+
+
+class EquilibriumTable_test(unittest.TestCase):
+    def setUp(self):
+        glider = glidermodels.Shallow100mGliderModel()
+        glider.initialise_gliderflightmodel(Cd0=0.20, mg=73.3, Vg=71.542e-3)
+        self.gfm = glider.gliderflight_model
+        self.gfm.dt = 0.5
+        self.directory = tempfile.TemporaryDirectory()
+        equilibrium.CACHE_DIRECTORY = self.directory.name
+        equilibrium._tables.clear()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def steady_state(self, pitch, rho, buoyancy_change, z):
+        gfm = self.gfm
+        FBg = gfm.G*rho*(gfm.Vg*(1-gfm.epsilon*max(-z/10, 0)*1e5) + buoyancy_change*1e-6) - gfm.mg*gfm.G
+        u_hat, w_hat = equilibrium.get_table(gfm).lookup(pitch, FBg)[:2]
+        V = math.sqrt(2*abs(FBg)/(rho*gfm.S))
+        return V*u_hat, V*w_hat
+
+    def test_steady_state(self):
+        # a glider in steady state stays in steady state when integrated with RK4.
+        uh, w = self.steady_state(-0.45, 1026., -200., -20.)
+        assert w < 0
+        r = self.gfm.step_integrate(0., 0., -20., 0., uh, w, -0.45, 1026., -200., 0.)
+        assert abs(r[4]-uh) < 1e-6 and abs(r[5]-w) < 1e-6
+
+    def test_relax_equals_integration(self):
+        uh, w = self.steady_state(0.45, 1026., 200., -20.)
+        args = (0., 0., -20., 0., uh+5e-4, w-5e-4, 0.45, 1026., 200., 0.)
+        r_rk4 = self.gfm.step_integrate(*args)
+        self.gfm.set_equilibrium_tolerance(1e-3)
+        r_eq = self.gfm.step_integrate(*args)
+        assert np.allclose(r_eq, r_rk4, rtol=0, atol=1e-5)
+        # not close to the steady state
+        args = (0., 0., -20., 0., uh+1e-2, w, 0.45, 1026., 200., 0.)
+        assert self.gfm._step_equilibrium(*args) is None
+
+    def test_disk_cache(self):
+        table = equilibrium.get_table(self.gfm, n=181)
+        assert len(os.listdir(self.directory.name)) == 1
+        equilibrium._tables.clear()
+        cached = equilibrium.get_table(self.gfm, n=181)
+        assert cached is not table
+        assert np.array_equal(cached.descending, table.descending, equal_nan=True)
+        self.gfm.define(Cd0=0.25)
+        assert equilibrium.get_table(self.gfm, n=181) is not cached
+
+unittest.main()
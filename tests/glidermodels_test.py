@@ -0,0 +1,110 @@
+import sys; sys.path.insert(0, "..")
+import unittest
+
+import numpy as np
+
+import glidersim.glidermodels as glidermodels
+
+class GliderFlightModel_backend_test(unittest.TestCase):
+    def __init__(self, *p):
+        super().__init__(*p)
+        self.gfm = glidermodels.GliderFlightModel()
+        self.gfm.define(Cd0=0.20, Vg=71.542e-3, mg=73.3)
+        self.gfm.dt = 0.5
+
+    def test_float_backend_equals_numpy_backend(self):
+        rng = np.random.default_rng(1)
+        for i in range(500):
+            state = [rng.normal()*100, rng.normal()*100, -abs(rng.normal())*50,
+                     rng.normal()*0.3, rng.normal()*0.3, rng.normal()*0.2,
+                     rng.uniform(-0.5, 0.5), 1025+rng.normal(), rng.uniform(-250, 250),
+                     rng.uniform(0, 2*np.pi)]
+            self.gfm.set_backend('numpy')
+            r_numpy = self.gfm.step_integrate(*state)
+            self.gfm.set_backend('float')
+            r_float = self.gfm.step_integrate(*state)
+            assert np.allclose(r_numpy, r_float, rtol=1e-12, atol=1e-12)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            self.gfm.set_backend('fortran')
+
+class NoiseStream_test(unittest.TestCase):
+    def test_reproducible(self):
+        a = glidermodels.NoiseStream(seed=3, block_size=16)
+        b = glidermodels.NoiseStream(seed=3, block_size=16)
+        x = [a.normal() for i in range(40)]
+        assert x == [b.normal() for i in range(40)]
+        assert x[:16] == np.random.default_rng(3).standard_normal(16).tolist()
+
+    def test_disabled(self):
+        noise = glidermodels.NoiseStream(enabled=False)
+        assert noise.uniform() == 0.5 and noise.normal() == 0
+
+    def test_set_noise(self):
+        glider = glidermodels.Shallow100mGliderModel()
+        glider.set_noise(seed=1)
+        assert glider.pitchmotor.noise is glider.noise
+        assert glider.gliderflight_model.fin_model.noise_stream is glider.noise
+
+class SurfaceStep_test(unittest.TestCase):
+    def floating_glider(self):
+        glider = glidermodels.Shallow100mGliderModel()
+        glider.initialise_gliderflightmodel(Cd0=0.20, mg=73.3, Vg=71.542e-3)
+        glider.gliderflight_model.dt = 0.5
+        glider.initialise_gliderstate('20190809', '15:20', 5440.1099, 646.5619, 'initial')
+        glider.set_noise(seed=1)
+        for actuator in (glider.pitchmotor, glider.buoyancypump, glider.finmotor):
+            actuator.set_commanded(actuator.position)
+        glider.update(0, 0.5)
+        return glider
+
+    def test_surface_step_equals_update(self):
+        a = self.floating_glider()
+        b = self.floating_glider()
+        assert a.is_quiescent()
+        for i in range(20):
+            a.update(i*0.5, 0.5)
+            b.surface_step(i*0.5, 0.5, 0.5)
+        assert np.array_equal(a.gs.vector, b.gs.vector)
+
+    def test_steps(self):
+        a = self.floating_glider()
+        b = self.floating_glider()
+        t0 = a.gs['m_present_time']
+        for i in range(20):
+            a.surface_step(t0+i*0.5, 0.5, 60)
+        b.surface_step(t0, 0.5, 60, steps=20)
+        for k in glidermodels.BaseGliderModel.SURFACE_CLOCKS + ('m_gps_status', 'm_heading'):
+            assert a.gs[k] == b.gs[k], k
+        for k in ['x_lmc_x', 'x_lmc_y', 'm_lmc_x', 'm_lmc_y']:
+            assert np.isclose(a.gs[k], b.gs[k], rtol=0, atol=1e-9), k
+        change_times = b.surface_change_times(60)
+        assert change_times['m_heading'] == b.gs['m_present_time']
+        assert change_times['water_depth'] == t0 + 60
+
+    def test_moving_actuator(self):
+        glider = self.floating_glider()
+        glider.buoyancypump.set_commanded(-200)
+        assert not glider.is_quiescent()
+
+
+class AdaptiveSteps_test(unittest.TestCase):
+    floating_glider = SurfaceStep_test.floating_glider
+
+    def test_steps(self):
+        glider = self.floating_glider()
+        assert [glider.adaptive_steps(0.5, 8, 1e-3) for i in range(4)] == [2, 4, 8, 8]
+        glider.buoyancypump.set_commanded(-200)
+        assert glider.adaptive_steps(0.5, 8, 1e-3) == 1
+
+    def test_time_step_restored(self):
+        glider = self.floating_glider()
+        glider.update(0.5, 0.5, 4)
+        assert glider.gliderflight_model.dt == 0.5
+        assert glider.gs['m_present_time'] == self.floating_glider().gs['m_present_time'] + 2
+
+# suppress any info messages:
+glidermodels.logger.setLevel(glidermodels.common.logging.ERROR)
+
+unittest.main()
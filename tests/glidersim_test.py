@@ -0,0 +1,111 @@
+import sys; sys.path.insert(0, "..")
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from glidersim import configuration, glidermodels, glidersim, planning
+
+environment = planning.ConstantEnvironment(water_depth=40., rho=1025., drho_dz=0.02)
+current = planning.ConstantEnvironment(water_depth=40., u=0.1, v=-0.05, rho=1025., drho_dz=0.02)
+
+
+def glider_mission(seed=1, storePeriod=4, noise=True, environment_model=environment, **special_settings):
+    conf = configuration.Config('nsb3.mi', datestr='20190809', timestr='15:20',
+                                lat_ini=5440.1099, lon_ini=646.5619,
+                                mission_directory='../data/comet/nsb3', storePeriod=storePeriod, seed=seed,
+                                noise=noise, special_settings=dict(initial_heading=0, **special_settings))
+    glider = glidermodels.Shallow100mGliderModel()
+    glider.initialise_gliderflightmodel(Cd0=0.20, mg=73.3, Vg=71.542e-3, T1=2052, T2=-35.5, T3=0.36)
+    GM = glidersim.GliderMission(conf, glider_model=glider, environment_model=environment_model)
+    GM.loadmission()
+    return GM
+
+
+class Checkpoint_test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_resume_is_bit_exact(self):
+        fn = os.path.join(self.directory.name, 'checkpoint.pck')
+        GM = glider_mission()
+        GM.run(dt=0.5, CPUcycle=4, maxSimulationTime=1/24, checkpoint_filename=fn, checkpoint_interval=1500)
+        full = GM.data
+        resumed = glidersim.GliderMission.load_checkpoint(fn, environment)
+        t_checkpoint = resumed.glider.gs['m_present_time']
+        assert full['m_present_time'][0] < t_checkpoint < full['m_present_time'][-1]
+        resumed.run(dt=0.5, CPUcycle=4, maxSimulationTime=1/24)
+        data = resumed.data
+        assert data.keys() == full.keys()
+        for k, v in full.items():
+            if k != 'utm_0':
+                assert np.array_equal(data[k], v), k
+        # with the noise enabled, another seed gives another trajectory.
+        other = glider_mission(seed=2)
+        other.run(dt=0.5, CPUcycle=4, maxSimulationTime=1/24)
+        assert not np.array_equal(other.get('m_depth'), full['m_depth'])
+
+
+class Adaptive_test(unittest.TestCase):
+    def run_mission(self, adaptive):
+        GM = glider_mission(storePeriod=40, noise=False)
+        n_updates = [0]
+        update = GM.glider.update
+        def counting_update(*p):
+            n_updates[0] += 1
+            return update(*p)
+        GM.glider.update = counting_update
+        GM.run(dt=0.5, CPUcycle=4, maxSimulationTime=2/24, adaptive=adaptive)
+        return GM, n_updates[0]
+
+    def test_deviation_from_fixed_time_step(self):
+        fixed, n_fixed = self.run_mission(None)
+        adaptive, n_adaptive = self.run_mission(1e-4)
+        assert n_adaptive < n_fixed/3
+        assert np.array_equal(adaptive.get('m_present_time'), fixed.get('m_present_time'))
+        # the same control decisions, at the same times.
+        for k in ['c_ballast_pumped', 'c_battpos', 'm_gps_status']:
+            assert np.array_equal(adaptive.get(k), fixed.get(k)), k
+        assert np.abs(adaptive.get('m_depth') - fixed.get('m_depth')).max() < 0.005
+        for k in ['x_lmc_x', 'x_lmc_y', 'm_lmc_x', 'm_lmc_y']:
+            assert np.abs(adaptive.get(k) - fixed.get(k)).max() < 1, k
+
+
+class FastForward_test(unittest.TestCase):
+    def run_mission(self, fast_forward):
+        GM = glider_mission(noise=False, environment_model=current, datatransfertime=900)
+        calls = dict(update=0, surface_step=0, cycle=0)
+        def counting(obj, name):
+            method = getattr(obj, name)
+            def counting_method(*p):
+                calls[name] += 1
+                return method(*p)
+            setattr(obj, name, counting_method)
+        counting(GM.glider, 'update')
+        counting(GM.glider, 'surface_step')
+        counting(GM.LC, 'cycle')
+        GM.run(dt=0.5, CPUcycle=4, maxSimulationTime=3.5/24, fast_forward=fast_forward)
+        return GM, calls
+
+    def test_jump_to_next_event(self):
+        normal, normal_calls = self.run_mission(None)
+        fast, fast_calls = self.run_mission(60)
+        n_surface = normal_calls['update'] - fast_calls['update']
+        assert n_surface > 1000
+        # at the surface, the behaviors are processed at events only, and the
+        # glider is advanced once per record.
+        assert fast_calls['surface_step'] < n_surface/3
+        assert fast_calls['cycle'] < normal_calls['cycle'] - n_surface/8/2
+        assert np.array_equal(fast.get('m_present_time'), normal.get('m_present_time'))
+        # the same control decisions, at the same times.
+        for k in ['c_ballast_pumped', 'c_battpos', 'm_gps_status', 'c_gps_on', 'nocomms', 'samedepth_for']:
+            assert np.array_equal(fast.get(k), normal.get(k)), k
+        # with a constant current, the drift over a jump equals that of the time steps.
+        for k in ['m_depth', 'x_lmc_x', 'x_lmc_y', 'm_lmc_x', 'm_lmc_y']:
+            assert np.abs(fast.get(k) - normal.get(k)).max() < 1e-6, k
+
+unittest.main()
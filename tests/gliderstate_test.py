@@ -0,0 +1,60 @@
+import sys; sys.path.insert(0, "..")
+import unittest
+import pickle
+
+import numpy as np
+
+from glidersim.gliderstate import GliderState
+
+class GliderState_test(unittest.TestCase):
+    def __init__(self, *p):
+        super().__init__(*p)
+        self.gs = GliderState(m_depth=0, m_present_time=1565364000., utm_0=None, _pickup=False)
+
+    def test_dict_access(self):
+        self.gs['m_depth'] = 10
+        assert self.gs['m_depth'] == 10. and isinstance(self.gs['m_depth'], float)
+        assert self.gs['_pickup'] is False and self.gs['utm_0'] is None
+        assert list(self.gs.keys()) == ['m_depth', 'm_present_time', 'utm_0', '_pickup']
+
+    def test_vector(self):
+        self.gs['m_depth'] = 10
+        assert self.gs.vector[self.gs.slot('m_depth')] == 10
+        assert self.gs.numerical_keys == ['m_depth', 'm_present_time']
+
+    def test_snapshot_restore(self):
+        snapshot = self.gs.snapshot()
+        self.gs['m_depth'] = 10
+        self.gs['utm_0'] = ((500000, 6000000), 32, 'U')
+        self.gs.restore(snapshot)
+        assert self.gs['m_depth'] == 0 and self.gs['utm_0'] is None
+
+    def test_pickle(self):
+        gs = pickle.loads(pickle.dumps(self.gs))
+        assert gs == self.gs
+
+    def test_numerical_type(self):
+        with self.assertRaises(TypeError):
+            self.gs['m_depth'] = None
+
+    def test_defer(self):
+        calls = []
+        def f(x):
+            calls.append(x)
+            return x, 2*x
+        self.gs['m_lat'] = self.gs['m_lon'] = 0
+        self.gs.defer(('m_lat', 'm_lon'), f, 1.)
+        self.gs.defer(('m_lat', 'm_lon'), f, 2.)
+        assert calls == [] and 'm_lat' in self.gs.numerical_keys
+        assert self.gs['m_lon'] == 4. and calls == [2.]
+        self.gs.defer(('m_lat', 'm_lon'), f, 3.)
+        assert self.gs.vector[self.gs.slot('m_lat')] == 3.
+        assert calls == [2., 3.]
+
+    def test_view(self):
+        self.gs['m_lat'] = 0
+        self.gs.defer(('m_lat',), lambda: (1.,))
+        assert self.gs.view(['m_depth'])[self.gs.slot('m_lat')] == 0
+        assert self.gs.view(['m_lat'])[self.gs.slot('m_lat')] == 1
+
+unittest.main()
@@ -0,0 +1,51 @@
+import sys; sys.path.insert(0, "..")
+import tempfile
+import unittest
+
+import numpy as np
+
+from glidersim import equilibrium, glidermodels, planning
+
+
+class DiveCycleModel_test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        equilibrium.CACHE_DIRECTORY = self.directory.name
+        glider = glidermodels.Shallow100mGliderModel()
+        glider.initialise_gliderflightmodel(Cd0=0.20, mg=73.3, Vg=71.542e-3, T1=2052, T2=-35.5, T3=0.36)
+        glider.gps.acquiretime = 100.
+        environment = planning.ConstantEnvironment(water_depth=40., rho=1025., drho_dz=0.02)
+        self.model = planning.DiveCycleModel.from_mission(glider, 'nsb3.mi', '../data/comet/nsb3',
+                                                          environment=environment)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_yo(self):
+        # the full simulator gives yos of 500 s and 129 m, with dives to 36.8 m.
+        yo = self.model.yo(water_depth=40.)
+        assert abs(yo['time'] - 500) < 10
+        assert abs(yo['distance'] - 129) < 3
+        assert 35.5 < yo['max_depth'] < 37
+        # without water depth, the glider dives to d_target_depth
+        assert self.model.yo()['max_depth'] > 49
+
+    def test_dive_cycle(self):
+        # the full simulator gives a dive cycle of 10965 s, of which 415 s at the surface.
+        cycle = self.model.dive_cycle(water_depth=40.)
+        assert abs(cycle['time'] - 10965) < 100
+        assert abs(cycle['surface_time'] - 415) < 30
+        short = self.model.dive_cycle(water_depth=40., surface_interval=3600)
+        assert short['dive_time'] < cycle['dive_time']
+
+    def test_time_to_reach(self):
+        cycle = self.model.dive_cycle(water_depth=40.)
+        speed = cycle['distance']/cycle['time']
+        t = self.model.time_to_reach(10000., 0., water_depth=40.)
+        assert abs(t - 10000/speed) < 1e-6*t
+        # with and against a current, and a current that is too strong.
+        t = self.model.time_to_reach(10000., np.radians([90, 270, 90]), u=np.array([0.1, 0.1, -1]), water_depth=40.)
+        assert t[0] < 10000/speed < t[1]
+        assert np.isinf(t[2])
+
+unittest.main()
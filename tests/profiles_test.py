@@ -0,0 +1,101 @@
+import sys; sys.path.insert(0, "..")
+import unittest
+
+import numpy as np
+
+import dbdreader
+
+import glidersim.environments as env
+
+
+def loop_binned_rho(t, P, rho, tm, age):
+    # the per-sample loop that read_gliderdata used before the binning was vectorised.
+    weights = np.exp(-(tm - t)/(age*3600))
+    max_depth = P.max()*10
+    dz = 5
+    zi = np.arange(dz/2, max_depth+dz/2, dz)
+    bins = np.arange(0, max_depth+dz, dz)
+    bins[0]=-10
+    idx = np.digitize(P*10, bins)-1
+    rho_avg = np.zeros_like(zi, float)
+    weights_sum = np.zeros_like(zi, float)
+    for _idx, _w, _rho in zip(idx, weights, rho):
+        try:
+            rho_avg[_idx] += _rho*_w
+            weights_sum[_idx] += _w
+        except IndexError:
+            continue
+    j = np.unique(idx)
+    return zi[j], rho_avg[j]/weights_sum[j]
+
+class RollingProfile_test(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.t = np.sort(rng.uniform(0, 12*3600, 1000))
+        self.depth = rng.uniform(0, 40, 1000)
+        self.T = 10 + rng.normal(size=1000)
+        self.bins = np.array([0, 2, 5, 10, 20, 40.])
+
+    def test_binning(self):
+        profile = env.RollingProfile(self.bins, 12*3600, variance=True)
+        profile.update(self.t, self.depth, T=self.T)
+        z, T_avg = profile.get('T')
+        i = np.digitize(self.depth, self.bins)-1
+        w = np.exp(-(self.t[-1]-self.t)/(12*3600))
+        assert np.allclose(z, [1, 3.5, 7.5, 15, 30])
+        assert np.isclose(T_avg[2], np.sum((w*self.T)[i==2])/np.sum(w[i==2]))
+        T_var = profile.get_variance('T')[1]
+        assert np.isclose(T_var[2], np.sum((w*(self.T-T_avg[2])**2)[i==2])/np.sum(w[i==2]))
+
+    def test_incremental_update(self):
+        profile = env.RollingProfile(self.bins, 12*3600)
+        profile.update(self.t, self.depth, T=self.T)
+        incremental = env.RollingProfile(self.bins, 12*3600)
+        for k in np.array_split(np.arange(1000), 4):
+            incremental.update(self.t[k], self.depth[k], T=self.T[k])
+        assert np.allclose(incremental.get('T')[1], profile.get('T')[1])
+
+class ReadGliderData_test(unittest.TestCase):
+    def test_same_as_loop(self):
+        env.GliderData.DBDREADER_CACHEDIR = '../data/cac'
+        env.GliderData.DBD_CACHE_DIRECTORY = None
+        glider_data = env.GliderData('comet', gliders_directory='../data')
+        dbd = dbdreader.MultiDBD(pattern='../data/comet/from-glider/comet*.[st]bd', cacheDir='../data/cac')
+        tmp = dbd.get_sync(*"sci_water_cond sci_water_temp sci_water_pressure".split())
+        tm = tmp[0][-1] + 3600
+        glider_data.read_gliderdata(tm, 54.3, 7.2)
+        age = tm - tmp[0]
+        t, C, T, P = np.compress((tmp[1]>0) & (age>=0) & (age<glider_data.AGE*3600), tmp, axis=1)
+        rho = env.fast_gsw.rho(C*10, T, P*10, 7.2, 54.3)
+        z, rho_avg = loop_binned_rho(t, P, rho, tm, glider_data.AGE)
+        assert np.allclose(glider_data.rho_fun(z), rho_avg, rtol=0, atol=1e-9)
+
+class ProfileTable_test(unittest.TestCase):
+    def test_lookup(self):
+        # same as interp1d, including the values outside the profile
+        z = np.array([2.5, 7.5, 12.5, 22.5, 31.])
+        values = [1025+np.arange(5.), 35-np.arange(5.)**2]
+        table = env.ProfileTable(z, values, dz=0.1)
+        for depth in [-3, 0, 2.5, 4.07, 12.5, 17.33, 30.95, 31, 50]:
+            expected = [np.interp(depth, z, v) for v in values]
+            assert np.allclose(table(depth), expected, rtol=0, atol=1e-10)
+
+class CellCachedBathymetry_test(unittest.TestCase):
+    def test_same_as_regulargridinterpolator(self):
+        from scipy.interpolate import RegularGridInterpolator
+        lat = np.linspace(53, 56, 31)
+        lon = np.linspace(3, 9, 61)
+        bathymetry = 30 + 20*np.sin(3*lat[:, None])*np.cos(2*lon[None, :])
+        reference = RegularGridInterpolator((lat, lon), bathymetry)
+        fun = env.CellCachedBathymetry(lat[::-1], lon, bathymetry[::-1])
+        rng = np.random.default_rng(1)
+        lats = rng.uniform(53, 56, 200)
+        lons = rng.uniform(3, 9, 200)
+        assert np.allclose(fun((lats, lons)), reference((lats, lons)))
+        # a glider moving through the cells
+        for _lat, _lon in zip(np.linspace(54, 54.3, 100), np.linspace(7, 7.5, 100)):
+            assert np.isclose(fun((_lat, _lon)), reference((_lat, _lon)))
+        self.assertRaises(ValueError, fun, (57., 7.))
+        assert np.isnan(env.CellCachedBathymetry(lat, lon, bathymetry, bounds_error=False)((57., 7.)))
+
+unittest.main()
@@ -0,0 +1,88 @@
+import sys; sys.path.insert(0, "..")
+import json
+import time
+import unittest
+
+from glidersim import configuration, glidermodels, glidersim, planning, profiling
+
+
+class FakeClock(object):
+    # replaces the time module of profiling; time advances only with sleep().
+    def __init__(self):
+        self.t = 0.
+
+    def perf_counter(self):
+        return self.t
+
+    def sleep(self, dt):
+        self.t += dt
+
+
+class PhaseProfiler_test(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        profiling.time = self.clock
+        self.addCleanup(setattr, profiling, 'time', time)
+
+    def test_exclusive_times(self):
+        profiler = profiling.PhaseProfiler()
+        order = []
+        def inner():
+            order.append('coordinates')
+            self.clock.sleep(2.)
+        inner = profiler.timed('coordinates', inner)
+        def outer():
+            order.append('recording')
+            self.clock.sleep(1.)
+            inner()
+        outer = profiler.timed('recording', outer)
+        for i in range(2):
+            outer()
+        assert order == ['recording', 'coordinates']*2
+        assert profiler.calls['recording'] == profiler.calls['coordinates'] == 2
+        assert profiler.times['coordinates'] == 4.
+        assert profiler.times['recording'] == 2.
+
+    def test_report(self):
+        profiler = profiling.PhaseProfiler()
+        profiler.start(0.)
+        profiler.timed('behaviors', lambda: self.clock.sleep(1.))()
+        self.clock.sleep(3.)
+        profiler.stop(100.)
+        report = profiler.report()
+        assert set(report['phases']) == set(profiling.PHASES + ('other',))
+        assert report['wall_time'] == 4. and report['simulated_time'] == 100.
+        assert report['speed'] == 25.
+        assert report['phases']['behaviors'] == dict(time=1., calls=1, fraction=0.25)
+        assert report['phases']['other'] == dict(time=3., calls=0, fraction=0.75)
+        profiler.reset()
+        assert profiler.calls['behaviors'] == 0 and profiler.wall_time == 0
+
+
+class GliderMission_test(unittest.TestCase):
+    def test_profile_metadata(self):
+        conf = configuration.Config('nsb3.mi', datestr='20190809', timestr='15:20',
+                                    lat_ini=5440.1099, lon_ini=646.5619,
+                                    mission_directory='../data/comet/nsb3', storePeriod=4,
+                                    special_settings={'initial_heading':0})
+        glider = glidermodels.Shallow100mGliderModel()
+        glider.initialise_gliderflightmodel(Cd0=0.20, mg=73.3, Vg=71.542e-3)
+        environment = planning.ConstantEnvironment(water_depth=40., rho=1025., drho_dz=0.02)
+        GM = glidersim.GliderMission(conf, glider_model=glider, environment_model=environment)
+        GM.loadmission()
+        GM.enable_profiling()
+        t0 = GM.glider.gs['m_present_time']
+        GM.run(dt=0.5, CPUcycle=4, maxSimulationTime=0.01)
+        profile = json.loads(GM.metadata['profile'])
+        assert profile == GM.profile_report()
+        assert profile['simulated_time'] == GM.glider.gs['m_present_time'] - t0
+        phases = profile['phases']
+        assert all(phases[k]['calls'] > 0 for k in profiling.PHASES)
+        # per time step of 0.5 s one environment lookup, three flight model calls and a
+        # recording; the behaviors run once per CPU cycle of 8 time steps.
+        n = phases['environment']['calls']
+        assert n*0.5 == profile['simulated_time']
+        assert phases['flight_model']['calls'] == 3*n and phases['recording']['calls'] == n
+        assert phases['behaviors']['calls'] == -(-n//8)
+
+unittest.main()
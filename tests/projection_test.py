@@ -0,0 +1,35 @@
+import sys; sys.path.insert(0, "..")
+import unittest
+
+import numpy as np
+
+from latlonUTM import UTM2latlon, latlon2UTM
+from latlon import convertToNmea
+
+from glidersim.projection import LocalProjection, decimal_to_nmea
+
+class LocalProjection_test(unittest.TestCase):
+    def __init__(self, *p):
+        super().__init__(*p)
+        self.utm_0 = latlon2UTM(54.2, 7.9)
+        self.projection = LocalProjection(self.utm_0, tolerance=0.001)
+
+    def test_accuracy(self):
+        (east, north), z0, z1 = self.utm_0
+        for x, y in [(0, 0), (1234.5, -250.), (-8000, 12000), (30000, 30000)]:
+            lat, lon = self.projection(x, y)
+            _lat, _lon = UTM2latlon(z0, z1, east+x, north+y)
+            assert abs(lat-_lat)*111e3 < 1e-3 and abs(lon-_lon)*65e3 < 1e-3
+
+    def test_array(self):
+        x = np.linspace(-20000, 20000, 101)
+        y = np.linspace(5000, -15000, 101)
+        lat, lon = self.projection.nmea_array(x, y)
+        _lat, _lon = np.array([self.projection.nmea(*p) for p in zip(x, y)]).T
+        assert np.array_equal(lat, _lat) and np.array_equal(lon, _lon)
+
+    def test_nmea(self):
+        for x in [54.2, 7.9, -7.9, 0.25]:
+            assert abs(decimal_to_nmea(x)-convertToNmea(x)) < 1e-9
+
+unittest.main()
@@ -0,0 +1,141 @@
+import sys; sys.path.insert(0, "..")
+import json
+import os
+import tempfile
+import unittest
+
+from glidersim import configuration, glidermodels, sweep
+
+
+def glider_model_factory():
+    glider = glidermodels.Shallow100mGliderModel()
+    glider.initialise_gliderflightmodel(Cd0=0.20, mg=73.3, Vg=71.542e-3)
+    return glider
+
+def config():
+    return configuration.Config('nsb3.mi', datestr='20190809', timestr='15:20',
+                                lat_ini=5440.1099, lon_ini=646.5619, output='out.nc',
+                                sensor_settings=dict(m_water_vx=0.1))
+
+
+class FakeSweep(sweep.ParameterSweep):
+    # writes the flight model coefficient instead of running a mission; fails for Cd0 > 0.3.
+    POLL_INTERVAL = 0.01
+
+    def run_job(self, jid, overrides):
+        glider_model = self.glider_model_factory()
+        sweep.apply_overrides(self.config, glider_model, overrides)
+        if glider_model.gliderflight_model.Cd0 > 0.3:
+            raise ValueError("Failing job.")
+        with open(self.output_filename(jid), 'w') as fp:
+            fp.write(f"{glider_model.gliderflight_model.Cd0}")
+
+
+class Overrides_test(unittest.TestCase):
+    def test_grid(self):
+        overrides = sweep.grid(Cd0=[0.18, 0.2], **{'sensor_settings.m_water_vx':[0, 0.2]})
+        assert len(overrides) == 4
+        assert overrides[1] == dict(Cd0=0.18, sensor_settings=dict(m_water_vx=0.2))
+
+    def test_nest_overrides(self):
+        nested = sweep.nest_overrides({'sensor_settings.m_water_vx':0.2, 'sensor_settings':dict(m_water_vy=0.1),
+                                       'special_settings.mission_initialisation_time':400, 'mg':73.1})
+        assert nested == dict(sensor_settings=dict(m_water_vx=0.2, m_water_vy=0.1),
+                              special_settings=dict(mission_initialisation_time=400), mg=73.1)
+        self.assertRaises(ValueError, sweep.nest_overrides, {'config.storePeriod':2})
+
+    def test_job_id(self):
+        a = sweep.job_id(dict(Cd0=0.18, sensor_settings=dict(m_water_vx=0.2, m_water_vy=0.1)))
+        b = sweep.job_id(dict(sensor_settings=dict(m_water_vy=0.1, m_water_vx=0.2), Cd0=0.18))
+        assert a == b and len(a) == 12
+        assert a != sweep.job_id(dict(Cd0=0.18))
+
+    def test_base_digest(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for d in ['missions', 'mafiles']:
+                os.mkdir(os.path.join(directory, d))
+            with open(os.path.join(directory, 'missions', 'nsb3.mi'), 'w') as fp:
+                fp.write("behavior: surface")
+            with open(os.path.join(directory, 'mafiles', 'yo10.ma'), 'w') as fp:
+                fp.write("d_target_depth 10")
+            conf = config()
+            conf.mission_directory = directory
+            glider_model = glider_model_factory()
+            run_kwds = dict(dt=0.5, CPUcycle=4)
+            digest = sweep.base_digest(conf, glider_model, run_kwds)
+            assert digest == sweep.base_digest(conf, glider_model_factory(), dict(run_kwds))
+            with open(os.path.join(directory, 'mafiles', 'yo10.ma'), 'w') as fp:
+                fp.write("d_target_depth 20")
+            assert sweep.base_digest(conf, glider_model, run_kwds) != digest
+
+    def test_apply_overrides(self):
+        conf = config()
+        glider_model = glider_model_factory()
+        c = sweep.apply_overrides(conf, glider_model, {'Cd0':0.18, 'T1':2000, 'sensor_settings.m_water_vy':0.2})
+        assert glider_model.gliderflight_model.Cd0 == 0.18
+        assert glider_model.gliderflight_model.pitch_model_parameters[0] == 2000
+        assert c.sensor_settings == dict(m_water_vx=0.1, m_water_vy=0.2)
+        assert conf.sensor_settings == dict(m_water_vx=0.1)
+
+    def test_unknown_overrides(self):
+        for overrides in [dict(Cd00=0.18), dict(storePeriod=2)]:
+            glider_model = glider_model_factory()
+            with self.assertRaises(ValueError):
+                sweep.apply_overrides(config(), glider_model, overrides)
+            assert glider_model.gliderflight_model.Cd0 == 0.20
+
+
+class ParameterSweep_test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create_sweep(self, overrides):
+        return FakeSweep(config(), glider_model_factory, None, overrides, output_directory=self.directory.name,
+                         max_workers=2, preload_environment=False)
+
+    def test_resume(self):
+        overrides = sweep.grid(Cd0=[0.18, 0.2, 0.4])
+        s = self.create_sweep(overrides)
+        assert s.run() == dict(completed=2, failed=1, timeout=0, skipped=0)
+        jid = sweep.job_id(overrides[0])
+        with open(s.output_filename(jid)) as fp:
+            assert float(fp.read()) == 0.18
+        assert os.path.exists(os.path.join(self.directory.name, sweep.job_id(overrides[2]) + ".err"))
+        # an interrupted write of the manifest is ignored.
+        with open(s.manifest_filename, 'a') as fp:
+            fp.write('{"id": "abc", "sta')
+        assert s.completed_jobs() == set(sweep.job_id(o) for o in overrides[:2])
+        # completed jobs are skipped, the failed job is run again.
+        s = self.create_sweep(overrides + [dict(Cd0=0.22)])
+        assert s.run() == dict(completed=1, failed=1, timeout=0, skipped=2)
+        assert len(s.completed_jobs()) == 3
+
+    def test_changed_base(self):
+        overrides = sweep.grid(Cd0=[0.18, 0.2])
+        assert self.create_sweep(overrides).run()['completed'] == 2
+        assert self.create_sweep(overrides).run()['skipped'] == 2
+        # jobs completed with another configuration, flight model or run() keywords are run again.
+        s = self.create_sweep(overrides)
+        s.config.sensor_settings['m_water_vx'] = 0.2
+        assert s.run()['skipped'] == 0
+        s = self.create_sweep(overrides)
+        s.run_kwds = dict(dt=0.5, CPUcycle=4, fast_forward=60)
+        assert s.run()['skipped'] == 0
+        def heavier_glider_model_factory():
+            glider_model = glider_model_factory()
+            glider_model.gliderflight_model.define(mg=73.5)
+            return glider_model
+        s = self.create_sweep(overrides)
+        s.glider_model_factory = heavier_glider_model_factory
+        assert s.run()['skipped'] == 0
+        assert s.run()['skipped'] == 2
+
+    def test_unknown_override(self):
+        s = self.create_sweep([dict(Cd0=0.18), dict(Cd00=0.18)])
+        self.assertRaises(ValueError, s.run)
+        assert not os.path.exists(s.manifest_filename)
+
+unittest.main()
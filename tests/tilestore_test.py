@@ -0,0 +1,131 @@
+import sys; sys.path.insert(0, "..")
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import netCDF4
+
+from glidersim import environments, getm, nemo, tilestore
+
+
+class TileStore_test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.lat = np.linspace(56, 53, 30) # descending
+        self.lon = np.linspace(3, 9, 45)
+        self.elevation = -30 - 20*np.sin(3*self.lat[:, None])*np.cos(2*self.lon[None, :])
+        self.elevation[0, 0] = 9999
+        fn = os.path.join(self.directory.name, 'bathymetry.nc')
+        dataset = netCDF4.Dataset(fn, 'w')
+        dataset.createDimension('lat', len(self.lat))
+        dataset.createDimension('lon', len(self.lon))
+        dataset.createVariable('lat', float, ('lat',))[...] = self.lat
+        dataset.createVariable('lon', float, ('lon',))[...] = self.lon
+        v = dataset.createVariable('elevation', float, ('lat', 'lon'))
+        v.missing_value = 9999
+        v[...] = self.elevation
+        dataset.close()
+        self.store_directory = os.path.join(self.directory.name, 'tiles')
+        self.store = tilestore.convert(fn, self.store_directory, 'elevation', 'lat', 'lon',
+                                       factor=-1, tile_size=8, dtype='float64')
+        self.depth = -self.elevation
+        self.depth[0, 0] = np.nan
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_indexing(self):
+        store = tilestore.TileStore(self.store_directory)
+        b = store.bathymetry
+        assert isinstance(b.tiles, np.memmap)
+        assert np.array_equal(store.lat, self.lat) and b.shape == self.depth.shape
+        assert b[3, 17] == self.depth[3, 17] and b[-1, -2] == self.depth[-1, -2]
+        assert np.isnan(b[0, 0])
+        i = np.array([1, 9, 29])
+        j = np.array([44, 8, 0])
+        assert np.array_equal(b[i, j], self.depth[i, j])
+        assert np.array_equal(b[7:10, 15:17], self.depth[7:10, 15:17])
+        assert np.array_equal(b[::-1][2, 5], self.depth[::-1][2, 5])
+        assert np.array_equal(b[:, ::-1][2:4, 5:9], self.depth[:, ::-1][2:4, 5:9])
+        lat, lon, depth = store.subregion(54, 54.5, 6.5, 7.5)
+        assert lat.max() > 54.5 and lat.min() < 54 and lon.min() < 6.5 and lon.max() > 7.5
+        assert depth.shape == (len(lat), len(lon))
+
+    def test_glider_data(self):
+        reference = environments.CellCachedBathymetry(self.lat, self.lon, self.depth)
+        glider_data = environments.GliderData('comet', bathymetry_filename=self.store_directory)
+        glider_data.read_bathymetry()
+        for lat, lon in zip(np.linspace(54, 55.5, 50), np.linspace(4, 8, 50)):
+            assert np.isclose(glider_data.bathymetry_fun((lat, lon)), reference((lat, lon)))
+
+
+class FakeNcGetm(object):
+    # a GETM bathymetry file, with masked land points as read by netCDF4.
+    def __init__(self, variables):
+        self.variables = variables
+
+    def var(self, name):
+        return self.variables[name]
+
+    def close(self):
+        pass
+
+
+class GetmTileStore_test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.latc = np.linspace(53, 56, 30)
+        self.lonc = np.linspace(3, 9, 45)
+        depth = 30 + 20*np.sin(3*self.latc[:, None])*np.cos(2*self.lonc[None, :])
+        land = np.zeros(depth.shape, bool)
+        land[10:13, 20:22] = True
+        self.bathymetry = np.ma.masked_where(land, depth)
+        fn = os.path.join(self.directory.name, 'bathymetry.nc')
+        dataset = netCDF4.Dataset(fn, 'w')
+        dataset.createDimension('yc', len(self.latc))
+        dataset.createDimension('xc', len(self.lonc))
+        dataset.createVariable('latc', float, ('yc',))[...] = self.latc
+        dataset.createVariable('lonc', float, ('xc',))[...] = self.lonc
+        dataset.createVariable('bathymetry', float, ('yc', 'xc'), fill_value=-10.)[...] = self.bathymetry
+        dataset.close()
+        self.store_directory = os.path.join(self.directory.name, 'tiles')
+        tilestore.convert(fn, self.store_directory, 'bathymetry', 'latc', 'lonc', tile_size=8, dtype='float64')
+        variables = dict(latc=self.latc, lonc=self.lonc, bathymetry=self.bathymetry)
+        NcGetm = getm.getm_nc.NcGetm
+        getm.getm_nc.NcGetm = lambda fn: FakeNcGetm(variables)
+        self.addCleanup(setattr, getm.getm_nc, 'NcGetm', NcGetm)
+        for c in [getm.Bathymetry, getm.GetmEnvironment, nemo.NemoEnvironment]:
+            self.addCleanup(setattr, c, 'BATHYMETRY', None)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_bathymetry(self):
+        reference = getm.Bathymetry('bathymetry.nc')
+        bathymetry = getm.Bathymetry(self.store_directory)
+        for k in [0, 1]:
+            assert np.array_equal(bathymetry.grids['X'][k], reference.grids['X'][k])
+        assert bathymetry.increment_latitude == bathymetry.increment_longitude == 1
+        for lat, lon in zip(np.linspace(53.5, 55.5, 50), np.linspace(4, 8, 50)):
+            d = bathymetry.get_water_depth(lat, lon)
+            d_reference = reference.get_water_depth(lat, lon)
+            # near land the water depth is masked, as for the netcdf file.
+            assert (d is np.ma.masked) == (d_reference is np.ma.masked)
+            if d is not np.ma.masked:
+                assert np.isclose(d, d_reference)
+        assert bathymetry.get_water_depth(54.15, 5.8) is np.ma.masked
+
+    def test_environments(self):
+        getm.GetmEnvironment.NCBATHYMETRY = self.store_directory
+        getm.GetmEnvironment._GetmEnvironment__setBathymetry(None)
+        d = getm.GetmEnvironment.BATHYMETRY[9:12, 19:21]
+        assert np.array_equal(d.mask, self.bathymetry.mask[9:12, 19:21])
+        assert np.isclose(d.mean(), self.bathymetry[9:12, 19:21].mean())
+        nemo.NemoEnvironment.NCBATHYMETRY = self.store_directory
+        nemo.NemoEnvironment._NemoEnvironment__setBathymetry(None)
+        d = nemo.NemoEnvironment.BATHYMETRY
+        assert d[11, 20] == 0 and d[5, 20] == self.bathymetry[5, 20]
+        assert np.array_equal(d[9:12, 19:21], self.bathymetry[9:12, 19:21].filled(0))
+
+unittest.main()
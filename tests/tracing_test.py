@@ -0,0 +1,30 @@
+import sys; sys.path.insert(0, "..")
+import os
+import tempfile
+import unittest
+
+from glidersim import tracing
+
+class Tracing_test(unittest.TestCase):
+    def write_and_read(self, extension):
+        fn = os.path.join(tempfile.mkdtemp(), f"trace{extension}")
+        tracer = tracing.start(fn, events=['transition', 'command'])
+        tracer.condition(0., 'Yo', 'running') # not selected
+        tracer.transition(1., 'Yo', 'running', 'UnInited', 'Active')
+        tracer.command(2., 'fin', 'c_heading', 0.25)
+        tracing.stop()
+        assert tracing.TRACER is None
+        return tracing.read(fn)
+
+    def test_formats(self):
+        events = self.write_and_read(".trc")
+        assert events == self.write_and_read(".jsonl")
+        assert events == [dict(event='transition', time=1., behavior='Yo', input='running',
+                               state='UnInited', next_state='Active'),
+                          dict(event='command', time=2., actuator='fin', command='c_heading', value=0.25)]
+
+    def test_unknown_event(self):
+        with self.assertRaises(ValueError):
+            tracing.Tracer(None, events=['fsm'])
+
+unittest.main()